@@ -0,0 +1,236 @@
+
+# Level-of-detail for our enemies' animations. Left to itself, Panda
+# poses every visible Actor's joints every frame, whether it's
+# charging the player, standing about, or lying dead. Instead, we
+# take over the posing of our enemies, and each frame decide which
+# of them are worth it:
+#
+#  - "Full": the nearest few moving enemies are posed every frame.
+#  - "Reduced": the rest--along with those standing idle, and the
+#    dying--are posed only every few frames.
+#  - "Frozen": those out of view, or whose deaths have finished
+#    playing, aren't posed at all.
+#
+# On top of that, no more than a set number of joints are posed in
+# a frame; those that don't fit wait for the next, stalest first.
+#
+# Only the posing of the joints is throttled: the animations still
+# play in full--their frames and "isPlaying" follow the clock as
+# usual--so the game's logic never notices.
+
+from panda3d.core import Point3, BoundingSphere
+
+# At most this many enemies are posed every frame
+MAX_FULL_RATE = 12
+# Every how many frames the others are posed
+REDUCED_INTERVAL = 4
+# The most joints posed in a single frame, by all enemies together
+MAX_JOINTS_PER_FRAME = 300
+
+TIER_FULL = 0
+TIER_REDUCED = 1
+TIER_FROZEN = 2
+
+TIER_INTERVALS = {
+    TIER_FULL : 1,
+    TIER_REDUCED : REDUCED_INTERVAL
+}
+
+# A delay long enough that Panda never gets
+# around to posing a character by itself
+NEVER = 1.0e9
+
+
+def countJoints(partGroup):
+    count = 1 if partGroup.isCharacterJoint() else 0
+    for i in range(partGroup.getNumChildren()):
+        count += countJoints(partGroup.getChild(i))
+    return count
+
+
+class AnimatedEnemy():
+    def __init__(self, enemy, numJoints):
+        self.enemy = enemy
+        self.character = enemy.actor.getPart("modelRoot").node()
+        self.numJoints = numJoints
+        self.tier = TIER_FULL
+        # Pose it on the first frame that we can
+        self.framesSinceUpdate = NEVER
+
+
+class AnimationLOD():
+    def __init__(self, evaluate = True, maxFullRate = MAX_FULL_RATE, maxJointsPerFrame = MAX_JOINTS_PER_FRAME):
+        # Without a window, nothing would ever see the poses,
+        # so we can decide who'd be posed, but not pose them
+        self.evaluate = evaluate
+        self.maxFullRate = maxFullRate
+        self.maxJointsPerFrame = maxJointsPerFrame
+
+        # Enemy -> its AnimatedEnemy
+        self.entries = {}
+        # Kind of enemy -> how many joints its characters have
+        self.jointCounts = {}
+
+        # Reused for testing enemies against the view
+        self.viewBounds = None
+        self.sphere = BoundingSphere(Point3(0, 0, 0), 1)
+
+        # Last frame's report: how many enemies were posed at
+        # full rate, at reduced rate (or put off), or not at
+        # all, and how many joints were posed
+        self.numFull = 0
+        self.numPartial = 0
+        self.numNone = 0
+        self.numJoints = 0
+
+        self.numFrames = 0
+        self.totalFull = 0
+        self.totalPartial = 0
+        self.totalNone = 0
+        self.totalJoints = 0
+        self.totalDeferred = 0
+
+    def add(self, enemy):
+        if enemy in self.entries:
+            return
+        numJoints = self.jointCounts.get(type(enemy))
+        if numJoints is None:
+            numJoints = countJoints(enemy.actor.getPartBundle("modelRoot"))
+            self.jointCounts[type(enemy)] = numJoints
+        entry = AnimatedEnemy(enemy, numJoints)
+        self.entries[enemy] = entry
+
+        # Panda's own level-of-detail slows a character's posing
+        # with distance; with a delay this long, it stops it
+        # altogether, leaving the posing to us.
+        entry.character.setLodAnimation(Point3(0, 0, 0), 1, 0, NEVER)
+
+    def remove(self, enemy):
+        entry = self.entries.pop(enemy, None)
+        if entry is not None:
+            entry.character.clearLodAnimation()
+
+    def clear(self):
+        for enemy in list(self.entries):
+            self.remove(enemy)
+
+    def getTier(self, entry, inView):
+        enemy = entry.enemy
+        if not inView:
+            return TIER_FROZEN
+        state = enemy.animations.state
+        if enemy.health <= 0:
+            if state == "die":
+                return TIER_REDUCED
+            return TIER_FROZEN
+        if state == "stand":
+            return TIER_REDUCED
+        return TIER_FULL
+
+    def updateViewBounds(self):
+        # The view-frustum, in the space of "render",
+        # or None if there's no camera to look through
+        if base.cam is None:
+            self.viewBounds = None
+            return
+        viewBounds = base.camLens.makeBounds()
+        viewBounds.xform(base.cam.getMat(render))
+        self.viewBounds = viewBounds
+
+    def isInView(self, entry):
+        if self.viewBounds is None:
+            return True
+        actor = entry.enemy.actor
+        self.sphere.setCenter(actor.getPos(render))
+        self.sphere.setRadius(entry.enemy.colliderRadius*2)
+        return self.viewBounds.contains(self.sphere) != 0
+
+    def update(self, player):
+        # Called once per frame, after the simulation
+        # has left everything where it's to be drawn
+        self.updateViewBounds()
+
+        playerPos = player.actor.getPos()
+        playerX = playerPos.x
+        playerY = playerPos.y
+
+        # Sort our enemies into tiers: the moving enemies
+        # nearest the player are posed at full rate, up to
+        # our limit; the rest drop to the reduced rate.
+        moving = []
+        numNone = 0
+        for entry in self.entries.values():
+            entry.framesSinceUpdate += 1
+            tier = self.getTier(entry, self.isInView(entry))
+            entry.tier = tier
+            if tier == TIER_FULL:
+                actor = entry.enemy.actor
+                offsetX = actor.getX() - playerX
+                offsetY = actor.getY() - playerY
+                moving.append((offsetX*offsetX + offsetY*offsetY, entry))
+            elif tier == TIER_FROZEN:
+                numNone += 1
+
+        if len(moving) > self.maxFullRate:
+            moving.sort(key = lambda distanceAndEntry: distanceAndEntry[0])
+            for distance, entry in moving[self.maxFullRate:]:
+                entry.tier = TIER_REDUCED
+
+        # Pose those that are due, full-rate first, and
+        # then the stalest, until the joint-budget runs out.
+        due = [entry for entry in self.entries.values()
+               if entry.tier != TIER_FROZEN and entry.framesSinceUpdate >= TIER_INTERVALS[entry.tier]]
+        due.sort(key = lambda entry: (entry.tier, -entry.framesSinceUpdate))
+
+        numFull = 0
+        numJoints = 0
+        numDeferred = 0
+        for entry in due:
+            if numJoints + entry.numJoints > self.maxJointsPerFrame:
+                numDeferred += 1
+                continue
+            numJoints += entry.numJoints
+            entry.framesSinceUpdate = 0
+            if self.evaluate:
+                entry.character.forceUpdate()
+            if entry.tier == TIER_FULL:
+                numFull += 1
+
+        self.numFull = numFull
+        self.numNone = numNone
+        self.numPartial = len(self.entries) - numFull - numNone
+        self.numJoints = numJoints
+
+        self.numFrames += 1
+        self.totalFull += numFull
+        self.totalPartial += self.numPartial
+        self.totalNone += numNone
+        self.totalJoints += numJoints
+        self.totalDeferred += numDeferred
+
+    def getReport(self):
+        return {
+            "full" : self.numFull,
+            "partial" : self.numPartial,
+            "none" : self.numNone,
+            "joints" : self.numJoints
+        }
+
+    def resetStats(self):
+        self.numFrames = 0
+        self.totalFull = 0
+        self.totalPartial = 0
+        self.totalNone = 0
+        self.totalJoints = 0
+        self.totalDeferred = 0
+
+    def getStats(self):
+        numFrames = max(1, self.numFrames)
+        return {
+            "frames" : self.numFrames,
+            "fullPerFrame" : self.totalFull/numFrames,
+            "partialPerFrame" : self.totalPartial/numFrames,
+            "nonePerFrame" : self.totalNone/numFrames,
+            "jointsPerFrame" : self.totalJoints/numFrames,
+            "deferred" : self.totalDeferred
+        }
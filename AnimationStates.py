@@ -0,0 +1,109 @@
+
+# A small state-machine for an Actor's animations. Rather than
+# looking each animation up by name, and asking whether it's still
+# playing, every time that we want to know what to play, we look up
+# the Actor's AnimControls once, and keep track ourselves of which is
+# playing and how long it has left to run.
+#
+# Each kind of game-object describes its animations with a table of
+# states (see "GameObject.py"): looping states play until another is
+# requested; the others play once, after which the state-machine is
+# left in no state at all (the Actor holding the last frame), and the
+# state's end-callback, if it has one, is called.
+#
+# Time is counted in simulation-steps ("update"), so these endings
+# arrive at the same point in the simulation however fast the game
+# is drawn.
+
+
+class AnimationState():
+    def __init__(self, animName, loop = False):
+        self.animName = animName
+        self.loop = loop
+
+
+class AnimationStateMachine():
+    def __init__(self, actor, states):
+        # State-name -> its AnimControl, whether it loops, and
+        # how long it lasts. (If the Actor lacks a state's
+        # animation, requesting a looping state does nothing,
+        # and a one-off state ends at once.)
+        self.controls = {}
+        self.loops = {}
+        self.durations = {}
+        for stateName, state in states.items():
+            self.loops[stateName] = state.loop
+            control = actor.getAnimControl(state.animName)
+            if control is not None:
+                self.controls[stateName] = control
+                self.durations[stateName] = control.getNumFrames()/control.getFrameRate()
+
+        # State-name -> called when that state's animation ends
+        self.endCallbacks = {}
+
+        self.state = None
+        self.control = None
+        # How long the current animation has to run,
+        # if it's not looping; otherwise zero
+        self.timeLeft = 0.0
+
+    def setEndCallback(self, stateName, callback):
+        self.endCallbacks[stateName] = callback
+
+    def request(self, stateName):
+        # Play the given state's animation, unless it's a loop
+        # that's already playing. Returns the animation's duration.
+        if stateName == self.state and self.timeLeft <= 0:
+            return 0.0
+
+        control = self.controls.get(stateName)
+        if control is None:
+            if not self.loops.get(stateName, True):
+                self.stop()
+                self.finish(stateName)
+            return 0.0
+
+        if self.control is not None:
+            self.control.stop()
+        self.state = stateName
+        self.control = control
+
+        if self.loops[stateName]:
+            control.loop(True)
+            self.timeLeft = 0.0
+        else:
+            control.play()
+            self.timeLeft = self.durations[stateName]
+        return self.durations[stateName]
+
+    def stop(self):
+        if self.control is not None:
+            self.control.stop()
+        self.state = None
+        self.control = None
+        self.timeLeft = 0.0
+
+    def getTimeLeft(self, stateName):
+        if stateName != self.state:
+            return 0.0
+        return self.timeLeft
+
+    def update(self, dt):
+        # Called once per simulation-step
+        if self.timeLeft <= 0:
+            return
+        self.timeLeft -= dt
+        if self.timeLeft > 0:
+            return
+
+        # The animation has ended: the Actor holds its last
+        # frame, and we hold no state until another is requested
+        finishedState = self.state
+        self.state = None
+        self.timeLeft = 0.0
+        self.finish(finishedState)
+
+    def finish(self, stateName):
+        callback = self.endCallbacks.get(stateName)
+        if callback is not None:
+            callback()
@@ -0,0 +1,235 @@
+
+from direct.actor.Actor import Actor
+from direct.stdpy import threading
+from panda3d.core import NodePath
+
+from BamCache import BamCache
+
+# Every asset that our game-objects and GUI use, so that they
+# can all be loaded once, up-front, rather than on first use.
+
+# Actors: a model, and the animations that go with it
+ACTORS = {
+    "player" : ("Models/PandaChan/act_p3d_chan",
+                {
+                    "stand" : "Models/PandaChan/a_p3d_chan_idle",
+                    "walk" : "Models/PandaChan/a_p3d_chan_run"
+                }),
+    "walkingEnemy" : ("Models/Misc/simpleEnemy",
+                      {
+                          "stand" : "Models/Misc/simpleEnemy-stand",
+                          "walk" : "Models/Misc/simpleEnemy-walk",
+                          "attack" : "Models/Misc/simpleEnemy-attack",
+                          "die" : "Models/Misc/simpleEnemy-die",
+                          "spawn" : "Models/Misc/simpleEnemy-spawn"
+                      }),
+    "trapEnemy" : ("Models/Misc/trap",
+                   {
+                       "stand" : "Models/Misc/trap-stand",
+                       "walk" : "Models/Misc/trap-walk"
+                   })
+}
+
+# Plain, un-animated models
+MODELS = [
+    "Models/Misc/bambooLaser",
+    "Models/Misc/bambooLaserHit",
+    "Models/Misc/playerHit"
+]
+
+# Textures used directly by the GUI (those used by our
+# models are loaded along with the models themselves)
+TEXTURES = [
+    "UI/UIButton.png",
+    "UI/UIButtonPressed.png",
+    "UI/UIButtonHighlighted.png",
+    "UI/UIButtonDisabled.png",
+    "UI/health.png",
+    "UI/stoneFrame.png"
+]
+
+SOUNDS = [
+    "Sounds/UIClick.ogg",
+    "Sounds/enemySpawn.ogg",
+    "Sounds/enemyDie.ogg",
+    "Sounds/enemyAttack.ogg",
+    "Sounds/laserHit.ogg",
+    "Sounds/laserNoHit.ogg",
+    "Sounds/FemaleDmgNoise.ogg",
+    "Sounds/trapHitsSomething.ogg",
+    "Sounds/trapStop.ogg",
+    "Sounds/trapSlide.ogg"
+]
+
+
+class AssetRegistry():
+    # Holds one loaded copy of each of our assets. Game-objects
+    # ask the registry for an instance of what they need--a copy
+    # of an Actor or model, a shared texture, a sound--rather
+    # than calling "loader" themselves.
+    #
+    # The assets can be loaded all at once ("loadAll"), or on a
+    # background-thread ("preload") while the title-menu is up.
+    # Anything asked for before it's been loaded is simply
+    # loaded on the spot--but while the thread is running, only
+    # the title-menu does that. (The game isn't started until
+    # the thread is done, as the two would otherwise be using
+    # "loader", and our dictionaries, at once.)
+    #
+    # Models and animations are loaded from the .bam-cache
+    # (see "BamCache.py"), and textures from the pre-baked
+    # textures (see "TexturePipeline.py"), where there are
+    # current copies.
+    def __init__(self):
+        self.bamCache = BamCache()
+        self.texturePipeline = self.bamCache.texturePipeline
+
+        # Actors that are never shown, but copied
+        self.actorTemplates = {}
+        self.models = {}
+        self.textures = {}
+        # One loaded sound per file, which keeps the
+        # decoded data in the audio-manager's cache
+        self.sounds = {}
+
+        self.jobs = []
+        for actorName in ACTORS:
+            self.jobs.append((self.loadActorFiles, actorName))
+        for modelPath in MODELS:
+            self.jobs.append((self.loadModel, modelPath))
+        for texturePath in TEXTURES:
+            self.jobs.append((self.loadTexture, texturePath))
+        for soundPath in SOUNDS:
+            self.jobs.append((self.loadSound, soundPath))
+
+        self.numJobsDone = 0
+        self.thread = None
+        self.progressCallback = None
+        self.doneCallback = None
+
+    def loadAll(self):
+        # Load everything, right now
+        for job, name in self.jobs:
+            job(name)
+            self.numJobsDone += 1
+        self.buildActorTemplates()
+
+    def preload(self, progressCallback = None, doneCallback = None):
+        # Start loading everything on a background-thread.
+        # "progressCallback" is called with the number of assets
+        # loaded so far and the total, and "doneCallback" once
+        # all are done--both on the main thread, from a task.
+        self.progressCallback = progressCallback
+        self.doneCallback = doneCallback
+
+        self.thread = threading.Thread(target = self.runJobs, name = "assetPreload")
+        self.thread.start()
+
+        taskMgr.add(self.checkPreload, "checkAssetPreload")
+
+    def runJobs(self):
+        for job, name in self.jobs:
+            job(name)
+            self.numJobsDone += 1
+
+    def checkPreload(self, task):
+        numJobsDone = self.numJobsDone
+        if self.progressCallback is not None:
+            self.progressCallback(numJobsDone, len(self.jobs))
+
+        if numJobsDone < len(self.jobs):
+            return task.cont
+
+        self.thread.join()
+        self.thread = None
+
+        # Building the templates touches no files--the
+        # thread has already put them into the model-pool--
+        # so this is quick enough to do on the main thread.
+        self.buildActorTemplates()
+
+        if self.doneCallback is not None:
+            self.doneCallback()
+
+        return task.done
+
+    def loadActorFiles(self, actorName):
+        # Load the model and animation files into the model-pool,
+        # from which the template Actor will later be built.
+        modelPath, anims = self.resolveActor(actorName)
+        loader.loadModel(modelPath)
+        for animPath in anims.values():
+            loader.loadModel(animPath)
+
+    def resolveActor(self, actorName):
+        modelPath, anims = ACTORS[actorName]
+        resolvedAnims = {}
+        for animName, animPath in anims.items():
+            resolvedAnims[animName] = self.bamCache.resolve(animPath)
+        return self.bamCache.resolve(modelPath), resolvedAnims
+
+    def buildActorTemplates(self):
+        for actorName in ACTORS:
+            self.getActorTemplate(actorName)
+
+    def getActorTemplate(self, actorName):
+        template = self.actorTemplates.get(actorName)
+        if template is None:
+            modelPath, anims = self.resolveActor(actorName)
+            template = Actor(modelPath, anims)
+            self.actorTemplates[actorName] = template
+        return template
+
+    def makeActor(self, actorName):
+        # A new Actor that shares its template's geometry
+        # and animations
+        return Actor(other = self.getActorTemplate(actorName))
+
+    def loadModel(self, modelPath):
+        model = self.models.get(modelPath)
+        if model is None:
+            model = loader.loadModel(self.bamCache.resolve(modelPath))
+            self.models[modelPath] = model
+        return model
+
+    def makeModel(self, modelPath):
+        return self.loadModel(modelPath).copyTo(NodePath())
+
+    def loadTexture(self, texturePath):
+        texture = self.textures.get(texturePath)
+        if texture is None:
+            texture = loader.loadTexture(self.texturePipeline.resolve(texturePath))
+            self.textures[texturePath] = texture
+        return texture
+
+    def getTexture(self, texturePath):
+        return self.loadTexture(texturePath)
+
+    def loadSound(self, soundPath):
+        sound = self.sounds.get(soundPath)
+        if sound is None:
+            sound = loader.loadSfx(soundPath)
+            self.sounds[soundPath] = sound
+        return sound
+
+    def makeSound(self, soundPath):
+        # Each caller gets a sound of its own, so that it can
+        # play, stop and loop it independently--but the decoded
+        # data is shared, via the audio-manager's cache.
+        self.loadSound(soundPath)
+        return loader.loadSfx(soundPath)
+
+    def cleanup(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        taskMgr.remove("checkAssetPreload")
+
+        for template in self.actorTemplates.values():
+            template.cleanup()
+            template.removeNode()
+        self.actorTemplates = {}
+
+        for model in self.models.values():
+            model.removeNode()
+        self.models = {}
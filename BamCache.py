@@ -0,0 +1,244 @@
+
+# A cache of our models and animations, converted from text
+# (.egg) to Panda's binary format (.bam). Binary files load far
+# more quickly, since there's nothing to parse.
+#
+#  python BamCache.py            (convert anything new or changed)
+#  python BamCache.py --report   (and compare load-times)
+#  python BamCache.py --clear
+#
+# Each cached file is named for the hash of its source-file's
+# contents and the Panda3D version, so an entry goes stale as
+# soon as either changes. Models use the pre-baked textures made
+# by "TexturePipeline.py", if there are any, and go stale when
+# those change too. Packaged builds don't need this:
+# "build_apps" converts to .bam already.
+
+import hashlib, json, os, shutil, sys, time
+
+from panda3d.core import Filename, LoaderOptions, NodePath, PandaSystem
+from panda3d.core import Loader as PandaLoader, ModelPool, TexturePool
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CACHE_DIR = ".bamcache"
+MANIFEST_NAME = "manifest.json"
+
+# The extensions that a model-path may be missing, in
+# the order that we look for them
+SOURCE_EXTENSIONS = (".egg", ".egg.pz")
+
+
+def findSource(modelPath):
+    for extension in SOURCE_EXTENSIONS:
+        sourcePath = modelPath + extension
+        if os.path.exists(os.path.join(ROOT_DIR, sourcePath)):
+            return sourcePath
+    return None
+
+
+def hashSource(sourcePath):
+    contentHash = hashlib.sha256()
+    with open(os.path.join(ROOT_DIR, sourcePath), "rb") as sourceFile:
+        for block in iter(lambda: sourceFile.read(1 << 20), b""):
+            contentHash.update(block)
+    contentHash.update(PandaSystem.getVersionString().encode("utf-8"))
+    return contentHash.hexdigest()
+
+
+def loadWithoutCache(path):
+    # Load a model straight from disk, bypassing both the
+    # model-pool and Panda's own on-disk cache.
+    options = LoaderOptions(LoaderOptions.LF_search | LoaderOptions.LF_report_errors | LoaderOptions.LF_no_cache)
+    node = PandaLoader.getGlobalPtr().loadSync(Filename(path), options)
+    if node is None:
+        return None
+    return NodePath(node)
+
+
+class BamCache():
+    def __init__(self, cacheDir = CACHE_DIR):
+        # (Imported here, since the texture-pipeline
+        #  uses some of this module's functions.)
+        from TexturePipeline import TexturePipeline
+
+        self.cacheDir = cacheDir
+        self.manifestPath = os.path.join(ROOT_DIR, cacheDir, MANIFEST_NAME)
+
+        self.texturePipeline = TexturePipeline()
+        self.textureKey = self.texturePipeline.getKey()
+
+        # Model-path -> source-file, its size, modification-time,
+        # and hash, the textures used, and the cached file made from it
+        self.manifest = {}
+        if os.path.exists(self.manifestPath):
+            try:
+                with open(self.manifestPath) as manifestFile:
+                    self.manifest = json.load(manifestFile)
+            except ValueError:
+                self.manifest = {}
+
+    def getCurrentHash(self, modelPath, sourcePath):
+        # Re-hashing a big egg-file on every launch would eat
+        # into what we're saving, so trust the recorded hash
+        # if the file's size and modification-time are as recorded.
+        entry = self.manifest.get(modelPath)
+        sourceStat = os.stat(os.path.join(ROOT_DIR, sourcePath))
+        if entry is not None and entry["source"] == sourcePath and \
+                entry["size"] == sourceStat.st_size and entry["mtime"] == sourceStat.st_mtime_ns:
+            return entry["hash"]
+        return hashSource(sourcePath)
+
+    def getCachedPath(self, modelPath):
+        # The cached .bam for a model, or None if it
+        # has none, or if what it has is out of date.
+        entry = self.manifest.get(modelPath)
+        if entry is None:
+            return None
+
+        sourcePath = findSource(modelPath)
+        if sourcePath is None:
+            return None
+
+        if self.getCurrentHash(modelPath, sourcePath) != entry["hash"]:
+            return None
+        if entry.get("textures", "") != self.textureKey:
+            return None
+        if not os.path.exists(os.path.join(ROOT_DIR, entry["bam"])):
+            return None
+
+        return entry["bam"]
+
+    def resolve(self, modelPath):
+        # The path to load a model by: the cached
+        # version, if it's there and current.
+        cachedPath = self.getCachedPath(modelPath)
+        if cachedPath is None:
+            return modelPath
+        return cachedPath
+
+    def build(self, modelPaths):
+        # Convert any model that's new or has changed, and
+        # return the model-paths that were converted.
+        os.makedirs(os.path.join(ROOT_DIR, self.cacheDir), exist_ok = True)
+
+        converted = []
+        for modelPath in modelPaths:
+            sourcePath = findSource(modelPath)
+            if sourcePath is None:
+                print("No source-file found for " + modelPath)
+                continue
+
+            if self.getCachedPath(modelPath) is not None:
+                continue
+
+            sourceHash = hashSource(sourcePath)
+            bamPath = self.cacheDir + "/" + sourceHash + ".bam"
+
+            model = loadWithoutCache(os.path.join(ROOT_DIR, sourcePath))
+            if model is not None:
+                self.texturePipeline.applyTo(model)
+            if model is None or not model.writeBamFile(Filename.fromOsSpecific(os.path.join(ROOT_DIR, bamPath))):
+                print("Couldn't convert " + sourcePath)
+                continue
+
+            oldEntry = self.manifest.pop(modelPath, None)
+            if oldEntry is not None and oldEntry["bam"] != bamPath:
+                self.removeCachedFile(oldEntry["bam"])
+
+            sourceStat = os.stat(os.path.join(ROOT_DIR, sourcePath))
+            self.manifest[modelPath] = {
+                "source" : sourcePath,
+                "size" : sourceStat.st_size,
+                "mtime" : sourceStat.st_mtime_ns,
+                "hash" : sourceHash,
+                "pandaVersion" : PandaSystem.getVersionString(),
+                "textures" : self.textureKey,
+                "bam" : bamPath
+            }
+            converted.append(modelPath)
+
+        with open(self.manifestPath, "w") as manifestFile:
+            json.dump(self.manifest, manifestFile, indent = 2, sort_keys = True)
+
+        return converted
+
+    def removeCachedFile(self, bamPath):
+        # (Identical sources share a cached file, so only
+        #  remove it once nothing else uses it.)
+        for entry in self.manifest.values():
+            if entry["bam"] == bamPath:
+                return
+        fullPath = os.path.join(ROOT_DIR, bamPath)
+        if os.path.exists(fullPath):
+            os.remove(fullPath)
+
+    def clear(self):
+        shutil.rmtree(os.path.join(ROOT_DIR, self.cacheDir), ignore_errors = True)
+        self.manifest = {}
+
+
+def getModelPaths():
+    # Every model and animation that the asset-registry loads
+    from Assets import ACTORS, MODELS
+
+    modelPaths = []
+    for modelPath, anims in ACTORS.values():
+        modelPaths.append(modelPath)
+        modelPaths += list(anims.values())
+    modelPaths += MODELS
+    return modelPaths
+
+
+def timeLoads(paths):
+    totalTime = 0.0
+    for path in paths:
+        # (Textures are released too, so that neither
+        #  load benefits from the other's work.)
+        ModelPool.releaseAllModels()
+        TexturePool.releaseAllTextures()
+        startTime = time.perf_counter()
+        loadWithoutCache(os.path.join(ROOT_DIR, path))
+        totalTime += time.perf_counter() - startTime
+    return totalTime
+
+
+def report(bamCache, modelPaths):
+    # Load everything once from source ("cold") and once
+    # from the cache ("warm"), and compare.
+    print("{0:<40} {1:>10} {2:>10}".format("model", "egg ms", "bam ms"))
+    totalCold = 0.0
+    totalWarm = 0.0
+    for modelPath in modelPaths:
+        sourcePath = findSource(modelPath)
+        cachedPath = bamCache.getCachedPath(modelPath)
+        if sourcePath is None or cachedPath is None:
+            continue
+        coldTime = timeLoads([sourcePath])
+        warmTime = timeLoads([cachedPath])
+        totalCold += coldTime
+        totalWarm += warmTime
+        print("{0:<40} {1:>10.1f} {2:>10.1f}".format(modelPath, coldTime*1000.0, warmTime*1000.0))
+    print("{0:<40} {1:>10.1f} {2:>10.1f}".format("total", totalCold*1000.0, totalWarm*1000.0))
+
+
+def main(args):
+    bamCache = BamCache()
+
+    if "--clear" in args:
+        bamCache.clear()
+        print("Cleared " + CACHE_DIR)
+        return 0
+
+    modelPaths = getModelPaths()
+    converted = bamCache.build(modelPaths)
+    print("Converted {0} of {1} models".format(len(converted), len(modelPaths)))
+
+    if "--report" in args:
+        report(bamCache, modelPaths)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,392 @@
+
+# End-to-end benchmarks: run fixed scenarios in a headless game
+# for a set number of frames, and report how long the frames took.
+#
+#  python Benchmark.py                                  (all scenarios)
+#  python Benchmark.py --scenario walking100 --frames 1200
+#  python Benchmark.py --save-baseline baseline.json
+#  python Benchmark.py --baseline baseline.json --tolerance 0.15
+#  python Benchmark.py --unbatched     (each enemy moves itself, as without NumPy)
+#  python Benchmark.py --scenario replay:replays/session.replay
+#
+# A "replay:"-scenario plays back a recorded session (see "Replay.py")
+# from start to finish, so that real games can be benchmarked, too.
+#
+# Each scenario runs in a process of its own, since a process
+# only gets one "ShowBase"--and so that peak-memory figures
+# don't bleed from one scenario into the next.
+
+import json, math, os, random, subprocess, sys, tempfile, time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from panda3d.core import Vec3
+
+from Input import ScriptedInput, NullInput, emptyKeys
+from Entities import STATE_ALIVE
+import Replay
+
+# The "update"-stages of the game that we time individually
+GAME_STAGES = ("updatePlayer", "updatePlayerQueries", "updateSpawning",
+               "updateSpatialGrid", "updateEnemies", "updateEnemyQueries",
+               "updateTraps", "updateCollisions", "updateDeadEnemies",
+               "updateDifficulty")
+
+# Engine-tasks that we time, and the names that we report them by
+ENGINE_TASKS = {
+    "igLoop" : "render",
+    "ivalLoop" : "intervals",
+    "eventManager" : "events"
+}
+
+DEFAULT_FRAMES = 600
+DEFAULT_WARMUP_FRAMES = 60
+DEFAULT_TOLERANCE = 0.15
+
+# The metrics that we compare against a baseline
+COMPARED_METRICS = ("p50", "p95", "p99", "peakMemoryKb")
+
+# Scenarios named with this, followed by a path, replay a recording
+REPLAY_PREFIX = "replay:"
+
+
+class Scenario():
+    def __init__(self, name, numEnemies = 0, shooting = False, slidingTraps = False):
+        self.name = name
+        # How many walking enemies to keep in the arena
+        self.numEnemies = numEnemies
+        # Whether the player fires the laser constantly
+        self.shooting = shooting
+        # Whether every trap is kept sliding at all times
+        self.slidingTraps = slidingTraps
+
+    def getGameArguments(self, batchedHorde):
+        # What to build the game with
+        return {
+            "headless" : True,
+            "inputSource" : self.makeInput(),
+            "batchedHorde" : batchedHorde
+        }
+
+    def getNumFrames(self, numFrames, numWarmupFrames):
+        # How many frames to time
+        return numFrames
+
+    def makeInput(self):
+        if not self.shooting:
+            return NullInput()
+
+        def sweepLaser(frame, player):
+            # Hold down "shoot", and sweep the aim around
+            # the player, so that the beam crosses the horde.
+            keys = emptyKeys()
+            keys["shoot"] = True
+            angle = frame*0.05
+            aimPoint = player.actor.getPos() + Vec3(math.cos(angle), math.sin(angle), 0)*5
+            return keys, aimPoint
+
+        return ScriptedInput(sweepLaser)
+
+    def setup(self, game):
+        game.startGame()
+
+        # The player shouldn't die partway through a benchmark
+        game.player.maxHealth = 1000000000
+        game.player.health = game.player.maxHealth
+
+        # Hold the horde at a fixed size: fill it now, and
+        # replace the fallen straight away.
+        game.maxEnemies = self.numEnemies
+        game.maximumMaxEnemies = self.numEnemies
+        game.spawnInterval = game.minimumSpawnInterval
+        game.enemyPool.resize(max(self.numEnemies, game.enemyPool.size))
+        for i in range(self.numEnemies):
+            game.spawnEnemy()
+
+    def beforeFrame(self, game):
+        if self.slidingTraps:
+            # Send any trap that has come to a halt (that is,
+            # that's in play but not "moving") back across the arena.
+            from GameObject import TrapEnemy
+            for trap in game.entities.query(TrapEnemy, STATE_ALIVE):
+                if trap.moveInX:
+                    position = trap.actor.getX()
+                else:
+                    position = trap.actor.getY()
+                trap.startMoving(-math.copysign(1, position))
+
+
+class ReplayScenario(Scenario):
+    # A recorded session, played back in full: however many
+    # frames it lasted, with the horde as it was recorded
+    # (whatever "--unbatched" says), so that it plays out
+    # just as it did.
+    def __init__(self, path):
+        Scenario.__init__(self, REPLAY_PREFIX + path)
+        self.recording = Replay.loadRecording(path)
+
+    def getGameArguments(self, batchedHorde):
+        return {
+            "headless" : True,
+            "inputSource" : Replay.ReplayInput(self.recording),
+            "batchedHorde" : self.recording.batchedHorde,
+            "simulationRate" : self.recording.simulationRate
+        }
+
+    def getNumFrames(self, numFrames, numWarmupFrames):
+        return max(1, self.recording.numSteps - numWarmupFrames)
+
+    def setup(self, game):
+        game.startGame(seed = self.recording.seed)
+
+    def beforeFrame(self, game):
+        pass
+
+
+SCENARIOS = [
+    Scenario("idle"),
+    Scenario("walking20", numEnemies = 20),
+    Scenario("walking100", numEnemies = 100),
+    Scenario("walking500", numEnemies = 500),
+    Scenario("laser", numEnemies = 20, shooting = True),
+    Scenario("trapsSliding", slidingTraps = True)
+]
+
+SCENARIOS_BY_NAME = dict((scenario.name, scenario) for scenario in SCENARIOS)
+
+
+def getScenario(name):
+    # A named scenario, or a "replay:"-scenario for a
+    # recording; None if there's no such scenario
+    if name.startswith(REPLAY_PREFIX):
+        return ReplayScenario(name[len(REPLAY_PREFIX):])
+    return SCENARIOS_BY_NAME.get(name)
+
+
+def percentile(sortedValues, fraction):
+    # Nearest-rank percentile of an already-sorted list
+    if len(sortedValues) == 0:
+        return 0.0
+    index = int(math.ceil(fraction*len(sortedValues))) - 1
+    return sortedValues[max(0, min(index, len(sortedValues) - 1))]
+
+
+def peakMemoryKb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes; Linux reports kilobytes
+    if sys.platform == "darwin":
+        peak //= 1024
+    return peak
+
+
+def timeStages(game, stageTimes):
+    # Replace each of the game's update-stages with a version
+    # that adds its running-time into "stageTimes".
+    for stageName in GAME_STAGES:
+        stageTimes[stageName] = 0.0
+        stage = getattr(game, stageName)
+
+        def timedStage(*args, stage = stage, stageName = stageName):
+            startTime = time.perf_counter()
+            stage(*args)
+            stageTimes[stageName] += time.perf_counter() - startTime
+
+        setattr(game, stageName, timedStage)
+
+
+def runScenario(scenario, numFrames, numWarmupFrames, batchedHorde = True):
+    # Only import the game here, in the child-process,
+    # so that the parent never opens a "ShowBase" of its own.
+    from Game import Game
+
+    random.seed(0)
+
+    game = Game(**scenario.getGameArguments(batchedHorde))
+    scenario.setup(game)
+    numFrames = scenario.getNumFrames(numFrames, numWarmupFrames)
+
+    stageTimes = {}
+    timeStages(game, stageTimes)
+
+    engineTasks = {}
+    for taskName, reportName in ENGINE_TASKS.items():
+        tasks = game.taskMgr.getTasksNamed(taskName)
+        if len(tasks) > 0:
+            engineTasks[reportName] = tasks[0]
+    engineTimes = dict.fromkeys(engineTasks, 0.0)
+
+    frameTimes = []
+    for frame in range(numWarmupFrames + numFrames):
+        if frame == numWarmupFrames:
+            # Don't count the warm-up in the stage-times
+            for stageName in stageTimes:
+                stageTimes[stageName] = 0.0
+            game.collisionPasses.resetStats()
+            game.collisionDispatcher.resetStats()
+            game.animationLod.resetStats()
+
+        scenario.beforeFrame(game)
+
+        startTime = time.perf_counter()
+        game.taskMgr.step()
+        frameTime = time.perf_counter() - startTime
+
+        if frame >= numWarmupFrames:
+            frameTimes.append(frameTime)
+            for reportName, task in engineTasks.items():
+                engineTimes[reportName] += task.getDt()
+
+    numEnemies = len(game.enemies)
+
+    frameTimes.sort()
+
+    subsystems = {}
+    for stageName, totalTime in stageTimes.items():
+        subsystems[stageName] = totalTime*1000.0/numFrames
+    for reportName, totalTime in engineTimes.items():
+        subsystems[reportName] = totalTime*1000.0/numFrames
+
+    result = {
+        "scenario" : scenario.name,
+        "batchedHorde" : game.horde is not None,
+        "frames" : numFrames,
+        "enemiesAtEnd" : numEnemies,
+        "meanMs" : sum(frameTimes)*1000.0/numFrames,
+        "p50" : percentile(frameTimes, 0.50)*1000.0,
+        "p95" : percentile(frameTimes, 0.95)*1000.0,
+        "p99" : percentile(frameTimes, 0.99)*1000.0,
+        "maxMs" : frameTimes[-1]*1000.0,
+        "subsystemMsPerFrame" : subsystems,
+        "collisionPasses" : game.collisionPasses.getStats(),
+        "collisionDispatch" : game.collisionDispatcher.getStats(),
+        "animationLod" : game.animationLod.getStats(),
+        "peakMemoryKb" : peakMemoryKb(),
+        "enemyPool" : game.enemyPool.getStats(),
+        "sounds" : game.sounds.getStats()
+    }
+
+    game.cleanup()
+
+    return result
+
+
+def runScenarioInChild(scenarioName, numFrames, numWarmupFrames, batchedHorde = True):
+    # Run a single scenario in a fresh Python-process, and
+    # collect its results from a temporary file.
+    handle, resultPath = tempfile.mkstemp(suffix = ".json")
+    os.close(handle)
+    try:
+        command = [sys.executable, os.path.abspath(__file__),
+                   "--run-scenario", scenarioName,
+                   "--frames", str(numFrames),
+                   "--warmup", str(numWarmupFrames),
+                   "--result-file", resultPath]
+        if not batchedHorde:
+            command.append("--unbatched")
+        subprocess.check_call(command, cwd = os.path.dirname(os.path.abspath(__file__)))
+        with open(resultPath) as resultFile:
+            return json.load(resultFile)
+    finally:
+        os.remove(resultPath)
+
+
+def compareToBaseline(results, baseline, tolerance):
+    # Returns the lines of a report, and whether
+    # anything got slower (or bigger) than allowed.
+    lines = []
+    regressed = False
+
+    header = "{0:<14} {1:<13} {2:>12} {3:>12} {4:>9}  {5}".format("scenario", "metric", "baseline", "current", "change", "")
+    lines.append(header)
+    lines.append("-"*len(header))
+
+    for scenarioName, result in results.items():
+        if scenarioName not in baseline:
+            lines.append("{0:<14} (not in baseline)".format(scenarioName))
+            continue
+        for metric in COMPARED_METRICS:
+            old = baseline[scenarioName].get(metric)
+            new = result.get(metric)
+            if old is None or new is None or old <= 0:
+                continue
+            change = (new - old)/old
+            status = ""
+            if change > tolerance:
+                status = "REGRESSION"
+                regressed = True
+            lines.append("{0:<14} {1:<13} {2:>12.3f} {3:>12.3f} {4:>+8.1f}%  {5}".format(scenarioName, metric, old, new, change*100.0, status))
+
+    return lines, regressed
+
+
+def getArgument(args, name, default):
+    if name in args:
+        return args[args.index(name) + 1]
+    return default
+
+
+def main(args):
+    numFrames = int(getArgument(args, "--frames", DEFAULT_FRAMES))
+    numWarmupFrames = int(getArgument(args, "--warmup", DEFAULT_WARMUP_FRAMES))
+
+    if "--run-scenario" in args:
+        # We're the child-process for a single scenario
+        scenario = getScenario(getArgument(args, "--run-scenario", None))
+        result = runScenario(scenario, numFrames, numWarmupFrames, "--unbatched" not in args)
+        with open(getArgument(args, "--result-file", None), "w") as resultFile:
+            json.dump(result, resultFile)
+        return 0
+
+    scenarioName = getArgument(args, "--scenario", None)
+    if scenarioName is not None:
+        if scenarioName.startswith(REPLAY_PREFIX):
+            # (Checked here, rather than in the child-process)
+            Replay.loadRecording(scenarioName[len(REPLAY_PREFIX):])
+        elif scenarioName not in SCENARIOS_BY_NAME:
+            print("Unknown scenario: " + scenarioName + " (choose from " + ", ".join(SCENARIOS_BY_NAME) + ")")
+            return 2
+        scenarioNames = [scenarioName]
+    else:
+        scenarioNames = [scenario.name for scenario in SCENARIOS]
+
+    results = {}
+    for name in scenarioNames:
+        results[name] = runScenarioInChild(name, numFrames, numWarmupFrames, "--unbatched" not in args)
+
+    report = json.dumps(results, indent = 2, sort_keys = True)
+    outputPath = getArgument(args, "--output", None)
+    if outputPath is not None:
+        with open(outputPath, "w") as outputFile:
+            outputFile.write(report)
+    print(report)
+
+    baselinePath = getArgument(args, "--save-baseline", None)
+    if baselinePath is not None:
+        with open(baselinePath, "w") as baselineFile:
+            baselineFile.write(report)
+        print("Saved baseline to " + baselinePath)
+
+    baselinePath = getArgument(args, "--baseline", None)
+    if baselinePath is not None:
+        with open(baselinePath) as baselineFile:
+            baseline = json.load(baselineFile)
+        tolerance = float(getArgument(args, "--tolerance", DEFAULT_TOLERANCE))
+
+        lines, regressed = compareToBaseline(results, baseline, tolerance)
+        print()
+        print("\n".join(lines))
+        if regressed:
+            print()
+            print("Slower than the baseline by more than {0:.0f}%!".format(tolerance*100.0))
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
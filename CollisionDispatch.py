@@ -0,0 +1,159 @@
+
+# Hands collisions straight to their handlers. Rather than the
+# pusher naming an event for each pair of colliders ("trapEnemy-
+# into-wall", and so on) and the messenger looking up who's
+# listening, every collision is thrown under a single event-name,
+# which we pick out of the event-queue ourselves (leaving any other
+# events there for the event-manager). We then look up
+# the handler by the pair of collider-types (the names of their
+# collision-nodes), find the game-objects that own the colliders
+# (in the game's registry--see "Entities.py"), and call the handler
+# with those.
+#
+# By default, collisions are held until "deliver" is called--once
+# per simulation-step--and a pair that collides more than once in
+# that time (such as a trap touching two of a wall's tubes) is
+# only delivered once.
+
+import time
+
+from panda3d.core import EventQueue
+
+# The one event-name that the pusher throws collisions under
+COLLISION_EVENT = "collision-into"
+
+
+class HandlerStats():
+    def __init__(self):
+        self.numCalls = 0
+        self.totalTime = 0.0
+
+
+class CollisionDispatcher():
+    def __init__(self, entities, batched = True):
+        # The pusher can only throw its events into the global
+        # queue, along with the keys, the mouse and the GUI
+        self.eventQueue = EventQueue.getGlobalEventQueue()
+
+        # Events that aren't collisions, held while we look
+        # through the queue
+        self.otherEvents = []
+
+        # Who owns which collider
+        self.entities = entities
+
+        self.batched = batched
+
+        # (From-type, into-type) -> handler
+        self.handlers = {}
+        self.handlerStats = {}
+
+        # (From-collider, into-collider) -> the owners and
+        # handler, for collisions not yet delivered
+        self.pending = {}
+
+        self.numCollisions = 0
+        self.numDuplicates = 0
+        self.numUnhandled = 0
+
+    def addHandler(self, fromType, intoType, handler):
+        # "handler" is called with the object that owns the
+        # "from"-collider, the one that owns the "into"-collider
+        # (or None, for things like walls), and the entry.
+        self.handlers[(fromType, intoType)] = handler
+        self.handlerStats[(fromType, intoType)] = HandlerStats()
+
+    def collectCollisions(self):
+        # Take the collisions out of the event-queue, and
+        # collect them (or handle them at once, if we're not
+        # batching them). Everything else--a key-press, say, or
+        # a button-click--is put back, in the same order, for
+        # the event-manager to handle at its usual point in the
+        # frame, rather than in the middle of a simulation-step.
+        #
+        # Returns the number of collisions taken.
+        eventQueue = self.eventQueue
+        otherEvents = self.otherEvents
+        numTaken = 0
+        while not eventQueue.isQueueEmpty():
+            event = eventQueue.dequeueEvent()
+            if event.name == COLLISION_EVENT:
+                self.collect(event.getParameter(0).getPtr())
+                numTaken += 1
+            else:
+                otherEvents.append(event)
+
+        if len(otherEvents) > 0:
+            for event in otherEvents:
+                eventQueue.queueEvent(event)
+            otherEvents.clear()
+
+        return numTaken
+
+    def collect(self, entry):
+        self.numCollisions += 1
+
+        fromNodePath = entry.getFromNodePath()
+        intoNodePath = entry.getIntoNodePath()
+        pairType = (fromNodePath.getName(), intoNodePath.getName())
+        handler = self.handlers.get(pairType)
+        if handler is None:
+            self.numUnhandled += 1
+            return
+
+        key = (fromNodePath, intoNodePath)
+        if key in self.pending:
+            self.numDuplicates += 1
+            return
+
+        collision = (pairType, handler,
+                     self.entities.getByCollider(fromNodePath),
+                     self.entities.getByCollider(intoNodePath),
+                     entry)
+        if self.batched:
+            self.pending[key] = collision
+        else:
+            self.call(collision)
+
+    def deliver(self):
+        # Call the handlers for everything collected
+        # since the last delivery
+        if len(self.pending) == 0:
+            return
+        pending = self.pending
+        self.pending = {}
+        for collision in pending.values():
+            self.call(collision)
+
+    def call(self, collision):
+        pairType, handler, fromOwner, intoOwner, entry = collision
+        startTime = time.perf_counter()
+        handler(fromOwner, intoOwner, entry)
+        stats = self.handlerStats[pairType]
+        stats.totalTime += time.perf_counter() - startTime
+        stats.numCalls += 1
+
+    def clear(self):
+        self.pending = {}
+
+    def resetStats(self):
+        self.numCollisions = 0
+        self.numDuplicates = 0
+        self.numUnhandled = 0
+        for stats in self.handlerStats.values():
+            stats.numCalls = 0
+            stats.totalTime = 0.0
+
+    def getStats(self):
+        handlers = {}
+        for (fromType, intoType), stats in self.handlerStats.items():
+            handlers[fromType + "-into-" + intoType] = {
+                "calls" : stats.numCalls,
+                "totalMs" : stats.totalTime*1000.0
+            }
+        return {
+            "collisions" : self.numCollisions,
+            "duplicates" : self.numDuplicates,
+            "unhandled" : self.numUnhandled,
+            "handlers" : handlers
+        }
@@ -0,0 +1,109 @@
+
+# Our collision-work, split into named passes: pushing things apart,
+# the player's queries (the laser), and the enemies' queries (their
+# attacks). Each pass runs on a schedule of its own--every so many
+# simulation-steps--and is skipped when there's nothing for it to do,
+# and each keeps count of how long it takes and how many pairs of
+# things it tests (or finds touching).
+
+import time
+
+
+class CollisionPass():
+    def __init__(self, name, run, interval = 1, isNeeded = None):
+        self.name = name
+        # Called with the time that the pass covers (which is more
+        # than one step, if the pass doesn't run every step);
+        # returns the number of pairs that it tested (or, for
+        # the pusher, the number that it found touching)
+        self.run = run
+        # Run every this-many steps
+        self.interval = interval
+        # If given, the pass is skipped whenever this returns False
+        self.isNeeded = isNeeded
+
+        self.enabled = True
+        self.stepsUntilDue = 0
+
+        self.numRuns = 0
+        self.numSkipped = 0
+        self.totalTime = 0.0
+        self.lastTime = 0.0
+        self.totalPairs = 0
+        self.lastPairs = 0
+
+    def update(self, dt):
+        # Called once per simulation-step; runs the
+        # pass if it's due, and returns whether it ran.
+        self.stepsUntilDue -= 1
+        if self.stepsUntilDue > 0:
+            return False
+        self.stepsUntilDue = self.interval
+
+        if not self.enabled or (self.isNeeded is not None and not self.isNeeded()):
+            self.numSkipped += 1
+            self.lastTime = 0.0
+            self.lastPairs = 0
+            return False
+
+        startTime = time.perf_counter()
+        numPairs = self.run(dt*self.interval)
+        self.lastTime = time.perf_counter() - startTime
+        self.lastPairs = numPairs
+
+        self.numRuns += 1
+        self.totalTime += self.lastTime
+        self.totalPairs += numPairs
+        return True
+
+    def resetStats(self):
+        self.numRuns = 0
+        self.numSkipped = 0
+        self.totalTime = 0.0
+        self.totalPairs = 0
+
+    def getStats(self):
+        msPerRun = 0.0
+        pairsPerRun = 0.0
+        if self.numRuns > 0:
+            msPerRun = self.totalTime*1000.0/self.numRuns
+            pairsPerRun = self.totalPairs/self.numRuns
+        return {
+            "interval" : self.interval,
+            "runs" : self.numRuns,
+            "skipped" : self.numSkipped,
+            "totalMs" : self.totalTime*1000.0,
+            "msPerRun" : msPerRun,
+            "pairs" : self.totalPairs,
+            "pairsPerRun" : pairsPerRun
+        }
+
+
+class CollisionPasses():
+    def __init__(self):
+        self.passes = {}
+
+    def addPass(self, collisionPass):
+        self.passes[collisionPass.name] = collisionPass
+        return collisionPass
+
+    def getPass(self, name):
+        return self.passes[name]
+
+    def update(self, name, dt):
+        return self.passes[name].update(dt)
+
+    def setInterval(self, name, interval):
+        collisionPass = self.passes[name]
+        collisionPass.interval = max(1, interval)
+        collisionPass.stepsUntilDue = 0
+
+    def setEnabled(self, name, enabled):
+        self.passes[name].enabled = enabled
+
+    def resetStats(self):
+        for collisionPass in self.passes.values():
+            collisionPass.resetStats()
+
+    def getStats(self):
+        return dict((name, collisionPass.getStats()) for name, collisionPass in self.passes.items())
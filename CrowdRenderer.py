@@ -0,0 +1,500 @@
+
+# Instanced, GPU-skinned drawing for the walking horde. Normally,
+# each walking enemy is an Actor of its own: its own copy of the
+# vertex-data, skinned on the CPU every frame, and drawn with draw-
+# calls of its own--so the cost of drawing them grows with every
+# enemy. The crowd-renderer instead draws them all at once, from
+# one shared copy of the geometry:
+#
+#  - Every frame of every animation is "baked" ahead of time into
+#    a buffer-texture of joint-matrices.
+#  - Each enemy's position, heading, animation-frame and colour
+#    are written, once per frame, into a buffer-texture.
+#  - A shader skins each vertex by its joints' matrices for its
+#    enemy's frame, and places it--and the whole crowd is drawn
+#    as instances of the one model: one draw-call per Geom.
+#
+# The enemies keep their Actors--for their colliders, and for their
+# animation-controls, which we read the frames from--but their own
+# geometry is hidden, and so is neither skinned nor drawn.
+#
+# This needs NumPy, and a graphics-card (or driver, such as Mesa's
+# software-renderer) with GLSL, instancing and buffer-textures; see
+# "isSupported".
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from direct.actor.Actor import Actor
+from panda3d.core import GeomVertexFormat, GeomVertexArrayFormat, GeomVertexData
+from panda3d.core import GeomVertexReader, GeomVertexWriter, GeomEnums, GeomNode
+from panda3d.core import InternalName, Texture, Shader
+from panda3d.core import NodePath, OmniBoundingVolume, Mat4
+
+# The most joints that may move any one vertex
+MAX_JOINTS_PER_VERTEX = 4
+
+# The texels that each instance's data takes up
+# in the buffer-texture: placement, frame and colour
+TEXELS_PER_INSTANCE = 3
+
+INITIAL_CAPACITY = 64
+
+# The shaders' source, as pieces: each shader is put together from
+# its pieces by "makeShader", along with some "#define"s:
+#  NUM_JOINTS_PER_VERTEX: the most joints that any vertex of the
+#    model is actually moved by
+#  PER_PIXEL_LIGHTING: whether to light each pixel (with the normal-
+#    map), or just each vertex, as the fixed-function pipeline does
+LIGHTING_FUNCTION = """
+uniform struct {
+    vec4 ambient;
+    vec4 diffuse;
+    vec3 specular;
+    float shininess;
+} p3d_Material;
+
+uniform struct {
+    vec4 ambient;
+} p3d_LightModel;
+
+uniform struct {
+    vec4 color;
+    vec4 position;
+    vec3 attenuation;
+} p3d_LightSource[4];
+
+// The diffuse light falling on a point, facing along "normal";
+// the specular light is put into "specular"
+vec3 light(vec3 viewPos, vec3 normal, out vec3 specular) {
+    vec3 toEye = normalize(-viewPos);
+    vec3 diffuse = p3d_LightModel.ambient.rgb*p3d_Material.ambient.rgb;
+    specular = vec3(0.0);
+    for (int i = 0; i < 4; ++i) {
+        // The slots that no light fills are black
+        if (p3d_LightSource[i].color.rgb == vec3(0.0)) {
+            continue;
+        }
+
+        // Directional lights have a "w" of zero, and
+        // point-lights one; the former don't fade
+        vec3 toLight = p3d_LightSource[i].position.xyz - viewPos*p3d_LightSource[i].position.w;
+        float distance = length(toLight);
+        toLight /= distance;
+        vec3 attenuation = p3d_LightSource[i].attenuation;
+        float fade = 1.0;
+        if (p3d_LightSource[i].position.w != 0.0) {
+            fade = 1.0/(attenuation.x + attenuation.y*distance + attenuation.z*distance*distance);
+        }
+        vec3 lightColor = p3d_LightSource[i].color.rgb*fade;
+
+        diffuse += lightColor*p3d_Material.diffuse.rgb*max(dot(normal, toLight), 0.0);
+        vec3 halfway = normalize(toLight + toEye);
+        specular += lightColor*p3d_Material.specular*pow(max(dot(normal, halfway), 0.0), p3d_Material.shininess);
+    }
+    return diffuse;
+}
+"""
+
+VERTEX_SHADER = """
+uniform mat4 p3d_ViewProjectionMatrix;
+uniform mat4 p3d_ViewMatrix;
+
+// Each instance's position and heading, the row of its
+// animation-frame, and its colour, in three texels
+uniform samplerBuffer instanceData;
+// The joints' matrices: three texels (columns) per joint,
+// for each frame of every animation in turn
+uniform samplerBuffer jointMatrices;
+uniform int numJoints;
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+in vec3 p3d_Tangent;
+in vec3 p3d_Binormal;
+in vec2 p3d_MultiTexCoord0;
+in vec4 jointIndices;
+in vec4 jointWeights;
+
+out vec2 texCoord;
+out vec4 instanceColor;
+#ifdef PER_PIXEL_LIGHTING
+out vec3 viewPos;
+out vec3 viewNormal;
+out vec3 viewTangent;
+out vec3 viewBinormal;
+#else
+out vec3 diffuseLight;
+out vec3 specularLight;
+#endif
+
+void main() {
+    int texel = gl_InstanceID*3;
+    vec4 placement = texelFetch(instanceData, texel);
+    int frameRow = int(texelFetch(instanceData, texel + 1).x);
+    instanceColor = texelFetch(instanceData, texel + 2);
+
+    // Skin the vertex by its joints, as posed in this frame
+    vec4 vertex = vec4(0.0);
+    vec3 normal = vec3(0.0);
+    vec3 tangent = vec3(0.0);
+    vec3 binormal = vec3(0.0);
+    for (int i = 0; i < NUM_JOINTS_PER_VERTEX; ++i) {
+        float weight = jointWeights[i];
+        if (weight > 0.0) {
+            int jointTexel = (frameRow*numJoints + int(jointIndices[i]))*3;
+            mat4 joint = mat4(texelFetch(jointMatrices, jointTexel),
+                              texelFetch(jointMatrices, jointTexel + 1),
+                              texelFetch(jointMatrices, jointTexel + 2),
+                              vec4(0.0, 0.0, 0.0, 1.0));
+            vertex += (p3d_Vertex*joint)*weight;
+            normal += (vec4(p3d_Normal, 0.0)*joint).xyz*weight;
+            tangent += (vec4(p3d_Tangent, 0.0)*joint).xyz*weight;
+            binormal += (vec4(p3d_Binormal, 0.0)*joint).xyz*weight;
+        }
+    }
+
+    // Then turn it to the instance's heading, and move it into place
+    float c = cos(placement.w);
+    float s = sin(placement.w);
+    mat3 rotation = mat3(c, s, 0.0,
+                         -s, c, 0.0,
+                         0.0, 0.0, 1.0);
+    vec4 worldPos = vec4(rotation*vertex.xyz + placement.xyz, 1.0);
+
+    gl_Position = p3d_ViewProjectionMatrix*worldPos;
+    texCoord = p3d_MultiTexCoord0;
+
+#ifdef PER_PIXEL_LIGHTING
+    viewPos = (p3d_ViewMatrix*worldPos).xyz;
+    viewNormal = mat3(p3d_ViewMatrix)*(rotation*normal);
+    viewTangent = mat3(p3d_ViewMatrix)*(rotation*tangent);
+    viewBinormal = mat3(p3d_ViewMatrix)*(rotation*binormal);
+#else
+    diffuseLight = light((p3d_ViewMatrix*worldPos).xyz,
+                         normalize(mat3(p3d_ViewMatrix)*(rotation*normal)),
+                         specularLight);
+#endif
+}
+"""
+
+FRAGMENT_SHADER = """
+uniform sampler2D p3d_Texture0;
+uniform sampler2D p3d_Texture1;
+uniform vec4 p3d_ColorScale;
+
+in vec2 texCoord;
+in vec4 instanceColor;
+#ifdef PER_PIXEL_LIGHTING
+in vec3 viewPos;
+in vec3 viewNormal;
+in vec3 viewTangent;
+in vec3 viewBinormal;
+#else
+in vec3 diffuseLight;
+in vec3 specularLight;
+#endif
+
+out vec4 fragColor;
+
+void main() {
+    vec4 texColor = texture(p3d_Texture0, texCoord);
+
+#ifdef PER_PIXEL_LIGHTING
+    // Bend the normal by the normal-map
+    vec3 mapNormal = texture(p3d_Texture1, texCoord).xyz*2.0 - 1.0;
+    vec3 normal = normalize(viewTangent*mapNormal.x + viewBinormal*mapNormal.y + viewNormal*mapNormal.z);
+    vec3 specularLight;
+    vec3 diffuseLight = light(viewPos, normal, specularLight);
+#endif
+
+    fragColor = vec4(texColor.rgb*diffuseLight + specularLight, texColor.a)*instanceColor*p3d_ColorScale;
+}
+"""
+
+# Renderers that run on the CPU, such as Mesa's; on these, the
+# crowd is lit per-vertex, which is all that the rest of the
+# scene gets there (they don't run the shader-generator's shaders).
+SOFTWARE_RENDERERS = ("llvmpipe", "softpipe", "swrast")
+
+
+def isSupported(gsg):
+    # Whether the crowd can be drawn with the given graphics-
+    # state-guardian (that is, on the given window's card)
+    return (numpy is not None and gsg is not None and gsg.getSupportsGlsl() and
+            gsg.getSupportsGeometryInstancing() and gsg.getSupportsBufferTexture())
+
+
+def isSoftwareRenderer(gsg):
+    renderer = gsg.getDriverRenderer().lower()
+    return any(name in renderer for name in SOFTWARE_RENDERERS)
+
+
+class CrowdRenderer():
+    # Much like the horde (see "Horde.py"), enemies are kept in
+    # slots, which are filled in order, and emptied by moving the
+    # last enemy into the emptied slot; each enemy's slot is its
+    # "crowdIndex", and is also its instance's index.
+    def __init__(self, template, perPixelLighting = True, capacity = INITIAL_CAPACITY):
+        # "template" is an Actor of the model to be drawn, with
+        # all of its animations; it's left as it was found.
+        self.perPixelLighting = perPixelLighting
+
+        self.enemies = []
+        self.size = 0
+        self.capacity = 0
+
+        # Bound methods for each enemy's Actor, as in the horde
+        self.xGetters = []
+        self.yGetters = []
+        self.zGetters = []
+        self.hGetters = []
+        # Each enemy's animation-controls, and the one
+        # that it was last seen playing
+        self.animControls = []
+        self.currentAnims = []
+
+        self.colorScales = None
+        self.instanceTexture = None
+
+        self.root = NodePath("crowd")
+        # The shared geometry is drawn wherever the enemies are,
+        # so there's no point in culling it as a whole.
+        self.root.node().setBounds(OmniBoundingVolume())
+        self.root.node().setFinal(True)
+
+        bakingActor = Actor(other = template)
+        self.jointIndices = {}
+        self.numJointsPerVertex = 1
+        self.buildGeometry(bakingActor)
+        self.bakeAnimations(bakingActor)
+        bakingActor.cleanup()
+        bakingActor.removeNode()
+
+        self.root.setShader(self.makeShader())
+        self.root.setShaderInput("jointMatrices", self.jointTexture)
+        self.root.setShaderInput("numJoints", self.numJoints)
+
+        self.grow(capacity)
+        self.root.hide()
+
+    def buildGeometry(self, actor):
+        # Copy each of the Actor's Geoms, with the same vertices--
+        # positions, normals and so on--but, in place of the
+        # references into the Actor's blend-table, the indices
+        # and weights of the joints that move each vertex.
+        jointFormat = GeomVertexArrayFormat()
+        jointFormat.addColumn(InternalName.make("jointIndices"), MAX_JOINTS_PER_VERTEX,
+                              GeomEnums.NT_float32, GeomEnums.C_other)
+        jointFormat.addColumn(InternalName.make("jointWeights"), MAX_JOINTS_PER_VERTEX,
+                              GeomEnums.NT_float32, GeomEnums.C_other)
+
+        for geomNodePath in actor.findAllMatches("**/+GeomNode"):
+            geomNode = geomNodePath.node()
+            crowdNode = GeomNode(geomNode.getName())
+            for geomIndex in range(geomNode.getNumGeoms()):
+                geom = geomNode.getGeom(geomIndex)
+                vertexData = geom.getVertexData()
+                blendTable = vertexData.getTransformBlendTable()
+
+                # The first array holds the vertices themselves,
+                # which we share, unchanged
+                vertexFormat = GeomVertexFormat()
+                vertexFormat.addArray(vertexData.getFormat().getArray(0))
+                vertexFormat.addArray(jointFormat)
+                vertexFormat = GeomVertexFormat.registerFormat(vertexFormat)
+
+                crowdData = GeomVertexData(vertexData.getName(), vertexFormat, GeomEnums.UH_static)
+                crowdData.setNumRows(vertexData.getNumRows())
+                crowdData.setArray(0, vertexData.getArray(0))
+
+                blendReader = GeomVertexReader(vertexData, "transform_blend")
+                indexWriter = GeomVertexWriter(crowdData, "jointIndices")
+                weightWriter = GeomVertexWriter(crowdData, "jointWeights")
+                while not blendReader.isAtEnd():
+                    blend = blendTable.getBlend(blendReader.getData1i())
+                    indices = [0]*MAX_JOINTS_PER_VERTEX
+                    weights = [0.0]*MAX_JOINTS_PER_VERTEX
+                    if blend.getNumTransforms() == 0:
+                        # Moved by no joints at all
+                        indices[0] = self.getJointIndex(None)
+                        weights[0] = 1.0
+                    numTransforms = min(blend.getNumTransforms(), MAX_JOINTS_PER_VERTEX)
+                    self.numJointsPerVertex = max(self.numJointsPerVertex, numTransforms)
+                    for i in range(numTransforms):
+                        indices[i] = self.getJointIndex(blend.getTransform(i))
+                        weights[i] = blend.getWeight(i)
+                    indexWriter.addData4f(*indices)
+                    weightWriter.addData4f(*weights)
+
+                crowdGeom = geom.makeCopy()
+                crowdGeom.setVertexData(crowdData)
+                crowdNode.addGeom(crowdGeom, geomNode.getGeomState(geomIndex))
+
+            crowdNodePath = self.root.attachNewNode(crowdNode)
+            crowdNodePath.setTransform(geomNodePath.getTransform(actor))
+
+    def makeShader(self):
+        # Loop over no more joints per vertex than are used: a
+        # software-renderer, at least, runs every pass of the
+        # loop, used or not. (Rigid models, such as ours,
+        # need only the one.)
+        header = "#version 150\n#define NUM_JOINTS_PER_VERTEX {0}\n".format(self.numJointsPerVertex)
+        if self.perPixelLighting:
+            header += "#define PER_PIXEL_LIGHTING\n"
+            return Shader.make(Shader.SL_GLSL, header + VERTEX_SHADER,
+                               header + LIGHTING_FUNCTION + FRAGMENT_SHADER)
+        return Shader.make(Shader.SL_GLSL, header + LIGHTING_FUNCTION + VERTEX_SHADER,
+                           header + FRAGMENT_SHADER)
+
+    def getJointIndex(self, vertexTransform):
+        # Each of the Actor's joints that moves vertices gets
+        # an index, in order. (A "joint" of None stands for
+        # no joint at all, and so never moves.)
+        index = self.jointIndices.get(vertexTransform)
+        if index is None:
+            index = len(self.jointIndices)
+            self.jointIndices[vertexTransform] = index
+        return index
+
+    def bakeAnimations(self, actor):
+        # Pose the Actor in every frame of every animation, and
+        # record its joints' matrices. We number the frames of all
+        # of the animations together, as "rows": an animation's frames
+        # take up a run of rows, starting at its "row-offset".
+        self.animRows = {}
+        numRows = 0
+        for animName in sorted(actor.getAnimNames()):
+            self.animRows[animName] = numRows
+            numRows += actor.getNumFrames(animName)
+
+        numJoints = len(self.jointIndices)
+        self.numJoints = numJoints
+        self.jointTexture = Texture("crowdJointMatrices")
+        self.jointTexture.setupBufferTexture(numRows*numJoints*3, Texture.T_float,
+                                             Texture.F_rgba32, GeomEnums.UH_static)
+
+        matrices = numpy.zeros((numRows, numJoints, 3, 4), dtype = numpy.float32)
+        for animName, rowOffset in self.animRows.items():
+            for frame in range(actor.getNumFrames(animName)):
+                actor.pose(animName, frame)
+                actor.update(force = True)
+                for vertexTransform, jointIndex in self.jointIndices.items():
+                    jointMatrix = Mat4(Mat4.identMat())
+                    if vertexTransform is not None:
+                        vertexTransform.getMatrix(jointMatrix)
+                    # Panda's matrices act on row-vectors, so each
+                    # of the columns gives one of the new coordinates
+                    for column in range(3):
+                        matrices[rowOffset + frame, jointIndex, column] = jointMatrix.getCol(column)
+
+        self.jointTexture.setRamImage(matrices.tobytes())
+
+    def grow(self, capacity):
+        # The instance-data lives in a buffer-texture, which we
+        # write straight into, through a NumPy array
+        self.instanceTexture = Texture("crowdInstances")
+        self.instanceTexture.setupBufferTexture(capacity*TEXELS_PER_INSTANCE, Texture.T_float,
+                                                Texture.F_rgba32, GeomEnums.UH_dynamic)
+        self.root.setShaderInput("instanceData", self.instanceTexture)
+
+        colorScales = numpy.ones((capacity, 4), dtype = numpy.float32)
+        if self.colorScales is not None:
+            colorScales[:self.size] = self.colorScales[:self.size]
+        self.colorScales = colorScales
+        self.capacity = capacity
+
+    def add(self, enemy):
+        if self.size == self.capacity:
+            self.grow(self.capacity*2)
+
+        index = self.size
+        self.size += 1
+        enemy.crowdIndex = index
+        self.enemies.append(enemy)
+
+        actor = enemy.actor
+        self.xGetters.append(actor.getX)
+        self.yGetters.append(actor.getY)
+        self.zGetters.append(actor.getZ)
+        self.hGetters.append(actor.getH)
+        self.animControls.append([(actor.getAnimControl(animName), rowOffset)
+                                  for animName, rowOffset in self.animRows.items()])
+        self.currentAnims.append(0)
+        self.colorScales[index] = actor.getColorScale()
+
+        # From now on, we draw it
+        actor.getPart("modelRoot").hide()
+
+    def remove(self, enemy):
+        index = enemy.crowdIndex
+        if index is None:
+            return
+        enemy.crowdIndex = None
+        enemy.actor.getPart("modelRoot").show()
+
+        lastIndex = self.size - 1
+        if index != lastIndex:
+            lastEnemy = self.enemies[lastIndex]
+            lastEnemy.crowdIndex = index
+            for slots in (self.enemies, self.xGetters, self.yGetters, self.zGetters,
+                          self.hGetters, self.animControls, self.currentAnims):
+                slots[index] = slots[lastIndex]
+            self.colorScales[index] = self.colorScales[lastIndex]
+
+        for slots in (self.enemies, self.xGetters, self.yGetters, self.zGetters,
+                      self.hGetters, self.animControls, self.currentAnims):
+            slots.pop()
+        self.size -= 1
+
+    def clear(self):
+        for enemy in list(self.enemies):
+            self.remove(enemy)
+        self.root.hide()
+
+    def setColorScale(self, enemy, red, green, blue, alpha):
+        if enemy.crowdIndex is not None:
+            self.colorScales[enemy.crowdIndex] = (red, green, blue, alpha)
+
+    def getFrameRows(self):
+        # The row of the joint-matrices for each enemy's
+        # current frame. An Actor plays only one animation at a time, so
+        # we keep to the one that we last saw playing until it
+        # stops; once none are, the Actor holds the last frame
+        # of the last that played, and so do we.
+        frameRows = []
+        currentAnims = self.currentAnims
+        for index, controls in enumerate(self.animControls):
+            control, rowOffset = controls[currentAnims[index]]
+            if not control.isPlaying():
+                for animIndex, (otherControl, otherRowOffset) in enumerate(controls):
+                    if otherControl.isPlaying():
+                        currentAnims[index] = animIndex
+                        control, rowOffset = otherControl, otherRowOffset
+                        break
+            frameRows.append(rowOffset + control.getFrame())
+        return frameRows
+
+    def update(self):
+        # Called once per frame, after the Actors have been placed
+        size = self.size
+        if size == 0:
+            self.root.hide()
+            return
+        self.root.show()
+        self.root.setInstanceCount(size)
+
+        instanceData = numpy.frombuffer(self.instanceTexture.modifyRamImage(), dtype = numpy.float32)
+        instanceData = instanceData.reshape(self.capacity, TEXELS_PER_INSTANCE, 4)
+        instanceData[:size, 0, 0] = [getX() for getX in self.xGetters]
+        instanceData[:size, 0, 1] = [getY() for getY in self.yGetters]
+        instanceData[:size, 0, 2] = [getZ() for getZ in self.zGetters]
+        instanceData[:size, 0, 3] = numpy.radians([getH() for getH in self.hGetters])
+        instanceData[:size, 1, 0] = self.getFrameRows()
+        instanceData[:size, 2] = self.colorScales[:size]
+
+    def cleanup(self):
+        self.clear()
+        self.root.removeNode()
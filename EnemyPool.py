@@ -0,0 +1,66 @@
+
+from panda3d.core import Vec3
+
+
+class EnemyPool():
+    # Building an enemy means loading an Actor and its animations,
+    # making colliders, and loading sounds--and tearing all of that
+    # down again when it dies. Instead, we keep a set of enemies
+    # built ahead of time and "parked" out of the scene, and hand
+    # them out (and take them back) as they spawn and die.
+    def __init__(self, enemyType, size):
+        self.enemyType = enemyType
+        # The most enemies that we'll hold on to at once
+        self.size = size
+
+        self.available = []
+
+        # How many requests for an enemy were met from the pool,
+        # and how many needed a new enemy to be built
+        self.hits = 0
+        self.misses = 0
+
+    def prewarm(self):
+        # Build enough enemies to fill the pool
+        while len(self.available) < self.size:
+            enemy = self.enemyType(Vec3(0, 0, 0))
+            enemy.park()
+            self.available.append(enemy)
+
+    def resize(self, size):
+        self.size = size
+        while len(self.available) > self.size:
+            self.available.pop().cleanup()
+        self.prewarm()
+
+    def acquire(self, pos):
+        if len(self.available) > 0:
+            self.hits += 1
+            enemy = self.available.pop()
+            enemy.activate(pos)
+        else:
+            self.misses += 1
+            enemy = self.enemyType(pos)
+        return enemy
+
+    def release(self, enemy):
+        # Take an enemy back; if we already have as
+        # many as we want, just get rid of it.
+        if len(self.available) < self.size:
+            enemy.park()
+            self.available.append(enemy)
+        else:
+            enemy.cleanup()
+
+    def getStats(self):
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "available" : len(self.available),
+            "size" : self.size
+        }
+
+    def cleanup(self):
+        for enemy in self.available:
+            enemy.cleanup()
+        self.available = []
@@ -0,0 +1,114 @@
+
+# A registry of every game-object in existence: the player, the
+# enemies (in play, dying, or parked in the pool) and the traps. Each
+# gets an ID that stays the same for as long as it exists, and is
+# filed by its type, its state, and its collider, so that we can ask:
+#
+#  - "Which walking enemies are dying?" ("query")--without looking
+#    at every enemy, since each state keeps its own set.
+#  - "Whose collider is this?" ("getByCollider")--with a single
+#    dictionary-lookup on the collider-node's key, rather than by
+#    way of a Python-tag.
+#
+# An object's state is one of:
+#  - "alive": in play. (A trap in play is "alive" while it's still.)
+#  - "moving": a trap in play, sliding across the arena.
+#  - "dying": out of health; an enemy plays its death, then is parked.
+#  - "parked": out of play, waiting in the enemy-pool.
+
+STATE_ALIVE = "alive"
+STATE_MOVING = "moving"
+STATE_DYING = "dying"
+STATE_PARKED = "parked"
+
+STATES = (STATE_ALIVE, STATE_MOVING, STATE_DYING, STATE_PARKED)
+
+
+class EntityRegistry():
+    def __init__(self):
+        self.nextId = 1
+
+        # ID -> object, and its state
+        self.entities = {}
+        self.states = {}
+
+        # Type -> {ID -> object}, and likewise for each state.
+        # (Dictionaries keep their order, so queries come out
+        #  in the order in which objects were registered.)
+        self.byType = {}
+        self.byState = dict((state, {}) for state in STATES)
+
+        # Collider-node key -> object
+        self.byCollider = {}
+
+    def register(self, entity, state = STATE_ALIVE):
+        # Returns the object's new ID
+        entityId = self.nextId
+        self.nextId += 1
+
+        self.entities[entityId] = entity
+        self.states[entityId] = state
+        self.byType.setdefault(type(entity), {})[entityId] = entity
+        self.byState[state][entityId] = entity
+        if entity.collider is not None:
+            self.byCollider[entity.collider.getKey()] = entity
+
+        return entityId
+
+    def unregister(self, entity):
+        entityId = entity.entityId
+        if entityId not in self.entities:
+            return
+        del self.entities[entityId]
+        del self.byType[type(entity)][entityId]
+        del self.byState[self.states.pop(entityId)][entityId]
+        if entity.collider is not None:
+            self.byCollider.pop(entity.collider.getKey(), None)
+
+    def setState(self, entity, state):
+        entityId = entity.entityId
+        previousState = self.states.get(entityId)
+        if previousState is None or previousState == state:
+            return
+        del self.byState[previousState][entityId]
+        self.byState[state][entityId] = entity
+        self.states[entityId] = state
+
+    def getState(self, entity):
+        return self.states.get(entity.entityId)
+
+    def get(self, entityId):
+        return self.entities.get(entityId)
+
+    def getByCollider(self, colliderNodePath):
+        # The object that owns the given collider,
+        # or None (for walls, and the like)
+        return self.byCollider.get(colliderNodePath.getKey())
+
+    def query(self, entityType = None, state = None):
+        # The objects of the given type (exactly) and in the
+        # given state; either may be left out
+        if entityType is None:
+            if state is None:
+                return list(self.entities.values())
+            return list(self.byState[state].values())
+
+        ofType = self.byType.get(entityType, {})
+        if state is None:
+            return list(ofType.values())
+
+        # Look through whichever set is the smaller
+        inState = self.byState[state]
+        if len(inState) < len(ofType):
+            return [entity for entity in inState.values() if type(entity) is entityType]
+        states = self.states
+        return [entity for entityId, entity in ofType.items() if states[entityId] == state]
+
+    def count(self, entityType = None, state = None):
+        if entityType is None:
+            if state is None:
+                return len(self.entities)
+            return len(self.byState[state])
+        if state is None:
+            return len(self.byType.get(entityType, {}))
+        return len(self.query(entityType, state))
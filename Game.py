@@ -8,25 +8,90 @@ from panda3d.core import CollisionTraverser, CollisionHandlerPusher, CollisionSp
 from panda3d.core import AmbientLight, DirectionalLight
 from panda3d.core import Vec4, Vec3
 from panda3d.core import WindowProperties
-import random
+from panda3d.core import loadPrcFileData, ClockObject
+import heapq
+import itertools
+import sys
+import time
 
 from direct.gui.DirectGui import *
 from GameObject import *
+from Input import LiveInput, NullInput
+from EnemyPool import EnemyPool
+from Assets import AssetRegistry
+from SoundManager import SoundManager
+import Horde
+from SpatialGrid import SpatialGrid
+import Hitscan
+from CollisionPasses import CollisionPass, CollisionPasses
+from CollisionDispatch import CollisionDispatcher, COLLISION_EVENT
+import CrowdRenderer
+from AnimationLOD import AnimationLOD
+from Entities import EntityRegistry
+import Profiling
+from HitchMonitor import HitchMonitor, HITCH_THRESHOLD_MS
+import Telemetry
+from RandomStreams import RandomStreams, makeSeed
+import Replay
+
+# The frame-rate that a headless game simulates at. Since
+# there's no window to sync to, the clock simply advances
+# by this step on every frame, as fast as the CPU allows.
+HEADLESS_FRAME_RATE = 60
+
+# How many times per second the game is simulated, whatever
+# the frame-rate, and the most steps that we'll take in one frame
+# before giving up on catching up (lest slow frames lead to
+# more steps, which lead to slower frames, and so on)
+SIMULATION_RATE = 60
+MAX_STEPS_PER_FRAME = 5
+
+# How often (in simulation-steps) each collision-pass runs
+COLLISION_PASS_INTERVALS = {
+    "pusher" : 1,
+    "playerQueries" : 1,
+    "enemyQueries" : 1
+}
+
+# No window, and no audio
+HEADLESS_CONFIG = """
+window-type none
+audio-library-name null
+sync-video false
+"""
 
 class Game(ShowBase):
-    def __init__(self):
+    def __init__(self, headless = False, inputSource = None, simulationRate = SIMULATION_RATE, batchedHorde = True,
+                 crowdRendering = False, telemetryFormat = None, logLevel = Telemetry.LEVEL_WARNING,
+                 recordReplays = False):
+        # A headless game runs the full simulation--enemies,
+        # traps, collisions--but without a window, sound, or GUI.
+        self.headless = headless
+        if headless:
+            loadPrcFileData("headless", HEADLESS_CONFIG)
+
         ShowBase.__init__(self)
 
-        #Disable mouse
-        self.disableMouse()
+        if self.headless:
+            # A clock that doesn't wait for real time: every frame
+            # is exactly one step long, however quickly it ran.
+            # (The global clock already exists by now, so this
+            #  can't go in the configuration-data above.)
+            globalClock.setMode(ClockObject.MNonRealTime)
+            globalClock.setFrameRate(HEADLESS_FRAME_RATE)
+
+        if not self.headless:
+            #Disable mouse
+            self.disableMouse()
 
-        #Set window properties
-        properties = WindowProperties()
-        properties.setSize(1000, 750)
-        self.win.requestProperties(properties)
+            #Set window properties
+            properties = WindowProperties()
+            properties.setSize(1000, 750)
+            self.win.requestProperties(properties)
 
-        #For exiting game and starting a new level
-        self.exitFunc = self.cleanup        
+        # On exiting--by the Quit button, or by closing the
+        # window--write the session out, and clean up
+        self.exitFunc = self.endSession
 
         #Add ambient lighting
         ambientLight = AmbientLight("ambient light")
@@ -45,14 +110,19 @@ class Game(ShowBase):
         render.setShaderAuto()
         
         #Load environment
-        self.environment = loader.loadModel("Models/Misc/environment")
-        self.environment.reparentTo(render)
+        # (It's only scenery--the walls are separate colliders, below--
+        #  so a headless game can do without it.)
+        self.environment = None
+        if not self.headless:
+            self.environment = loader.loadModel("Models/Misc/environment")
+            self.environment.reparentTo(render)
       
-        # Move the camera to a position high above the screen
-        # --that is, offset it along the z-axis.
-        self.camera.setPos(0, 0, 32)
-        # Tilt the camera down by setting its pitch.
-        self.camera.setP(-90)
+        if not self.headless:
+            # Move the camera to a position high above the screen
+            # --that is, offset it along the z-axis.
+            self.camera.setPos(0, 0, 32)
+            # Tilt the camera down by setting its pitch.
+            self.camera.setP(-90)
 
         #Set up key map
         self.keyMap = {
@@ -73,51 +143,103 @@ class Game(ShowBase):
         self.accept("d-up", self.updateKeyMap, ["right", False])
         self.accept("mouse1", self.updateKeyMap, ["shoot", True])
         self.accept("mouse1-up", self.updateKeyMap, ["shoot", False])
+
+        # All of our models, animations, textures and sounds
+        self.assets = AssetRegistry()
+        # Plays our sound-effects by name, keeping
+        # the number playing at once in check
+        self.sounds = SoundManager(self.assets)
+        self.loadingLabel = None
+        self.startButton = None
+
+        # Where the player's input comes from: the keyboard
+        # and mouse, or--if we have no window--a script, or nothing.
+        if inputSource is None:
+            if self.headless:
+                inputSource = NullInput()
+            else:
+                inputSource = LiveInput(self.keyMap)
+        self.inputSource = inputSource
         
+        # The simulation runs in fixed steps of this length,
+        # using up the time that frames take as it goes
+        self.simulationRate = simulationRate
+        self.simulationDt = 1.0/simulationRate
+        self.maxStepsPerFrame = MAX_STEPS_PER_FRAME
+        self.unsimulatedTime = 0
+
+        # Every game-object, by ID, type, state and
+        # collider (see "Entities.py")
+        self.entities = EntityRegistry()
+
         #Collisions        
+        # (This traverser is the pushing-pass's own; the player's
+        #  and enemies' queries don't use traversers at all--
+        #  see "Hitscan.py" and "SpatialGrid.py".)
         self.pusher = CollisionHandlerPusher()
-        self.cTrav = CollisionTraverser()
+        self.cTrav = CollisionTraverser("pusher")
+
+        # Collisions are traversed as part of each simulation-step,
+        # rather than once per frame by ShowBase
+        self.taskMgr.remove("collisionLoop")
         
         #This accounts for 2d only collisons
         self.pusher.setHorizontal(True)
 
         #Pattern for the trap enemy to move along
-        self.pusher.add_in_pattern("%fn-into-%in")
-        self.accept("trapEnemy-into-wall", self.stopTrap)
-        self.accept("trapEnemy-into-trapEnemy", self.stopTrap)
-        self.accept("trapEnemy-into-player", self.trapHitsSomething)
-        self.accept("trapEnemy-into-walkingEnemy", self.trapHitsSomething)
+        # Collisions all go out under one event-name, and the
+        # dispatcher calls the handler for each pair of
+        # collider-types directly (see "CollisionDispatch.py").
+        self.pusher.add_in_pattern(COLLISION_EVENT)
+        self.collisionDispatcher = CollisionDispatcher(self.entities)
+        self.collisionDispatcher.addHandler("trapEnemy", "wall", self.stopTrap)
+        self.collisionDispatcher.addHandler("trapEnemy", "trapEnemy", self.stopTrap)
+        self.collisionDispatcher.addHandler("trapEnemy", "player", self.trapHitsSomething)
+        self.collisionDispatcher.addHandler("trapEnemy", "walkingEnemy", self.trapHitsSomething)
 
 
         # Tubes are defined by their start-points, end-points, and radius.
-        # In this first case, the tube goes from (-8, 0, 0) to (8, 0, 0),
+        # In this first case, the tube goes from (-8, 8, 0) to (8, 8, 0),
         # and has a radius of 0.2.
 
         #Adding walls
-        wallSolid = CollisionTube(-8.0, 0, 0, 8.0, 0, 0, 0.2)
-        wallNode = CollisionNode("wall")
-        wallNode.addSolid(wallSolid)
-        wall = render.attachNewNode(wallNode)
-        wall.setY(8.0)
-
-        wallSolid = CollisionTube(-8.0, 0, 0, 8.0, 0, 0, 0.2)
-        wallNode = CollisionNode("wall")
-        wallNode.addSolid(wallSolid)
-        wall = render.attachNewNode(wallNode)
-        wall.setY(-8.0)
-
-        wallSolid = CollisionTube(0, -8.0, 0, 0, 8.0, 0, 0.2)
-        wallNode = CollisionNode("wall")
-        wallNode.addSolid(wallSolid)
-        wall = render.attachNewNode(wallNode)
-        wall.setX(8.0)
-
-        wallSolid = CollisionTube(0, -8.0, 0, 0, 8.0, 0, 0.2)
+        # The walls never move, so they're built once into a
+        # single node, in a sub-tree of their own: one bounding-
+        # volume for the traverser to check, and no transforms.
+        self.staticCollision = render.attachNewNode("staticCollision")
         wallNode = CollisionNode("wall")
-        wallNode.addSolid(wallSolid)
-        wall = render.attachNewNode(wallNode)
-        wall.setX(-8.0)
-
+        wallNode.addSolid(CollisionTube(-8.0, 8.0, 0, 8.0, 8.0, 0, 0.2))
+        wallNode.addSolid(CollisionTube(-8.0, -8.0, 0, 8.0, -8.0, 0, 0.2))
+        wallNode.addSolid(CollisionTube(8.0, -8.0, 0, 8.0, 8.0, 0, 0.2))
+        wallNode.addSolid(CollisionTube(-8.0, -8.0, 0, -8.0, 8.0, 0, 0.2))
+        self.staticCollision.attachNewNode(wallNode)
+
+        # The collision-passes, run from "simulate"
+        self.collisionPasses = CollisionPasses()
+        self.collisionPasses.addPass(CollisionPass("pusher", self.runPusherPass,
+                                                   COLLISION_PASS_INTERVALS["pusher"]))
+        self.collisionPasses.addPass(CollisionPass("playerQueries", self.runPlayerQueries,
+                                                   COLLISION_PASS_INTERVALS["playerQueries"],
+                                                   lambda: self.player.firing))
+        self.collisionPasses.addPass(CollisionPass("enemyQueries", self.runEnemyQueries,
+                                                   COLLISION_PASS_INTERVALS["enemyQueries"],
+                                                   lambda: len(self.pendingAttacks) > 0))
+
+        # Enemies' attacks that have landed, but not yet
+        # been checked for hits
+        self.pendingAttacks = []
+
+        # A frame-by-frame record of each session, along with
+        # our debug-log (see "Telemetry.py")
+        self.telemetry = Telemetry.Telemetry(telemetryFormat, logLevel = logLevel)
+        self.log = self.telemetry.getChannel("game")
+
+        # All of our randomness, seeded anew for each game,
+        # and--if asked for--a recording of each game's seed and
+        # input, for replaying it exactly (see "Replay.py")
+        self.randomStreams = RandomStreams()
+        self.recordReplays = recordReplays
+        self.recording = None
 
         self.updateTask = taskMgr.add(self.update, "update")
         
@@ -127,7 +249,19 @@ class Game(ShowBase):
         self.enemies = []
         self.trapEnemies = []
 
+        # Enemies that have died since they were last collected
+        # (they tell us so, via "enemyDied"), so that we needn't
+        # check every enemy's health every step
+        self.newlyDeadEnemies = []
+
+        # The dead enemies, as a heap ordered by when their "die"
+        # animations end: (end-time, order of death, enemy). Each
+        # step, we only look at those whose time has come.
         self.deadEnemies = []
+        self.numDeaths = 0
+
+        # How long the game has been simulated for, in seconds
+        self.simulationTime = 0.0
 
         # Set up some spawn points
         self.spawnPoints = []
@@ -148,27 +282,104 @@ class Game(ShowBase):
         self.maxEnemies = 2
         self.maximumMaxEnemies = 20
 
+        # Enemies are built ahead of time, and re-used
+        # as they spawn and die, rather than being built
+        # (and torn down) as the game goes.
+        # (The pool is filled once our assets are loaded.)
+        self.enemyPool = EnemyPool(WalkingEnemy, self.maximumMaxEnemies)
+
+        # Where everything is, roughly, for enemies' attacks
+        # to look up what they hit
+        self.spatialGrid = SpatialGrid()
+
+        # Walking enemies are moved all together, by the horde,
+        # if NumPy is available; otherwise, each moves itself.
+        if batchedHorde and Horde.isAvailable():
+            self.horde = Horde.Horde(self.spatialGrid)
+        else:
+            self.horde = None
+
+        # Walking enemies may instead be drawn all together, by the
+        # crowd-renderer, if asked for and the graphics-card allows.
+        # (It needs the enemies' model, so it's built once our
+        #  assets are loaded.)
+        self.crowdRendering = crowdRendering
+        self.crowdRenderer = None
+
+        # Otherwise, their animations are posed as their level-of-
+        # detail allows. (Without a window, there's nothing to
+        # pose them for--but we still decide who would be.)
+        self.animationLod = AnimationLOD(evaluate = not self.headless)
+
         self.numTrapsPerSide = 2
+        # Each trap's slide is a looping sound that plays for as
+        # long as it moves, so allow one for every trap; otherwise
+        # the last few to set off would silence the first.
+        self.sounds.setMaxVoicesOfType("trapSlide", self.numTrapsPerSide*4)
 
         self.difficultyInterval = 5.0
         self.difficultyTimer = self.difficultyInterval
 
-        self.enemySpawnSound = loader.loadSfx("Sounds/enemySpawn.ogg")
-
+        self.gameOverScreen = None
+        self.titleMenu = None
+        self.titleMenuBackdrop = None
+
+        if self.headless:
+            # Nobody's waiting on a menu, so just load everything now
+            self.assets.loadAll()
+            self.assetsLoaded()
+        else:
+            self.setupGui()
+
+            #Music
+            music = loader.loadMusic("Music/Defending-the-Princess-Haunted.ogg")
+            music.setLoop(True)
+            music.setVolume(0.075)
+            music.play()
+
+            # Load our models, animations, textures and sounds
+            # in the background while the title-menu is up.
+            self.assets.preload(self.updateLoadingLabel, self.assetsLoaded)
+
+    def updateLoadingLabel(self, numLoaded, numToLoad):
+        self.loadingLabel["text"] = "Loading... {0}%".format(numLoaded*100//numToLoad)
+        self.loadingLabel.setText()
+
+    def assetsLoaded(self):
+        if self.loadingLabel is not None:
+            self.loadingLabel.hide()
+        # The game can be started now that nothing's still loading
+        # on the background-thread--which would otherwise be using
+        # "loader" and the registry alongside the game.
+        if self.startButton is not None:
+            self.startButton["state"] = DGG.NORMAL
+
+        self.enemyPool.prewarm()
+
+        gsg = None if self.win is None else self.win.getGsg()
+        if self.crowdRendering and CrowdRenderer.isSupported(gsg):
+            self.crowdRenderer = CrowdRenderer.CrowdRenderer(self.assets.getActorTemplate("walkingEnemy"),
+                                                             perPixelLighting = not CrowdRenderer.isSoftwareRenderer(gsg))
+            self.crowdRenderer.root.reparentTo(render)
+
+    def setupGui(self):
         #Game Over screen
         self.gameOverScreen = DirectDialog(frameSize = (-0.7, 0.7, -0.7, 0.7),
                                            fadeScreen = 0.4,
                                            relief = DGG.FLAT,
-                                           frameTexture = "UI/stoneFrame.png")
+                                           frameTexture = self.assets.getTexture("UI/stoneFrame.png"))
         self.gameOverScreen.hide()
 
         self.font = loader.loadFont("Fonts/Wbxkomik.ttf")
 
+        # One sound, shared by all of our buttons
+        clickSound = self.sounds.getSharedSound("uiClick")
+
         buttonImages = (
-            loader.loadTexture("UI/UIButton.png"),
-            loader.loadTexture("UI/UIButtonPressed.png"),
-            loader.loadTexture("UI/UIButtonHighlighted.png"),
-            loader.loadTexture("UI/UIButtonDisabled.png")
+            self.assets.getTexture("UI/UIButton.png"),
+            self.assets.getTexture("UI/UIButtonPressed.png"),
+            self.assets.getTexture("UI/UIButtonHighlighted.png"),
+            self.assets.getTexture("UI/UIButtonDisabled.png")
         )
 
         label = DirectLabel(text = "Game Over!",
@@ -191,7 +402,7 @@ class Game(ShowBase):
                            parent = self.gameOverScreen,
                            scale = 0.07,
                            text_font = self.font,
-                           clickSound = loader.loadSfx("Sounds/UIClick.ogg"),
+                           clickSound = clickSound,
                            frameTexture = buttonImages,
                            frameSize = (-4, 4, -1, 1),
                            text_scale = 0.75,
@@ -206,7 +417,7 @@ class Game(ShowBase):
                            parent = self.gameOverScreen,
                            scale = 0.07,
                            text_font = self.font,
-                           clickSound = loader.loadSfx("Sounds/UIClick.ogg"),
+                           clickSound = clickSound,
                            frameTexture = buttonImages,
                            frameSize = (-4, 4, -1, 1),
                            text_scale = 0.75,
@@ -241,19 +452,21 @@ class Game(ShowBase):
                              text_font = self.font,
                              text_fg = (1, 1, 1, 1))
 
-        btn = DirectButton(text = "Start Game",
-                           command = self.startGame,
-                           pos = (0, 0, 0.2),
-                           parent = self.titleMenu,
-                           scale = 0.1,
-                           text_font = self.font,
-                           clickSound = loader.loadSfx("Sounds/UIClick.ogg"),
-                           frameTexture = buttonImages,
-                           frameSize = (-4, 4, -1, 1),
-                           text_scale = 0.75,
-                           relief = DGG.FLAT,
-                           text_pos = (0, -0.2))
-        btn.setTransparency(True)
+        # (Disabled until our assets have finished loading)
+        self.startButton = DirectButton(text = "Start Game",
+                                        command = self.startGame,
+                                        pos = (0, 0, 0.2),
+                                        parent = self.titleMenu,
+                                        scale = 0.1,
+                                        text_font = self.font,
+                                        clickSound = clickSound,
+                                        frameTexture = buttonImages,
+                                        frameSize = (-4, 4, -1, 1),
+                                        text_scale = 0.75,
+                                        relief = DGG.FLAT,
+                                        text_pos = (0, -0.2),
+                                        state = DGG.DISABLED)
+        self.startButton.setTransparency(True)
 
         btn = DirectButton(text = "Quit",
                            command = self.quit,
@@ -261,7 +474,7 @@ class Game(ShowBase):
                            parent = self.titleMenu,
                            scale = 0.1,
                            text_font = self.font,
-                           clickSound = loader.loadSfx("Sounds/UIClick.ogg"),
+                           clickSound = clickSound,
                            frameTexture = buttonImages,
                            frameSize = (-4, 4, -1, 1),
                            text_scale = 0.75,
@@ -269,23 +482,47 @@ class Game(ShowBase):
                            text_pos = (0, -0.2))
         btn.setTransparency(True)
 
-        #Music
-        music = loader.loadMusic("Music/Defending-the-Princess-Haunted.ogg")
-        music.setLoop(True)
-        music.setVolume(0.075)
-        music.play()
+        self.loadingLabel = DirectLabel(text = "",
+                                        scale = 0.05,
+                                        pos = (0, 0, -0.9),
+                                        parent = self.titleMenu,
+                                        relief = None,
+                                        text_font = self.font,
+                                        text_fg = (1, 1, 1, 1))
+
+    def startGame(self, seed = None):
+        # "seed" decides everything random in the game;
+        # by default, each game gets a new one
+        self.unsimulatedTime = 0
+
+        if not self.headless:
+            self.titleMenu.hide()
+            self.titleMenuBackdrop.hide()
+            self.gameOverScreen.hide()
+
+        # Write out the last session, if it didn't end
+        # in a game over
+        self.saveRecording()
+        self.cleanup()
+        self.telemetry.flush()
 
-    def startGame(self):
-        self.titleMenu.hide()
-        self.titleMenuBackdrop.hide()
-        self.gameOverScreen.hide()
+        if seed is None:
+            seed = makeSeed()
+        self.randomStreams.reseed(seed)
 
-        self.cleanup()
+        # Everything else that a game starts from, so
+        # that every game with this seed starts alike
+        self.simulationTime = 0.0
+        self.numDeaths = 0
+        self.spawnInterval = self.initialSpawnInterval
+        self.spawnTimer = self.spawnInterval
+
+        if self.recordReplays:
+            self.recording = Replay.Recording(seed, self.simulationRate, self.horde is not None)
 
         self.player = Player()
 
         self.maxEnemies = 2
-        self.spawnInterval = self.initialSpawnInterval
 
         self.difficultyTimer = self.difficultyInterval
 
@@ -311,58 +548,66 @@ class Game(ShowBase):
         for i in range(self.numTrapsPerSide):
             # Note that we "pop" the chosen location,
             # so that it won't be chosen again.
-            slot = sideTrapSlots[0].pop(random.randint(0, len(sideTrapSlots[0])-1))
+            slot = sideTrapSlots[0].pop(self.randomStreams.traps.randint(0, len(sideTrapSlots[0])-1))
             trap = TrapEnemy(Vec3(slot, 7.0, 0))
             self.trapEnemies.append(trap)
 
-            slot = sideTrapSlots[1].pop(random.randint(0, len(sideTrapSlots[1])-1))
+            slot = sideTrapSlots[1].pop(self.randomStreams.traps.randint(0, len(sideTrapSlots[1])-1))
             trap = TrapEnemy(Vec3(slot, -7.0, 0))
             self.trapEnemies.append(trap)
 
-            slot = sideTrapSlots[2].pop(random.randint(0, len(sideTrapSlots[2])-1))
+            slot = sideTrapSlots[2].pop(self.randomStreams.traps.randint(0, len(sideTrapSlots[2])-1))
             trap = TrapEnemy(Vec3(7.0, slot, 0))
             trap.moveInX = True
             self.trapEnemies.append(trap)
 
-            slot = sideTrapSlots[3].pop(random.randint(0, len(sideTrapSlots[3])-1))
+            slot = sideTrapSlots[3].pop(self.randomStreams.traps.randint(0, len(sideTrapSlots[3])-1))
             trap = TrapEnemy(Vec3(-7.0, slot, 0))
             trap.moveInX = True
             self.trapEnemies.append(trap)
 
+        self.addToSpatialGrid(self.player)
+        for trap in self.trapEnemies:
+            self.addToSpatialGrid(trap)
+
+    def addToSpatialGrid(self, gameObject):
+        pos = gameObject.actor.getPos()
+        mask = gameObject.collider.node().getIntoCollideMask()
+        self.spatialGrid.insert(gameObject, pos.x, pos.y, gameObject.colliderRadius, mask.getWord())
+
     def updateKeyMap(self, controlName, controlState):
             self.keyMap[controlName] = controlState
 
     def spawnEnemy(self):
         if len(self.enemies) < self.maxEnemies:
-            spawnPoint = random.choice(self.spawnPoints)
+            spawnPoint = self.randomStreams.spawning.choice(self.spawnPoints)
 
-            newEnemy = WalkingEnemy(spawnPoint)
+            newEnemy = self.enemyPool.acquire(spawnPoint)
 
+            newEnemy.enemyIndex = len(self.enemies)
             self.enemies.append(newEnemy)
+            self.addToSpatialGrid(newEnemy)
+            if self.horde is not None:
+                self.horde.add(newEnemy)
+            if self.crowdRenderer is not None:
+                self.crowdRenderer.add(newEnemy)
+            else:
+                self.animationLod.add(newEnemy)
+
+            self.sounds.play("enemySpawn")
 
-            self.enemySpawnSound.play()
-
-    def stopTrap(self, entry):
-        collider = entry.getFromNodePath()
-        if collider.hasPythonTag("owner"):
-            trap = collider.getPythonTag("owner")
-            trap.moveDirection = 0
-            trap.ignorePlayer = False
-            trap.movementSound.stop()
-            trap.stopSound.play()
-
-    def trapHitsSomething(self, entry):
-        collider = entry.getFromNodePath()
-        if collider.hasPythonTag("owner"):
-            trap = collider.getPythonTag("owner")
+    def stopTrap(self, trap, other, entry):
+        if trap is not None:
+            trap.stopMoving()
+
+    def trapHitsSomething(self, trap, obj, entry):
+        if trap is not None:
             # We don't want stationary traps to do damage,
             # so ignore the collision if the "moveDirection" is 0
             if trap.moveDirection == 0:
                 return
 
-            collider = entry.getIntoNodePath()
-            if collider.hasPythonTag("owner"):
-                obj = collider.getPythonTag("owner")
+            if obj is not None:
                 if isinstance(obj, Player):
                     if not trap.ignorePlayer:
                         obj.alterHealth(-1)
@@ -370,69 +615,48 @@ class Game(ShowBase):
                 else:
                     obj.alterHealth(-10)
 
-                trap.impactSound.play()
+                self.sounds.play("trapHitsSomething")
 
     def update(self, task):
-        dt = globalClock.getDt()
+        if self.headless:
+            frameDt = 1.0/HEADLESS_FRAME_RATE
+        else:
+            frameDt = globalClock.getDt()
 
         # If the player is dead, or we're not
         # playing yet, ignore this logic.
         if self.player is not None:
             if self.player.health > 0:
-                self.player.update(self.keyMap, dt)
-
-                # Wait to spawn an enemy...
-                self.spawnTimer -= dt
-                if self.spawnTimer <= 0:
-                    # Spawn one!
-                    self.spawnTimer = self.spawnInterval
-                    self.spawnEnemy()
-
-                # Update all enemies and traps
-                [enemy.update(self.player, dt) for enemy in self.enemies]
-                [trap.update(self.player, dt) for trap in self.trapEnemies]
-
-                # Find the enemies that have just
-                # died, if any
-                newlyDeadEnemies = [enemy for enemy in self.enemies if enemy.health <= 0]
-                # And re-build the enemy-list to exclude
-                # those that have just died.
-                self.enemies = [enemy for enemy in self.enemies if enemy.health > 0]
-
-                # Newly-dead enemies should have no collider,
-                # and should play their "die" animation.
-                # In addition, increase the player's score.
-                for enemy in newlyDeadEnemies:
-                    enemy.collider.removeNode()
-                    enemy.actor.play("die")
-                    self.player.score += enemy.scoreValue
-                if len(newlyDeadEnemies) > 0:
-                    self.player.updateScore()
-
-                self.deadEnemies += newlyDeadEnemies
-
-                # Check our "dead enemies" to see
-                # whether they're still animating their
-                # "die" animation. In not, clean them up,
-                # and drop them from the "dead enemies" list.
-                enemiesAnimatingDeaths = []
-                for enemy in self.deadEnemies:
-                    deathAnimControl = enemy.actor.getAnimControl("die")
-                    if deathAnimControl is None or not deathAnimControl.isPlaying():
-                        enemy.cleanup()
-                    else:
-                        enemiesAnimatingDeaths.append(enemy)
-                self.deadEnemies = enemiesAnimatingDeaths
-
-                # Make the game more difficult over time!
-                self.difficultyTimer -= dt
-                if self.difficultyTimer <= 0:
-                    self.difficultyTimer = self.difficultyInterval
-                    if self.maxEnemies < self.maximumMaxEnemies:
-                        self.maxEnemies += 1
-                    if self.spawnInterval > self.minimumSpawnInterval:
-                        self.spawnInterval -= 0.1
-            else:
+                # Our Actors were last left part-way between
+                # simulation-steps; put them back where the
+                # simulation had them.
+                self.restoreSimState()
+
+                # Simulate as many whole steps as fit into the time
+                # that has passed; keep any remainder for next frame.
+                self.unsimulatedTime += frameDt
+                numSteps = 0
+                while self.unsimulatedTime >= self.simulationDt and self.player.health > 0:
+                    if numSteps >= self.maxStepsPerFrame:
+                        # We've fallen too far behind: let the
+                        # game slow down instead.
+                        self.unsimulatedTime = 0
+                        break
+                    self.simulate(self.simulationDt)
+                    self.unsimulatedTime -= self.simulationDt
+                    numSteps += 1
+
+                # Then draw everything at the fraction of a step
+                # that's left over.
+                self.interpolate(self.unsimulatedTime/self.simulationDt)
+                self.updateAnimation()
+
+                self.telemetry.record(self, frameDt)
+                if self.player.health <= 0:
+                    # Game over: write the session out
+                    self.saveRecording()
+                    self.telemetry.flush()
+            elif not self.headless:
                 if self.gameOverScreen.isHidden():
                     self.gameOverScreen.show()
                     self.finalScoreLabel["text"] = "Final score: " + str(self.player.score)
@@ -441,18 +665,253 @@ class Game(ShowBase):
 
         return task.cont
 
+    def simulate(self, dt):
+        # A single, fixed-length step of the game.
+        # Each stage of the step is a method of its own,
+        # so that it can be timed (or replaced) separately.
+        self.simulationTime += dt
+
+        self.updatePlayer(dt)
+        self.updatePlayerQueries(dt)
+        self.updateSpawning(dt)
+        self.updateSpatialGrid()
+        self.updateEnemies(dt)
+        self.updateEnemyQueries(dt)
+        self.updateTraps(dt)
+        self.updateCollisions()
+        self.updateDeadEnemies(dt)
+        self.updateDifficulty(dt)
+
+        for gameObject in self.getSimulatedObjects():
+            gameObject.storeSimState()
+
+    def updateAnimation(self):
+        # Once everything is where it's to be drawn, gather the
+        # crowd's instance-data, and pose the others' joints
+        if self.crowdRenderer is not None:
+            self.crowdRenderer.update()
+        self.animationLod.update(self.player)
+
+    def getSimulatedObjects(self):
+        # Everything that the simulation moves. (This is walked a
+        # few times a step, so the lists are chained together as
+        # they're walked, rather than copied into a new one.)
+        return itertools.chain((self.player,), self.enemies, self.trapEnemies)
+
+    def restoreSimState(self):
+        for gameObject in self.getSimulatedObjects():
+            gameObject.restoreSimState()
+
+    def interpolate(self, alpha):
+        for gameObject in self.getSimulatedObjects():
+            gameObject.interpolate(alpha)
+
+    def updatePlayerQueries(self, dt):
+        self.collisionPasses.update("playerQueries", dt)
+
+    def updateEnemyQueries(self, dt):
+        self.collisionPasses.update("enemyQueries", dt)
+
+    def updateCollisions(self):
+        self.collisionPasses.update("pusher", self.simulationDt)
+
+    def runPusherPass(self, dt):
+        # Push things apart. Collisions that this produces
+        # (such as a trap hitting a wall) are handled straight
+        # away, within this step.
+        self.cTrav.traverse(render)
+        numContacts = self.collisionDispatcher.collectCollisions()
+        self.collisionDispatcher.deliver()
+
+        # The horde keeps its own copy of its enemies'
+        # positions, which the pusher may just have changed
+        if self.horde is not None:
+            self.horde.readPositions()
+
+        # The pairs that the pusher found touching this step
+        # (which Panda doesn't tell us how many pairs it
+        # tested to find)
+        return numContacts
+
+    def runPlayerQueries(self, dt):
+        # Fire the player's laser
+        hitObject, beamLength = self.castLaser(self.player.position, self.player.firingDirection)
+        self.player.fireLaser(hitObject, beamLength, dt)
+
+        # Every enemy and trap, and each wall
+        return len(self.enemies) + len(self.trapEnemies) + 4
+
+    def runEnemyQueries(self, dt):
+        # Check each landed attack for a hit
+        numPairs = 0
+        for enemy in self.pendingAttacks:
+            if enemy.health > 0:
+                numPairs += enemy.resolveAttack()
+        self.pendingAttacks = []
+        return numPairs
+
+    def castLaser(self, origin, direction):
+        # What the player's laser hits first--an enemy, a trap,
+        # or (if neither) a wall--and how far away. A wall
+        # is reported as None.
+        hitObject = None
+        hitDistance = Hitscan.castRayAtWalls(origin.x, origin.y, direction.x, direction.y)
+
+        if self.horde is not None and self.horde.size > 0:
+            enemy, distance = self.horde.castRay(origin.x, origin.y, direction.x, direction.y)
+            if distance < hitDistance:
+                hitObject = enemy
+                hitDistance = distance
+
+        # (Their Actors' coordinates are read one at a time,
+        #  as that doesn't make a new point for each.)
+        for targets in (self.enemies, self.trapEnemies):
+            for target in targets:
+                if target.hordeIndex is not None:
+                    continue
+                actor = target.actor
+                distance = Hitscan.castRayAtCircle(origin.x, origin.y, direction.x, direction.y,
+                                                   actor.getX(), actor.getY(), target.colliderRadius)
+                if distance is not None and distance < hitDistance:
+                    hitObject = target
+                    hitDistance = distance
+
+        return hitObject, hitDistance
+
+    def updatePlayer(self, dt):
+        keys, aimPoint = self.inputSource.poll(self.player)
+        if self.recording is not None:
+            self.recording.addStep(keys, aimPoint)
+        self.player.update(keys, aimPoint, dt)
+
+    def updateSpawning(self, dt):
+        # Wait to spawn an enemy...
+        self.spawnTimer -= dt
+        if self.spawnTimer <= 0:
+            # Spawn one!
+            self.spawnTimer = self.spawnInterval
+            self.spawnEnemy()
+
+    def updateEnemies(self, dt):
+        # Update all enemies: those in the horde all at once,
+        # and any others one by one
+        if self.horde is not None:
+            self.horde.update(self.player, dt)
+            [enemy.update(self.player, dt) for enemy in self.enemies if enemy.hordeIndex is None]
+        else:
+            [enemy.update(self.player, dt) for enemy in self.enemies]
+
+        self.collectDeadEnemies()
+
+    def collectDeadEnemies(self):
+        # Take the enemies that have just died, if
+        # any, out of the enemy-list
+        if len(self.newlyDeadEnemies) == 0:
+            return
+        newlyDeadEnemies = self.newlyDeadEnemies
+        self.newlyDeadEnemies = []
+
+        # Newly-dead enemies should have no collider,
+        # and should play their "die" animation--at the
+        # end of which they go back into the pool.
+        # In addition, increase the player's score.
+        # (The collider is stashed rather than removed,
+        #  since the enemy will go back into the pool.)
+        for enemy in newlyDeadEnemies:
+            self.removeEnemy(enemy)
+            if self.horde is not None:
+                self.horde.remove(enemy)
+            self.spatialGrid.remove(enemy)
+            enemy.collider.stash()
+            dyingTime = enemy.animations.request("die")
+            self.numDeaths += 1
+            heapq.heappush(self.deadEnemies, (self.simulationTime + dyingTime, self.numDeaths, enemy))
+            self.player.score += enemy.scoreValue
+            self.player.kills += 1
+        self.player.updateScore()
+
+    def enemyDied(self, enemy):
+        self.newlyDeadEnemies.append(enemy)
+
+    def removeEnemy(self, enemy):
+        # Take an enemy out of the enemy-list by moving the
+        # last enemy into its slot, rather than shifting
+        # everything after it down
+        index = enemy.enemyIndex
+        if index is None:
+            return
+        enemy.enemyIndex = None
+
+        lastEnemy = self.enemies.pop()
+        if lastEnemy is not enemy:
+            self.enemies[index] = lastEnemy
+            lastEnemy.enemyIndex = index
+
+    def updateSpatialGrid(self):
+        # Re-file anything that has moved into another cell.
+        # (The horde does this itself for its enemies.)
+        grid = self.spatialGrid
+        grid.move(self.player, self.player.actor.getX(), self.player.actor.getY())
+        for trap in self.trapEnemies:
+            grid.move(trap, trap.actor.getX(), trap.actor.getY())
+        for enemy in self.enemies:
+            if enemy.hordeIndex is None:
+                grid.move(enemy, enemy.actor.getX(), enemy.actor.getY())
+
+    def updateTraps(self, dt):
+        [trap.update(self.player, dt) for trap in self.trapEnemies]
+
+    def updateDeadEnemies(self, dt):
+        # Return the dead enemies whose "die" animations have
+        # ended to the pool. They're at the top of the heap;
+        # the rest we leave alone.
+        deadEnemies = self.deadEnemies
+        while len(deadEnemies) > 0 and deadEnemies[0][0] <= self.simulationTime:
+            endTime, deathNumber, enemy = heapq.heappop(deadEnemies)
+            self.releaseEnemy(enemy)
+
+    def releaseEnemy(self, enemy):
+        # Return an enemy to the pool--and, if the crowd-renderer
+        # was drawing it, leave it to draw itself again
+        if self.crowdRenderer is not None:
+            self.crowdRenderer.remove(enemy)
+        self.animationLod.remove(enemy)
+        self.enemyPool.release(enemy)
+
+    def updateDifficulty(self, dt):
+        # Make the game more difficult over time!
+        self.difficultyTimer -= dt
+        if self.difficultyTimer <= 0:
+            self.difficultyTimer = self.difficultyInterval
+            if self.maxEnemies < self.maximumMaxEnemies:
+                self.maxEnemies += 1
+            if self.spawnInterval > self.minimumSpawnInterval:
+                self.spawnInterval -= 0.1
+
     def cleanup(self):
         # Call our various cleanup methods,
         # empty the various lists,
         # and make the player "None" again.
 
+        # Enemies go back into the pool, for the next game
+        if self.horde is not None:
+            self.horde.clear()
         for enemy in self.enemies:
-            enemy.cleanup()
+            enemy.enemyIndex = None
+            self.releaseEnemy(enemy)
         self.enemies = []
+        self.newlyDeadEnemies = []
 
-        for enemy in self.deadEnemies:
-            enemy.cleanup()
+        for endTime, deathNumber, enemy in self.deadEnemies:
+            self.releaseEnemy(enemy)
         self.deadEnemies = []
+        if self.crowdRenderer is not None:
+            self.crowdRenderer.clear()
+        self.animationLod.clear()
+
+        self.spatialGrid.clear()
+        self.pendingAttacks = []
+        self.collisionDispatcher.clear()
 
         for trap in self.trapEnemies:
             trap.cleanup()
@@ -463,13 +922,123 @@ class Game(ShowBase):
             self.player = None
 
     def quit(self):
-        # Clean up, then exit
-
-        self.cleanup()
-
+        # Exit (which runs "endSession", below, on the way)
         base.userExit()
 
-
-game = Game()
-game.run()
+    def endSession(self):
+        # Write out the session--its recording and its
+        # telemetry--then clean everything up
+        self.saveRecording()
+        self.telemetry.flush()
+        self.cleanup()
+        self.sounds.stopAll()
+        self.enemyPool.cleanup()
+        if self.crowdRenderer is not None:
+            self.crowdRenderer.cleanup()
+            self.crowdRenderer = None
+        self.assets.cleanup()
+
+    def saveRecording(self):
+        # Save the game being recorded, if there is one,
+        # as it stands; returns the path saved to, or None
+        if self.recording is None:
+            return None
+        recording = self.recording
+        self.recording = None
+        if recording.numSteps == 0:
+            return None
+        recording.finish(self)
+        path = Replay.makeRecordingPath()
+        recording.save(path)
+        self.log.info("Saved a replay of %d steps to %s", recording.numSteps, path)
+        return path
+
+    def runFrames(self, numFrames):
+        # Step the whole task-loop--our update (collisions and
+        # all), intervals, and so on--a set number of times.
+        # Without a window this doesn't wait on anything.
+        for i in range(numFrames):
+            self.taskMgr.step()
+
+
+def enableProfiling(game, args):
+    # With "--pstats", time our stages in PStats (see "Profiling.py");
+    # returns the profiler, or None
+    if "--pstats" not in args:
+        return None
+    profiler, connected = Profiling.enable(game)
+    if not connected:
+        print("Couldn't connect to PStats; is \"pstats\" running?")
+    return profiler
+
+
+def makeHitchMonitor(game, args):
+    # With "--hitches", save what happened around any frame slower
+    # than "--hitch-ms" (see "HitchMonitor.py"). With a window, F9
+    # profiles the next few frames, either way.
+    detectHitches = "--hitches" in args
+    if not detectHitches and game.headless:
+        return None
+    threshold = HITCH_THRESHOLD_MS
+    if "--hitch-ms" in args:
+        threshold = float(args[args.index("--hitch-ms") + 1])
+    return HitchMonitor(game, detectHitches = detectHitches, threshold = threshold)
+
+
+def getTelemetryFormat(args):
+    # "--telemetry csv" or "--telemetry json" writes each
+    # session out, into "telemetry/"
+    if "--telemetry" not in args:
+        return None
+    telemetryFormat = args[args.index("--telemetry") + 1]
+    if telemetryFormat not in Telemetry.FORMATS:
+        raise ValueError("Unknown telemetry-format: " + telemetryFormat)
+    return telemetryFormat
+
+
+def getLogLevel(args):
+    # "--log-level debug" (or "info", and so on)
+    if "--log-level" not in args:
+        return Telemetry.LEVEL_WARNING
+    return Telemetry.LEVELS[args[args.index("--log-level") + 1]]
+
+
+def main(args):
+    if "--headless" in args:
+        # Simulate a game with nobody at the controls, and
+        # report how quickly we got through it.
+        numFrames = 1000
+        if "--frames" in args:
+            numFrames = int(args[args.index("--frames") + 1])
+
+        game = Game(headless = True, batchedHorde = "--unbatched" not in args,
+                    telemetryFormat = getTelemetryFormat(args), logLevel = getLogLevel(args),
+                    recordReplays = "--record" in args)
+        profiler = enableProfiling(game, args)
+        hitchMonitor = makeHitchMonitor(game, args)
+        game.startGame()
+
+        startTime = time.perf_counter()
+        game.runFrames(numFrames)
+        elapsed = time.perf_counter() - startTime
+
+        print("Simulated {0} frames in {1:.3f}s ({2:.0f} frames per second)".format(numFrames, elapsed, numFrames/elapsed))
+        if hitchMonitor is not None:
+            hitchMonitor.cleanup()
+        if profiler is not None:
+            Profiling.disable(profiler)
+        game.saveRecording()
+        game.telemetry.flush()
+        game.cleanup()
+    else:
+        game = Game(crowdRendering = "--crowd" in args,
+                    telemetryFormat = getTelemetryFormat(args), logLevel = getLogLevel(args),
+                    recordReplays = "--record" in args)
+        enableProfiling(game, args)
+        makeHitchMonitor(game, args)
+        game.run()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
 
@@ -1,24 +1,61 @@
 
-from panda3d.core import Vec4, Vec3, Vec2, Plane, Point3, BitMask32
-from direct.actor.Actor import Actor
-from panda3d.core import CollisionSphere, CollisionNode, CollisionRay, CollisionSegment, CollisionHandlerQueue
+from panda3d.core import Vec4, Vec3, Point3, BitMask32
+from panda3d.core import CollisionSphere, CollisionNode
 from direct.gui.OnscreenText import OnscreenText
 from direct.gui.OnscreenImage import OnscreenImage
 from panda3d.core import TextNode
-from panda3d.core import AudioSound
 from panda3d.core import PointLight
 
-import math, random
+import math
+
+from AnimationStates import AnimationState, AnimationStateMachine
+from Entities import STATE_ALIVE, STATE_MOVING, STATE_DYING, STATE_PARKED
+from Telemetry import LEVEL_DEBUG
 
 FRICTION = 150.0
 
+# A note on the per-step code below: calling a method of a Panda
+# vector ("length", "assign", "normalize" and so on) makes a new
+# bound-method object each time, and vector arithmetic makes a new
+# vector. Reading and writing a vector's components, updating it
+# in place ("*=", "+="), and calling methods of NodePaths don't.
+# So the code that runs every step works component by component,
+# and keeps the vectors that it updates (such as our velocity and
+# position) rather than making new ones.
+
 
 class GameObject():
-    def __init__(self, pos, modelName, modelAnims, maxHealth, maxSpeed, colliderName):
-        self.actor = Actor(modelName, modelAnims)
+    # Our animations, by state-name (see "AnimationStates.py")
+    animationStates = {}
+
+    # Our state is kept in fixed slots, rather than in a
+    # dictionary per object--a good deal smaller, and a
+    # little quicker to get at. (Each sub-class lists its
+    # own additions.) By what they're for:
+    __slots__ = (
+        # Our ID in the game's registry (see "Entities.py"),
+        # and our part of the scene-graph
+        "entityId", "actor", "collider", "colliderRadius", "animations",
+        # Where the simulation has put us, and where our last
+        # update put us
+        "simPos", "simH", "previousSimPos", "previousSimH", "position",
+        # Where we're drawn, between steps
+        "interpolatedPos",
+        # Movement
+        "velocity", "acceleration", "maxSpeed", "walking",
+        # Health
+        "health", "maxHealth", "deathSound"
+    )
+
+    def __init__(self, pos, actorName, maxHealth, maxSpeed, colliderName):
+        # Our Actor is a copy of a template held by the asset-
+        # registry, which saves loading its model and animations.
+        self.actor = base.assets.makeActor(actorName)
         self.actor.reparentTo(render)
         self.actor.setPos(pos)
 
+        self.animations = AnimationStateMachine(self.actor, self.animationStates)
+
         self.maxHealth = maxHealth
         self.health = maxHealth
 
@@ -27,40 +64,98 @@ class GameObject():
         self.velocity = Vec3(0, 0, 0)
         self.acceleration = 300.0
 
+        self.interpolatedPos = Point3()
+
         self.walking = False
 
+        self.colliderRadius = 0.3
+
         colliderNode = CollisionNode(colliderName)
-        colliderNode.addSolid(CollisionSphere(0, 0, 0, 0.3))
+        colliderNode.addSolid(CollisionSphere(0, 0, 0, self.colliderRadius))
         self.collider = self.actor.attachNewNode(colliderNode)
-        self.collider.setPythonTag("owner", self)
 
+        # The name of the sound to play on dying, if any.
+        # (Sounds are played by the game's sound-manager,
+        #  rather than held by each object.)
         self.deathSound = None
 
+        self.resetSimState()
+
+        # The game finds us by our ID--or by our collider,
+        # when it's hit by something
+        self.entityId = base.entities.register(self)
+
+    def resetSimState(self):
+        # The game simulates in fixed steps, and draws us part-way
+        # between where we were at the last two steps. These hold
+        # those two positions and headings.
+        self.simPos = self.actor.getPos()
+        self.simH = self.actor.getH()
+        self.previousSimPos = Point3(self.simPos)
+        self.previousSimH = self.simH
+
+        # Our position, as set by each update, and shared
+        # by whatever else needs it that step. (It's kept,
+        # and updated in place, from here on.)
+        self.position = self.actor.getPos()
+
+    def storeSimState(self):
+        # Called at the end of each simulation-step
+        self.previousSimPos, self.simPos = self.simPos, self.actor.getPos()
+        self.previousSimH, self.simH = self.simH, self.actor.getH()
+
+    def interpolate(self, alpha):
+        # Place our Actor "alpha" of the way from our
+        # previous step's position to our latest one.
+        # (Take the short way around for the heading.)
+        # (NodePath's "setPos" makes an object of its own when
+        #  given three numbers, but not when given a point.)
+        simPos = self.simPos
+        previousSimPos = self.previousSimPos
+        position = self.interpolatedPos
+        position.x = previousSimPos.x + (simPos.x - previousSimPos.x)*alpha
+        position.y = previousSimPos.y + (simPos.y - previousSimPos.y)*alpha
+        position.z = previousSimPos.z + (simPos.z - previousSimPos.z)*alpha
+        self.actor.setPos(position)
+        headingChange = (self.simH - self.previousSimH + 180.0) % 360.0 - 180.0
+        self.actor.setH(self.previousSimH + headingChange*alpha)
+
+    def restoreSimState(self):
+        # Put our Actor back where the simulation left it
+        self.actor.setPos(self.simPos)
+        self.actor.setH(self.simH)
+
     def update(self, dt):
+        # (Everything here works on our vectors in place.)
+        velocity = self.velocity
+
         # If we're going faster than our maximum speed,
         # set the velocity-vector's length to that maximum
-        speed = self.velocity.length()
+        speed = math.sqrt(velocity.x*velocity.x + velocity.y*velocity.y + velocity.z*velocity.z)
         if speed > self.maxSpeed:
-            self.velocity.normalize()
-            self.velocity *= self.maxSpeed
+            velocity *= self.maxSpeed/speed
             speed = self.maxSpeed
 
         # If we're walking, don't worry about friction.
-        # Otherwise, use friction to slow us down.
+        # Otherwise, use friction to slow us down--that is,
+        # to shorten our velocity-vector.
         if not self.walking:
             frictionVal = FRICTION*dt
-            if frictionVal > speed:
-                self.velocity.set(0, 0, 0)
+            if frictionVal >= speed:
+                velocity.x = velocity.y = velocity.z = 0.0
             else:
-                frictionVec = -self.velocity
-                frictionVec.normalize()
-                frictionVec *= frictionVal
-
-                self.velocity += frictionVec
+                velocity *= (speed - frictionVal)/speed
 
         # Move the character, using our velocity and
-        # the time since the last update.
-        self.actor.setPos(self.actor.getPos() + self.velocity*dt)
+        # the time since the last update. (We start from
+        # our Actor, rather than from our last position,
+        # since collisions may have pushed it since.)
+        actor = self.actor
+        position = self.position
+        position.x = actor.getX() + velocity.x*dt
+        position.y = actor.getY() + velocity.y*dt
+        position.z = actor.getZ() + velocity.z*dt
+        actor.setPos(position)
 
     def alterHealth(self, dHealth):
         previousHealth = self.health
@@ -68,14 +163,17 @@ class GameObject():
 
         if self.health > self.maxHealth:
             self.health = self.maxHealth
-        if previousHealth > 0 and self.health <= 0 and self.deathSound is not None:
-            self.deathSound.play()
+        if previousHealth > 0 and self.health <= 0:
+            base.entities.setState(self, STATE_DYING)
+            if self.deathSound is not None:
+                base.sounds.play(self.deathSound)
 
     def cleanup(self):
-        # Remove various nodes, and clear the Python-tag--see below!
+        # Leave the registry, and remove various nodes
+
+        base.entities.unregister(self)
 
         if self.collider is not None and not self.collider.isEmpty():
-            self.collider.clearPythonTag("owner")
             base.cTrav.removeCollider(self.collider)
             base.pusher.removeCollider(self.collider)
 
@@ -87,14 +185,26 @@ class GameObject():
         self.collider = None
 
 class Player(GameObject):
+    animationStates = {
+        "stand" : AnimationState("stand", loop = True),
+        "walk" : AnimationState("walk", loop = True)
+    }
+
+    __slots__ = (
+        # The laser, and its effects
+        "firingDirection", "firing", "beamModel", "beamHitModel", "beamHitPulseRate",
+        "beamHitTimer", "damagePerSecond", "beamHitLight", "beamHitLightNodePath",
+        "beamHitPos", "laserSoundNoHit", "laserSoundHit",
+        # Being hurt
+        "damageTakenModel", "damageTakenModelTimer", "damageTakenModelDuration",
+        # Score, the HUD, and telemetry
+        "score", "scoreUI", "healthIcons", "kills", "damageTaken", "laserOnTime", "log"
+    )
+
     def __init__(self):
         GameObject.__init__(self,
                             Vec3(0, 0, 0),
-                            "Models/PandaChan/act_p3d_chan",
-                              {
-                                  "stand" : "Models/PandaChan/a_p3d_chan_idle",
-                                  "walk" : "Models/PandaChan/a_p3d_chan_run"
-                              },
+                            "player",
                             5,
                             10,
                             "player")
@@ -121,45 +231,17 @@ class Player(GameObject):
         base.pusher.addCollider(self.collider, self.actor)
         base.cTrav.addCollider(self.collider, base.pusher)
         
-        # This stores the previous position of the mouse,
-        # as a fall-back in case we don't get a good position
-        # on a given update.
-        self.lastMousePos = Vec2(0, 0)
-
-        # Construct a plane facing upwards, and centred at (0, 0, 0)
-        self.groundPlane = Plane(Vec3(0, 0, 1), Vec3(0, 0, 0))
-        
         #Lasers
-        self.ray = CollisionRay(0, 0, 0, 0, 1, 0)
-
-        rayNode = CollisionNode("playerRay")
-        rayNode.addSolid(self.ray)
-
-        # After we've made our ray-node:
-        mask = BitMask32()
-
-        # Note that we set a different bit here!
-        # This means that the ray's mask and
-        # the collider's mask don't match, and
-        # so the ray won't collide with the
-        # collider.
-        mask.setBit(2)
-        rayNode.setFromCollideMask(mask)
-
-        mask = BitMask32()
-        rayNode.setIntoCollideMask(mask)                
-
-        self.rayNodePath = render.attachNewNode(rayNode)
-        self.rayQueue = CollisionHandlerQueue()
-
-        # We want this ray to collide with things, so
-        # tell our traverser about it. However, note that,
-        # unlike with "CollisionHandlerPusher", we don't
-        # have to tell our "CollisionHandlerQueue" about it.
-        base.cTrav.addCollider(self.rayNodePath, self.rayQueue)
+        # What the laser hits is worked out by the game, only
+        # while we're firing (see "Hitscan.py"). This is the
+        # direction that we last aimed in.
+        self.firingDirection = Vec3(0, 1, 0)
+        self.firing = False
+        # And where the beam last hit something
+        self.beamHitPos = Point3()
 
         # A nice laser-beam model to show our laser
-        self.beamModel = loader.loadModel("Models/Misc/bambooLaser")
+        self.beamModel = base.assets.makeModel("Models/Misc/bambooLaser")
         self.beamModel.reparentTo(self.actor)
         self.beamModel.setZ(1.5)
         # This prevents lights from affecting this particular node
@@ -168,7 +250,7 @@ class Player(GameObject):
         # we have it initially hidden.
         self.beamModel.hide()
 
-        self.beamHitModel = loader.loadModel("Models/Misc/bambooLaserHit")
+        self.beamHitModel = base.assets.makeModel("Models/Misc/bambooLaserHit")
         self.beamHitModel.reparentTo(render)
         self.beamHitModel.setZ(1.5)
         self.beamHitModel.setLightOff()
@@ -181,21 +263,33 @@ class Player(GameObject):
 
         self.score = 0
 
-        self.scoreUI = OnscreenText(text = "0",
-                                    pos = (-1.3, 0.825),
-                                    mayChange = True,
-                                    align = TextNode.ALeft,
-                                    font = base.font)
+        # Running totals, for the game's telemetry
+        self.kills = 0
+        self.damageTaken = 0.0
+        self.laserOnTime = 0.0
 
+        # Our debug-messages go to the telemetry's log,
+        # rather than being printed
+        self.log = base.telemetry.getChannel("player")
+
+        # A headless game has no window to show a HUD in
+        self.scoreUI = None
         self.healthIcons = []
-        for i in range(self.maxHealth):
-            icon = OnscreenImage(image = "UI/health.png",
-                                 pos = (-1.275 + i*0.075, 0, 0.95),
-                                 scale = 0.04)
-            icon.setTransparency(True)
-            self.healthIcons.append(icon)
-
-        self.damageTakenModel = loader.loadModel("Models/Misc/playerHit")
+        if not base.headless:
+            self.scoreUI = OnscreenText(text = "0",
+                                        pos = (-1.3, 0.825),
+                                        mayChange = True,
+                                        align = TextNode.ALeft,
+                                        font = base.font)
+
+            for i in range(self.maxHealth):
+                icon = OnscreenImage(image = base.assets.getTexture("UI/health.png"),
+                                     pos = (-1.275 + i*0.075, 0, 0.95),
+                                     scale = 0.04)
+                icon.setTransparency(True)
+                self.healthIcons.append(icon)
+
+        self.damageTakenModel = base.assets.makeModel("Models/Misc/playerHit")
         self.damageTakenModel.setLightOff()
         self.damageTakenModel.setZ(1.0)
         self.damageTakenModel.reparentTo(self.actor)
@@ -204,99 +298,76 @@ class Player(GameObject):
         self.damageTakenModelTimer = 0
         self.damageTakenModelDuration = 0.15
 
-        self.laserSoundNoHit = loader.loadSfx("Sounds/laserNoHit.ogg")
-        self.laserSoundNoHit.setLoop(True)
-        self.laserSoundHit = loader.loadSfx("Sounds/laserHit.ogg")
-        self.laserSoundHit.setLoop(True)
+        # The IDs of our looping laser-sounds, while they play
+        self.laserSoundNoHit = None
+        self.laserSoundHit = None
 
         self.beamHitLight = PointLight("beamHitLight")
         self.beamHitLight.setColor(Vec4(0.1, 1.0, 0.2, 1))
         self.beamHitLight.setAttenuation((1.0, 0.1, 0.5))
         self.beamHitLightNodePath = render.attachNewNode(self.beamHitLight)
 
-        self.hurtSound = loader.loadSfx("Sounds/FemaleDmgNoise.ogg")
-
-        # This vector is used to calculate the orientation for
-        # the character's model. Since the character faces along
-        # the y-direction, we use the y-axis.
-        self.yVector = Vec2(0, 1)
+        self.animations.request("stand")
 
-        self.actor.loop("stand")
-
-    def update(self, keys, dt):
+    def update(self, keys, aimPoint, dt):
         GameObject.update(self, dt)
 
+        self.updateMovement(keys, dt)
+        self.updateAim(aimPoint)
+        self.updateBeam(keys, dt)
+        self.updateDamageTaken(dt)
+
+    def updateMovement(self, keys, dt):
         self.walking = False
 
         # If we're  pushing a movement key, add a relevant amount
         # to our velocity.
+        velocity = self.velocity
         if keys["up"]:
             self.walking = True
-            self.velocity.addY(self.acceleration*dt)
+            velocity.y += self.acceleration*dt
         if keys["down"]:
             self.walking = True
-            self.velocity.addY(-self.acceleration*dt)
+            velocity.y -= self.acceleration*dt
         if keys["left"]:
             self.walking = True
-            self.velocity.addX(-self.acceleration*dt)
+            velocity.x -= self.acceleration*dt
         if keys["right"]:
             self.walking = True
-            self.velocity.addX(self.acceleration*dt)
+            velocity.x += self.acceleration*dt
         
 
         # Run the appropriate animation for our current state.
-        # See the text below this for an explanation
+        # (Requesting the loop that's already playing does nothing.)
         if self.walking:
-            standControl = self.actor.getAnimControl("stand")
-            if standControl.isPlaying():
-                standControl.stop()
-
-            walkControl = self.actor.getAnimControl("walk")
-            if not walkControl.isPlaying():
-                self.actor.loop("walk")
+            self.animations.request("walk")
         else:
-            standControl = self.actor.getAnimControl("stand")
-            if not standControl.isPlaying():
-                self.actor.stop("walk")
-                self.actor.loop("stand")
-
-        # It's possible that we'll find that we
-        # don't have the mouse--such as if the pointer
-        # is outside of the game-window. In that case,
-        # just use the previous position.
-        mouseWatcher = base.mouseWatcherNode
-        if mouseWatcher.hasMouse():
-            mousePos = mouseWatcher.getMouse()
-        else:
-            mousePos = self.lastMousePos
-
-        mousePos3D = Point3()
-        nearPoint = Point3()
-        farPoint = Point3()
-
-        # Get the 3D line corresponding with the 
-        # 2D mouse-position.
-        # The "extrude" method will store its result in the
-        # "nearPoint" and "farPoint" objects.
-        base.camLens.extrude(mousePos, nearPoint, farPoint)
-
-        # Get the 3D point at which the 3D line
-        # intersects our ground-plane.
-        # Similarly to the above, the "intersectsLine" method
-        # will store its result in the "mousePos3D" object.
-        self.groundPlane.intersectsLine(mousePos3D,
-                                        render.getRelativePoint(base.camera, nearPoint),
-                                        render.getRelativePoint(base.camera, farPoint))
-
-        firingVector = Vec3(mousePos3D - self.actor.getPos())
-        firingVector2D = firingVector.getXy()
-        firingVector2D.normalize()
-        firingVector.normalize()
-
-        heading = self.yVector.signedAngleDeg(firingVector2D)
-
-        self.actor.setH(heading)
-
+            self.animations.request("stand")
+
+    def updateAim(self, aimPoint):
+        # The aim-point is the spot on the ground-plane that
+        # our input-source says we're pointing at.
+        position = self.position
+        aimX = aimPoint.x - position.x
+        aimY = aimPoint.y - position.y
+        aimZ = aimPoint.z - position.z
+
+        # (If we're aiming right at our own feet, we keep
+        #  facing, and firing, in the direction that we were.)
+        if math.sqrt(aimX*aimX + aimY*aimY + aimZ*aimZ) > 0.001:
+            # Face along it. (Since the character faces along the
+            # y-direction, that's the angle from the y-axis.)
+            self.actor.setH(math.degrees(math.atan2(-aimX, aimY)))
+
+            # And fire along it, on the ground
+            groundLength = math.sqrt(aimX*aimX + aimY*aimY)
+            if groundLength > 0:
+                firingDirection = self.firingDirection
+                firingDirection.x = aimX/groundLength
+                firingDirection.y = aimY/groundLength
+                firingDirection.z = 0.0
+
+    def updateBeam(self, keys, dt):
         # In short, run a timer, and use the timer in a sine-function
         # to pulse the scale of the beam-hit model. When the timer
         # runs down (and the scale is at its lowest), reset the timer
@@ -304,68 +375,14 @@ class Player(GameObject):
         self.beamHitTimer -= dt
         if self.beamHitTimer <= 0:
             self.beamHitTimer = self.beamHitPulseRate
-            self.beamHitModel.setH(random.uniform(0.0, 360.0))
+            self.beamHitModel.setH(base.randomStreams.effects.uniform(0.0, 360.0))
         self.beamHitModel.setScale(math.sin(self.beamHitTimer*3.142/self.beamHitPulseRate)*0.4 + 0.9)
        
-        # If we're pressing the "shoot" button, check
-        # whether the ray has hit anything, and if so,
-        # examine the collision-entry for the first hit.
-        # If the thing hit has an "owner" Python-tag, then
-        # it's a GameObject, and should try to take damage--
-        # with the exception if "TrapEnemies",
-        # which are invulnerable.
-        if keys["shoot"]:
-            if self.rayQueue.getNumEntries() > 0:
-                scoredHit = False                
-                self.rayQueue.sortEntries()
-                rayHit = self.rayQueue.getEntry(0)
-                hitPos = rayHit.getSurfacePoint(render)
-
-                hitNodePath = rayHit.getIntoNodePath()
-                print (hitNodePath)
-                if hitNodePath.hasPythonTag("owner"):
-                    hitObject = hitNodePath.getPythonTag("owner")
-                    if not isinstance(hitObject, TrapEnemy):
-                        hitObject.alterHealth(self.damagePerSecond*dt)
-                        scoredHit = True
-                
-                # Find out how long the beam is, and scale the
-                # beam-model accordingly.
-                beamLength = (hitPos - self.actor.getPos()).length()
-                self.beamModel.setSy(beamLength)
-
-                self.beamModel.show()
-
-                if scoredHit:
-                    if self.laserSoundNoHit.status() == AudioSound.PLAYING:
-                        self.laserSoundNoHit.stop()
-                    if self.laserSoundHit.status() != AudioSound.PLAYING:
-                        self.laserSoundHit.play()
-
-                    self.beamHitModel.show()
-
-                    self.beamHitModel.setPos(hitPos)
-                    self.beamHitLightNodePath.setPos(hitPos + Vec3(0, 0, 0.5))
-
-                    # If the light hasn't already been set here, set it
-                    if not render.hasLight(self.beamHitLightNodePath):
-                        # Apply the light to the scene, so that it
-                        # illuminates things
-                        render.setLight(self.beamHitLightNodePath)
-                else:
-                    if self.laserSoundHit.status() == AudioSound.PLAYING:
-                        self.laserSoundHit.stop()
-                    if self.laserSoundNoHit.status() != AudioSound.PLAYING:
-                        self.laserSoundNoHit.play()
-
-                    # If the light has been set here, remove it
-                    # See explanation in the tutorial-text below...
-                    if render.hasLight(self.beamHitLightNodePath):
-                        # Clear the light from the scene, so that it
-                        # no longer illuminates anything
-                        render.clearLight(self.beamHitLightNodePath)
-
-                    self.beamHitModel.hide()
+        # Whether we're firing; if so, the game works out
+        # what our beam hits, and calls "fireLaser".
+        self.firing = keys["shoot"]
+        if self.firing:
+            self.laserOnTime += dt
         else:
             if render.hasLight(self.beamHitLightNodePath):
                 # Clear the light from the scene
@@ -375,37 +392,103 @@ class Player(GameObject):
             self.beamModel.hide()
             self.beamHitModel.hide()
 
-            if self.laserSoundNoHit.status() == AudioSound.PLAYING:
-                self.laserSoundNoHit.stop()
-            if self.laserSoundHit.status() == AudioSound.PLAYING:
-                self.laserSoundHit.stop()
-
-        if firingVector.length() > 0.001:
-            self.ray.setOrigin(self.actor.getPos())
-            self.ray.setDirection(firingVector)
-
-        self.lastMousePos = mousePos
+            self.stopLaserSound("laserSoundNoHit")
+            self.stopLaserSound("laserSoundHit")
 
+    def updateDamageTaken(self, dt):
         if self.damageTakenModelTimer > 0:
             self.damageTakenModelTimer -= dt
             self.damageTakenModel.setScale(2.0 - self.damageTakenModelTimer/self.damageTakenModelDuration)
             if self.damageTakenModelTimer <= 0:
                 self.damageTakenModel.hide()
 
+    def fireLaser(self, hitObject, beamLength, dt):
+        # Our beam has hit something "beamLength" away--if
+        # nothing else, a wall (in which case "hitObject" is None).
+        # If the thing hit is a GameObject, it should try to
+        # take damage--with the exception of "TrapEnemies",
+        # which are invulnerable.
+        scoredHit = False
+
+        if hitObject is not None and not isinstance(hitObject, TrapEnemy):
+            hitObject.alterHealth(self.damagePerSecond*dt)
+            scoredHit = True
+
+        # (This runs every step that the laser fires, so we check
+        # the channel's level before building the message's
+        # arguments, rather than have "debug" throw them away.)
+        if self.log.isEnabledFor(LEVEL_DEBUG):
+            self.log.debug("Laser hit %s, %.2f away", type(hitObject).__name__, beamLength)
+
+        # Scale the beam-model to the beam's length.
+        self.beamModel.setSy(beamLength)
+
+        self.beamModel.show()
+
+        self.updateLaserSound(scoredHit)
+
+        if scoredHit:
+            self.beamHitModel.show()
+
+            position = self.position
+            firingDirection = self.firingDirection
+            hitPos = self.beamHitPos
+            hitPos.x = position.x + firingDirection.x*beamLength
+            hitPos.y = position.y + firingDirection.y*beamLength
+            hitPos.z = position.z + firingDirection.z*beamLength
+            self.beamHitModel.setPos(hitPos)
+            hitPos.z += 0.5
+            self.beamHitLightNodePath.setPos(hitPos)
+
+            # If the light hasn't already been set here, set it
+            if not render.hasLight(self.beamHitLightNodePath):
+                # Apply the light to the scene, so that it
+                # illuminates things
+                render.setLight(self.beamHitLightNodePath)
+        else:
+            # If the light has been set here, remove it
+            # See explanation in the tutorial-text below...
+            if render.hasLight(self.beamHitLightNodePath):
+                # Clear the light from the scene, so that it
+                # no longer illuminates anything
+                render.clearLight(self.beamHitLightNodePath)
+
+            self.beamHitModel.hide()
+
+    def updateLaserSound(self, scoredHit):
+        # Loop the sound for a beam that's hitting something,
+        # or the one for a beam that isn't--but not both
+        if scoredHit:
+            self.stopLaserSound("laserSoundNoHit")
+            if not base.sounds.isPlaying(self.laserSoundHit):
+                self.laserSoundHit = base.sounds.play("laserHit", loop = True)
+        else:
+            self.stopLaserSound("laserSoundHit")
+            if not base.sounds.isPlaying(self.laserSoundNoHit):
+                self.laserSoundNoHit = base.sounds.play("laserNoHit", loop = True)
+
+    def stopLaserSound(self, soundAttribute):
+        playId = getattr(self, soundAttribute)
+        if playId is not None:
+            base.sounds.stop(playId)
+            setattr(self, soundAttribute, None)
 
     def updateScore(self):
-        self.scoreUI.setText(str(self.score))
+        if self.scoreUI is not None:
+            self.scoreUI.setText(str(self.score))
 
     def alterHealth(self, dHealth):
         GameObject.alterHealth(self, dHealth)
+        if dHealth < 0:
+            self.damageTaken -= dHealth
 
         self.updateHealthUI()
 
         self.damageTakenModel.show()
-        self.damageTakenModel.setH(random.uniform(0.0, 360.0))
+        self.damageTakenModel.setH(base.randomStreams.effects.uniform(0.0, 360.0))
         self.damageTakenModelTimer = self.damageTakenModelDuration
 
-        self.hurtSound.play()
+        base.sounds.play("playerHurt")
 
     def updateHealthUI(self):
         for index, icon in enumerate(self.healthIcons):
@@ -415,17 +498,16 @@ class Player(GameObject):
                 icon.hide()
     
     def cleanup(self):
-        self.scoreUI.removeNode()
+        if self.scoreUI is not None:
+            self.scoreUI.removeNode()
 
         for icon in self.healthIcons:
             icon.removeNode()
 
         self.beamHitModel.removeNode()
 
-        base.cTrav.removeCollider(self.rayNodePath)
-
-        self.laserSoundHit.stop()
-        self.laserSoundNoHit.stop()
+        self.stopLaserSound("laserSoundHit")
+        self.stopLaserSound("laserSoundNoHit")
 
         render.clearLight(self.beamHitLightNodePath)
         self.beamHitLightNodePath.removeNode()
@@ -433,13 +515,24 @@ class Player(GameObject):
         GameObject.cleanup(self)
 
 class Enemy(GameObject):
-    def __init__(self, pos, modelName, modelAnims, maxHealth, maxSpeed, colliderName):
-        GameObject.__init__(self, pos, modelName, modelAnims, maxHealth, maxSpeed, colliderName)
+    __slots__ = ("scoreValue", "hordeIndex", "crowdIndex", "enemyIndex")
+
+    def __init__(self, pos, actorName, maxHealth, maxSpeed, colliderName):
+        GameObject.__init__(self, pos, actorName, maxHealth, maxSpeed, colliderName)
 
         # This is the number of points to award
         # if the enemy is killed.
         self.scoreValue = 1
 
+        # Our slot in the game's batched horde, if we're in it
+        # (see "Horde.py")
+        self.hordeIndex = None
+        # And our instance in the game's crowd-renderer, if
+        # that's what draws us (see "CrowdRenderer.py")
+        self.crowdIndex = None
+        # And our slot in the game's list of live enemies
+        self.enemyIndex = None
+
     def update(self, player, dt):
         # In short, update as a GameObject, then
         # run whatever enemy-specific logic is to be done.
@@ -447,39 +540,50 @@ class Enemy(GameObject):
         # allows us to customise that specific logic
         # to the enemy, without re-writing the rest.
 
+        self.animations.update(dt)
+
         GameObject.update(self, dt)
 
         self.runLogic(player, dt)
 
-        # As with the player, play the appropriate animation.
+        # As with the player, play the appropriate animation--
+        # but let a one-off animation, such as spawning or
+        # attacking, finish before standing.
         if self.walking:
-            walkingControl = self.actor.getAnimControl("walk")
-            if not walkingControl.isPlaying():
-                self.actor.loop("walk")
-        else:
-            spawnControl = self.actor.getAnimControl("spawn")
-            if spawnControl is None or not spawnControl.isPlaying():
-                attackControl = self.actor.getAnimControl("attack")
-                if attackControl is None or not attackControl.isPlaying():
-                    standControl = self.actor.getAnimControl("stand")
-                    if not standControl.isPlaying():
-                        self.actor.loop("stand")
-
+            self.animations.request("walk")
+        elif self.animations.timeLeft <= 0:
+            self.animations.request("stand")
 
     def runLogic(self, player, dt):
         pass
 
+    def alterHealth(self, dHealth):
+        wasAlive = self.health > 0
+        GameObject.alterHealth(self, dHealth)
+
+        # Let the game know that we've died, so that
+        # it needn't look through every enemy for us
+        if wasAlive and self.health <= 0 and self.enemyIndex is not None:
+            base.enemyDied(self)
+
 class WalkingEnemy(Enemy):
+    animationStates = {
+        "stand" : AnimationState("stand", loop = True),
+        "walk" : AnimationState("walk", loop = True),
+        "spawn" : AnimationState("spawn"),
+        "attack" : AnimationState("attack"),
+        "die" : AnimationState("die")
+    }
+
+    __slots__ = (
+        # Attacking
+        "attackDistance", "attackDelay", "attackDelayTimer", "attackWaitTimer",
+        "attackMask", "attackDamage"
+    )
+
     def __init__(self, pos):
         Enemy.__init__(self, pos,
-                       "Models/Misc/simpleEnemy",
-                       {
-                        "stand" : "Models/Misc/simpleEnemy-stand",
-                        "walk" : "Models/Misc/simpleEnemy-walk",
-                        "attack" : "Models/Misc/simpleEnemy-attack",
-                        "die" : "Models/Misc/simpleEnemy-die",
-                        "spawn" : "Models/Misc/simpleEnemy-spawn"
-                        },
+                       "walkingEnemy",
                        3.0,
                        7.0,
                        "walkingEnemy")
@@ -495,96 +599,99 @@ class WalkingEnemy(Enemy):
 
         self.collider.node().setIntoCollideMask(mask)
 
-        self.attackSegment = CollisionSegment(0, 0, 0, 1, 0, 0)
-        
-        segmentNode = CollisionNode("enemyAttackSegment")
-        segmentNode.addSolid(self.attackSegment)
-
         # A mask that matches the player's, so that
         # the enemy's attack will hit the player-character,
-        # but not the enemy-character (or other enemies)
-        mask = BitMask32()
-        mask.setBit(1)
+        # but not the enemy-character (or other enemies).
+        # Attacks are checked against the game's spatial grid
+        # only when they land, rather than by a collision-
+        # segment that's traversed every frame.
+        self.attackMask = BitMask32()
+        self.attackMask.setBit(1)
 
-        segmentNode.setFromCollideMask(mask)
+        # How much damage the enemy's attack does
+        # That is, this results in the player-character's
+        # health being reduced by one.
+        self.attackDamage = -1
 
-        mask = BitMask32()
+        self.deathSound = "enemyDie"
 
-        segmentNode.setIntoCollideMask(mask)
+        self.animations.request("spawn")
 
-        self.attackSegmentNodePath = render.attachNewNode(segmentNode)
-        self.segmentQueue = CollisionHandlerQueue()
+    def park(self):
+        # Take this enemy out of play without destroying it,
+        # so that it can be brought back later by "activate".
+        # Its Actor leaves the scene-graph, and its collider
+        # is stashed (and so ignored by collisions).
+        self.animations.stop()
+        self.actor.detachNode()
+        self.collider.stash()
+        base.entities.setState(self, STATE_PARKED)
 
-        base.cTrav.addCollider(self.attackSegmentNodePath, self.segmentQueue)
+    def activate(self, pos):
+        # Bring a parked enemy back into play as though new
+        self.actor.reparentTo(render)
+        self.actor.setPos(pos)
+        self.actor.setH(0)
+        self.resetSimState()
 
-        # How much damage the enemy's attack does
-        # That is, this results in the player-character's
-        # health being reduced by one.
-        self.attackDamage = -1
+        self.health = self.maxHealth
+        self.updateHealthVisual()
 
-        self.deathSound = loader.loadSfx("Sounds/enemyDie.ogg")
-        self.attackSound = loader.loadSfx("Sounds/enemyAttack.ogg")
+        self.velocity.set(0, 0, 0)
+        self.walking = False
+        self.attackDelayTimer = 0
+        self.attackWaitTimer = 0
 
-        # A reference vector, used to determine
-        # which way to face the Actor.
-        # Since the character faces along
-        # the y-direction, we use the y-axis.
-        self.yVector = Vec2(0, 1)
+        self.collider.unstash()
+        base.entities.setState(self, STATE_ALIVE)
 
-        self.actor.play("spawn")
+        self.animations.request("spawn")
 
     def runLogic(self, player, dt):
-        spawnControl = self.actor.getAnimControl("spawn")
-        if spawnControl is not None and spawnControl.isPlaying():
+        if self.animations.state == "spawn":
             return
 
         # In short: find the vector between
-        # this enemy and the player.
+        # this enemy and the player (on the ground).
         # If the enemy is far from the player,
         # use that vector to move towards the player.
         # Otherwise, just stop for now.
         # Finally, face the player.
-        vectorToPlayer = player.actor.getPos() - self.actor.getPos()
-
-        vectorToPlayer2D = vectorToPlayer.getXy()
-        distanceToPlayer = vectorToPlayer2D.length()
+        # (As in "GameObject.update", this is all done
+        #  component by component.)
+        playerPos = player.position
+        position = self.position
+        toPlayerX = playerPos.x - position.x
+        toPlayerY = playerPos.y - position.y
 
-        vectorToPlayer2D.normalize()
+        distanceToPlayer = math.sqrt(toPlayerX*toPlayerX + toPlayerY*toPlayerY)
 
-        heading = self.yVector.signedAngleDeg(vectorToPlayer2D)
-
-        self.attackSegment.setPointA(self.actor.getPos())
-        self.attackSegment.setPointB(self.actor.getPos() + self.actor.getQuat().getForward()*self.attackDistance)
+        # Since the character faces along the y-direction,
+        # our heading is the angle from the y-axis.
+        heading = math.degrees(math.atan2(-toPlayerX, toPlayerY))
 
         if distanceToPlayer > self.attackDistance*0.9:
-            attackControl = self.actor.getAnimControl("attack")
-            if not attackControl.isPlaying():
+            if self.animations.state != "attack":
                 self.walking = True
-                vectorToPlayer.setZ(0)
-                vectorToPlayer.normalize()
-                self.velocity += vectorToPlayer*self.acceleration*dt
+                speedChange = self.acceleration*dt/distanceToPlayer
+                velocity = self.velocity
+                velocity.x += toPlayerX*speedChange
+                velocity.y += toPlayerY*speedChange
                 self.attackWaitTimer = 0.2
                 self.attackDelayTimer = 0
         else:
             self.walking = False
-            self.velocity.set(0, 0, 0)
+            velocity = self.velocity
+            velocity.x = velocity.y = velocity.z = 0.0
 
             # If we're waiting for an attack to land...
             if self.attackDelayTimer > 0:
                 self.attackDelayTimer -= dt
                 # If the time has come for the attack to land...
                 if self.attackDelayTimer <= 0:
-                    # Check for a hit..
-                    if self.segmentQueue.getNumEntries() > 0:
-                        self.segmentQueue.sortEntries()
-                        segmentHit = self.segmentQueue.getEntry(0)
-
-                        hitNodePath = segmentHit.getIntoNodePath()
-                        if hitNodePath.hasPythonTag("owner"):
-                            # Apply damage!
-                            hitObject = hitNodePath.getPythonTag("owner")
-                            hitObject.alterHealth(self.attackDamage)
-                            self.attackWaitTimer = 1.0
+                    # Have it checked for a hit, along with
+                    # any others that land this step
+                    base.pendingAttacks.append(self)
             # If we're instead waiting to be allowed to attack...
             elif self.attackWaitTimer > 0:
                 self.attackWaitTimer -= dt
@@ -593,16 +700,51 @@ class WalkingEnemy(Enemy):
                     # Start an attack!
                     # (And set the wait-timer to a random amount,
                     #  to vary things a little bit.)
-                    self.attackWaitTimer = random.uniform(0.5, 0.7)
+                    self.attackWaitTimer = base.randomStreams.attacks.uniform(0.5, 0.7)
                     self.attackDelayTimer = self.attackDelay
-                    self.actor.play("attack")
-                    self.attackSound.play()
+                    self.startAttack()
 
         self.actor.setH(heading)
+
+    def startAttack(self):
+        # Returns how long the attack-animation lasts
+        duration = self.animations.request("attack")
+        base.sounds.play("enemyAttack")
+        return duration
+
+    def resolveAttack(self):
+        # Called by the game for a landed attack; returns the
+        # number of things that were checked for a hit.
+        numTested = base.spatialGrid.numTested
+        if self.landAttack():
+            if self.hordeIndex is not None:
+                base.horde.setAttackWaitTimer(self, 1.0)
+            else:
+                self.attackWaitTimer = 1.0
+        return base.spatialGrid.numTested - numTested
+
+    def landAttack(self):
+        # Returns whether the attack hit anything.
+        # Our attack reaches "attackDistance" ahead of us;
+        # ask the spatial grid what the first thing is
+        # along that line, if anything.
+        pos = self.actor.getPos()
+        forward = self.actor.getQuat().getForward()
+        hitObject = base.spatialGrid.querySegment(pos.x, pos.y,
+                                                  pos.x + forward.x*self.attackDistance,
+                                                  pos.y + forward.y*self.attackDistance,
+                                                  self.attackMask.getWord(), ignore = self)
+        if hitObject is not None:
+            # Apply damage!
+            hitObject.alterHealth(self.attackDamage)
+            return True
+        return False
     
     def alterHealth(self, dHealth):
         Enemy.alterHealth(self, dHealth)
         self.updateHealthVisual()
+        if self.hordeIndex is not None:
+            base.horde.setHealth(self)
 
     def updateHealthVisual(self):
         perc = self.health/self.maxHealth
@@ -610,22 +752,21 @@ class WalkingEnemy(Enemy):
             perc = 0
         # The parameters here are red, green, blue, and alpha
         self.actor.setColorScale(perc, perc, perc, 1)
-    
-    def cleanup(self):
-        base.cTrav.removeCollider(self.attackSegmentNodePath)
-        self.attackSegmentNodePath.removeNode()
-
-        GameObject.cleanup(self)
+        if self.crowdIndex is not None:
+            base.crowdRenderer.setColorScale(self, perc, perc, perc, 1)
 
 
 class TrapEnemy(Enemy):
+    animationStates = {
+        "stand" : AnimationState("stand", loop = True),
+        "walk" : AnimationState("walk", loop = True)
+    }
+
+    __slots__ = ("moveInX", "moveDirection", "ignorePlayer", "movementSound")
+
     def __init__(self, pos):
         Enemy.__init__(self, pos,
-                       "Models/Misc/trap",
-                       {
-                        "stand" : "Models/Misc/trap-stand",
-                        "walk" : "Models/Misc/trap-walk",
-                        },
+                       "trapEnemy",
                        100.0,
                        10.0,
                        "trapEnemy")
@@ -653,36 +794,48 @@ class TrapEnemy(Enemy):
         # collisions with the player during movement
         self.ignorePlayer = False
 
-        self.impactSound = loader.loadSfx("Sounds/trapHitsSomething.ogg")
-        self.stopSound = loader.loadSfx("Sounds/trapStop.ogg")
-        self.movementSound = loader.loadSfx("Sounds/trapSlide.ogg")
-        self.movementSound.setLoop(True)
+        # The ID of our looping movement-sound, while it plays
+        self.movementSound = None
 
     def runLogic(self, player, dt):
         if self.moveDirection != 0:
             self.walking = True
             if self.moveInX:
-                self.velocity.addX(self.moveDirection*self.acceleration*dt)
+                self.velocity.x += self.moveDirection*self.acceleration*dt
             else:
-                self.velocity.addY(self.moveDirection*self.acceleration*dt)
+                self.velocity.y += self.moveDirection*self.acceleration*dt
         else:
             self.walking = False
-            diff = player.actor.getPos() - self.actor.getPos()
+            playerPos = player.position
+            position = self.position
             if self.moveInX:
-                detector = diff.y
-                movement = diff.x
+                detector = playerPos.y - position.y
+                movement = playerPos.x - position.x
             else:
-                detector = diff.x
-                movement = diff.y
+                detector = playerPos.x - position.x
+                movement = playerPos.y - position.y
 
             if abs(detector) < 0.5:
-                self.moveDirection = math.copysign(1, movement)
-                self.movementSound.play()
+                self.startMoving(math.copysign(1, movement))
+
+    def startMoving(self, direction):
+        self.moveDirection = direction
+        self.movementSound = base.sounds.play("trapSlide", loop = True)
+        base.entities.setState(self, STATE_MOVING)
+
+    def stopMoving(self):
+        self.moveDirection = 0
+        self.ignorePlayer = False
+        base.sounds.stop(self.movementSound)
+        self.movementSound = None
+        base.sounds.play("trapStop")
+        base.entities.setState(self, STATE_ALIVE)
 
     def alterHealth(self, dHealth):
         pass
 
     def cleanup(self):
-        self.movementSound.stop()
+        base.sounds.stop(self.movementSound)
+        self.movementSound = None
 
         Enemy.cleanup(self)
\ No newline at end of file
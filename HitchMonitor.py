@@ -0,0 +1,246 @@
+
+# Catching slow frames in the act. A frame that spikes--an Actor
+# being built for a spawn, a death being cleaned up, shaders being
+# regenerated when a light is toggled--is gone before anyone can
+# look at it. So we keep a rolling record of recent frame-times, and
+# a rolling record of what the game was doing: a second thread
+# samples the main thread's call-stack every few milliseconds. When
+# a frame runs over our threshold, we wait a few frames more, and
+# then save the frame-history and the samples taken around it.
+#
+# Separately, a hotkey (F9) runs the next so-many frames under
+# cProfile, for a full count of calls and times.
+#
+# Everything is saved into "profiles/":
+#  - "*.json": the frame-history (frame-number and milliseconds).
+#  - "*.collapsed": sampled call-stacks, one line per stack with its
+#    count ("outer;inner;innermost 12"), as read by flamegraph-tools
+#    (such as "flamegraph.pl" or speedscope).
+#  - "*.pstats": cProfile's statistics, as read by the "pstats"
+#    module, snakeviz or gprof2dot.
+
+import cProfile, collections, json, os, sys, threading, time
+
+# A frame taking longer than this is a hitch
+HITCH_THRESHOLD_MS = 50.0
+# How many frames of history to keep, and to save before a hitch
+HISTORY_LENGTH = 300
+FRAMES_BEFORE_HITCH = 30
+# And how many frames after it to wait before saving
+FRAMES_AFTER_HITCH = 10
+# How long to wait, after saving a hitch, before catching another
+HITCH_COOLDOWN = 2.0
+
+# How often the main thread's stack is sampled, in seconds, and
+# for how long samples are kept
+SAMPLE_INTERVAL = 0.002
+SAMPLE_HISTORY = 5.0
+
+# How many frames the hotkey runs under cProfile
+CAPTURE_FRAMES = 120
+
+OUTPUT_DIRECTORY = "profiles"
+
+
+class StackSampler():
+    def __init__(self, threadId, interval = SAMPLE_INTERVAL, history = SAMPLE_HISTORY):
+        self.threadId = threadId
+        self.interval = interval
+        # (Time, stack) for each sample; old ones fall off the end
+        self.samples = collections.deque(maxlen = int(history/interval))
+
+        # Code-object -> its label in a stack
+        self.labels = {}
+
+        self.thread = None
+        self.stopEvent = threading.Event()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target = self.run, name = "StackSampler", daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopEvent.set()
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        while not self.stopEvent.wait(self.interval):
+            frame = sys._current_frames().get(self.threadId)
+            if frame is not None:
+                self.samples.append((time.perf_counter(), self.getStack(frame)))
+
+    def getStack(self, frame):
+        # The stack's labels, outermost first
+        labels = self.labels
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                label = "{0} ({1}:{2})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+                labels[code] = label
+            stack.append(label)
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def getSamples(self, startTime, endTime):
+        # (Copied first, as the sampler may add to them meanwhile)
+        return [stack for sampleTime, stack in list(self.samples) if startTime <= sampleTime <= endTime]
+
+
+def writeCollapsed(path, stacks):
+    counts = collections.Counter(stacks)
+    with open(path, "w") as outputFile:
+        for stack, count in sorted(counts.items()):
+            outputFile.write("{0} {1}\n".format(";".join(stack), count))
+
+
+class HitchMonitor():
+    def __init__(self, game, detectHitches = True, threshold = HITCH_THRESHOLD_MS,
+                 outputDirectory = OUTPUT_DIRECTORY):
+        self.game = game
+        self.detectHitches = detectHitches
+        self.threshold = threshold/1000.0
+        self.outputDirectory = outputDirectory
+
+        # (Frame-number, start-time, duration) for recent frames
+        self.history = collections.deque(maxlen = HISTORY_LENGTH)
+        self.lastFrameTime = None
+
+        self.sampler = StackSampler(threading.get_ident())
+        if detectHitches:
+            self.sampler.start()
+
+        # The hitch that we're waiting to save, if any:
+        # its history-entry, and how many frames are left to wait
+        self.pendingHitch = None
+        self.framesUntilSave = 0
+        self.cooldownUntil = 0.0
+        self.numHitches = 0
+
+        # The cProfile-capture under way, if any, and how many
+        # frames it has left; or how many frames the capture
+        # that starts next frame is to run for
+        self.profile = None
+        self.captureFrame = None
+        self.captureStart = None
+        self.framesLeftToCapture = 0
+        self.framesToCapture = 0
+
+        # The paths of everything saved, in order
+        self.savedPaths = []
+
+        # Timed at the very start of each frame
+        self.task = game.taskMgr.add(self.update, "hitchMonitor", sort = -100)
+
+        if not game.headless:
+            game.accept("f9", self.captureFrames)
+
+    def update(self, task):
+        now = time.perf_counter()
+        frameNumber = globalClock.getFrameCount()
+
+        if self.lastFrameTime is not None:
+            duration = now - self.lastFrameTime
+            entry = (frameNumber - 1, self.lastFrameTime, duration)
+            self.history.append(entry)
+            if (self.detectHitches and duration > self.threshold and
+                    self.pendingHitch is None and now >= self.cooldownUntil):
+                self.numHitches += 1
+                self.pendingHitch = entry
+                self.framesUntilSave = FRAMES_AFTER_HITCH
+        self.lastFrameTime = now
+
+        if self.pendingHitch is not None:
+            self.framesUntilSave -= 1
+            if self.framesUntilSave < 0:
+                self.saveHitch()
+                self.cooldownUntil = time.perf_counter() + HITCH_COOLDOWN
+
+        if self.profile is not None:
+            self.framesLeftToCapture -= 1
+            if self.framesLeftToCapture <= 0:
+                self.finishCapture()
+        elif self.framesToCapture > 0:
+            self.startCapture()
+
+        return task.cont
+
+    def makePath(self, name, extension):
+        os.makedirs(self.outputDirectory, exist_ok = True)
+        path = os.path.join(self.outputDirectory, name + extension)
+        self.savedPaths.append(path)
+        return path
+
+    def getHistory(self, startTime):
+        return [{"frame" : frameNumber, "ms" : duration*1000.0}
+                for frameNumber, frameStart, duration in self.history if frameStart >= startTime]
+
+    def saveHitch(self):
+        hitchFrame, hitchStart, hitchDuration = self.pendingHitch
+        self.pendingHitch = None
+
+        # From a few frames before the hitch until now
+        startTime = hitchStart
+        for frameNumber, frameStart, duration in self.history:
+            if frameNumber >= hitchFrame - FRAMES_BEFORE_HITCH:
+                startTime = frameStart
+                break
+        endTime = time.perf_counter()
+
+        name = "hitch-{0}-{1:.0f}ms".format(hitchFrame, hitchDuration*1000.0)
+        with open(self.makePath(name, ".json"), "w") as outputFile:
+            json.dump({
+                "frame" : hitchFrame,
+                "ms" : hitchDuration*1000.0,
+                "thresholdMs" : self.threshold*1000.0,
+                "enemies" : len(self.game.enemies),
+                "deadEnemies" : len(self.game.deadEnemies),
+                "history" : self.getHistory(startTime)
+            }, outputFile, indent = 2)
+        writeCollapsed(self.makePath(name, ".collapsed"), self.sampler.getSamples(startTime, endTime))
+        print("Saved a {0:.0f}ms hitch to {1}".format(hitchDuration*1000.0, os.path.join(self.outputDirectory, name) + ".*"))
+
+    def captureFrames(self, numFrames = CAPTURE_FRAMES):
+        # Run the next "numFrames" frames under cProfile
+        # (and sample them, too, for the collapsed stacks),
+        # from the start of the next frame
+        if self.profile is None:
+            self.framesToCapture = numFrames
+
+    def startCapture(self):
+        self.framesLeftToCapture = self.framesToCapture
+        self.framesToCapture = 0
+        self.captureFrame = globalClock.getFrameCount()
+        self.captureStart = time.perf_counter()
+        self.sampler.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def finishCapture(self):
+        self.profile.disable()
+        name = "capture-{0}".format(self.captureFrame)
+        self.profile.dump_stats(self.makePath(name, ".pstats"))
+        writeCollapsed(self.makePath(name, ".collapsed"),
+                       self.sampler.getSamples(self.captureStart, time.perf_counter()))
+        if not self.detectHitches:
+            self.sampler.stop()
+        self.profile = None
+        print("Saved a profile of {0} frames to {1}".format(globalClock.getFrameCount() - self.captureFrame,
+                                                          os.path.join(self.outputDirectory, name) + ".*"))
+
+    def cleanup(self):
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile = None
+        self.sampler.stop()
+        self.game.taskMgr.remove(self.task)
+        if not self.game.headless:
+            self.game.ignore("f9")
@@ -0,0 +1,81 @@
+
+# Hitscan for the player's laser: rather than a collision-ray that
+# the traverser tests every frame, whether or not we're shooting,
+# we work out what the beam hits only while it's firing--by
+# solving for where the ray meets each enemy's collision-sphere
+# (all at once, where NumPy is available) and the arena's walls.
+#
+# Everything happens in the ground-plane: the beam is fired
+# level, from the player's feet, as the collision-ray was.
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The walls are tubes along the edges of the arena, eight
+# units out, with a radius of 0.2; the beam stops at their
+# inner surfaces.
+WALL_DISTANCE = 8.0 - 0.2
+
+
+def castRayAtWalls(originX, originY, directionX, directionY):
+    # The distance along the ray to the first wall that it meets
+    distance = math.inf
+    if directionX > 0:
+        distance = min(distance, (WALL_DISTANCE - originX)/directionX)
+    elif directionX < 0:
+        distance = min(distance, (-WALL_DISTANCE - originX)/directionX)
+    if directionY > 0:
+        distance = min(distance, (WALL_DISTANCE - originY)/directionY)
+    elif directionY < 0:
+        distance = min(distance, (-WALL_DISTANCE - originY)/directionY)
+    return max(distance, 0.0)
+
+
+def castRayAtCircle(originX, originY, directionX, directionY, centreX, centreY, radius):
+    # The distance along the ray (whose direction should be of
+    # unit length) to where it enters the circle, or None if
+    # it misses. A ray starting inside the circle hits it at once.
+    offsetX = centreX - originX
+    offsetY = centreY - originY
+    along = offsetX*directionX + offsetY*directionY
+    closestSquared = offsetX*offsetX + offsetY*offsetY - along*along
+    radiusSquared = radius*radius
+    if closestSquared > radiusSquared:
+        return None
+    halfChord = math.sqrt(radiusSquared - closestSquared)
+    if along + halfChord < 0:
+        # It's behind us
+        return None
+    return max(along - halfChord, 0.0)
+
+
+def castRayAtCircles(originX, originY, directionX, directionY, centres, radii):
+    # As "castRayAtCircle", but for many circles at once: "centres"
+    # is an N-by-2 array, and "radii" an array of N. Returns the
+    # index of the nearest circle hit and the distance to it,
+    # or (None, inf) if none are.
+    if len(centres) == 0:
+        return None, math.inf
+
+    offsetsX = centres[:, 0] - originX
+    offsetsY = centres[:, 1] - originY
+    along = offsetsX*directionX + offsetsY*directionY
+    halfChordsSquared = radii*radii - (offsetsX*offsetsX + offsetsY*offsetsY - along*along)
+
+    # Only the few circles that the line passes through
+    # need any more work
+    candidates = numpy.flatnonzero(halfChordsSquared >= 0)
+    if len(candidates) == 0:
+        return None, math.inf
+
+    halfChords = numpy.sqrt(halfChordsSquared[candidates])
+    along = along[candidates]
+    distances = numpy.where(along + halfChords >= 0, numpy.maximum(along - halfChords, 0), math.inf)
+    nearest = int(numpy.argmin(distances))
+    if distances[nearest] == math.inf:
+        return None, math.inf
+    return int(candidates[nearest]), float(distances[nearest])
@@ -0,0 +1,300 @@
+
+# Batched movement for the walking horde. Rather than each walking
+# enemy running "GameObject.update" and "runLogic" for itself--with
+# their vector-temporaries, normalisations and so on--the horde
+# keeps the movement-state of every live walking enemy in NumPy
+# arrays, one row per enemy, and steps them all at once: seeking
+# the player, clamping to maximum speed, friction, and facing.
+# The results are then written back to the Actors in one pass.
+#
+# NumPy is optional: without it, the game simply falls back to
+# updating each enemy individually.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from GameObject import FRICTION
+import Hitscan
+
+# The animation that the horde last set looping for an enemy
+LOOP_NONE = 0
+LOOP_WALK = 1
+LOOP_STAND = 2
+
+LOOP_NAMES = {
+    LOOP_WALK : "walk",
+    LOOP_STAND : "stand"
+}
+
+INITIAL_CAPACITY = 64
+
+
+def isAvailable():
+    return numpy is not None
+
+
+class Horde():
+    # While an enemy is in the horde, the horde's arrays--not
+    # the enemy's own "velocity", "walking" and timer attributes--
+    # hold its movement-state; those attributes are brought up
+    # to date when the enemy leaves the horde.
+    #
+    # Positions are read back from the Actors after each collision-
+    # traversal ("readPositions"), since the pusher may have moved
+    # them. (The pusher is horizontal, so only x and y are read.)
+    def __init__(self, spatialGrid, capacity = INITIAL_CAPACITY):
+        # The grid that our enemies are filed in; we keep
+        # it up to date as they move from cell to cell.
+        self.spatialGrid = spatialGrid
+
+        self.enemies = []
+        self.size = 0
+        self.capacity = 0
+
+        # Bound methods for each enemy's Actor, kept
+        # in slot-order, so that reading and writing
+        # transforms doesn't look them up every time
+        self.xGetters = []
+        self.yGetters = []
+        self.transformSetters = []
+
+        self.arrays = {}
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        # The arrays, and the shape of a row of each
+        shapes = {
+            "positions" : (3,),
+            "velocities" : (3,),
+            "headings" : (),
+            "walking" : (),
+            "health" : (),
+            "colliderRadii" : (),
+            "maxSpeeds" : (),
+            "accelerations" : (),
+            "attackDistances" : (),
+            "attackDelays" : (),
+            "attackDelayTimers" : (),
+            "attackWaitTimers" : (),
+            "spawnTimers" : (),
+            "attackAnimTimers" : (),
+            "looping" : (),
+            "gridCells" : (2,)
+        }
+        dtypes = {
+            "walking" : bool,
+            "looping" : numpy.int8,
+            "gridCells" : numpy.int64
+        }
+        for name, shape in shapes.items():
+            newArray = numpy.zeros((capacity,) + shape, dtype = dtypes.get(name, numpy.float64))
+            oldArray = self.arrays.get(name)
+            if oldArray is not None:
+                newArray[:self.size] = oldArray[:self.size]
+            self.arrays[name] = newArray
+            setattr(self, name, newArray)
+        self.capacity = capacity
+
+    def add(self, enemy):
+        if self.size == self.capacity:
+            self.grow(self.capacity*2)
+
+        index = self.size
+        self.size += 1
+        enemy.hordeIndex = index
+        self.enemies.append(enemy)
+
+        actor = enemy.actor
+        self.xGetters.append(actor.getX)
+        self.yGetters.append(actor.getY)
+        self.transformSetters.append(actor.setPosHpr)
+
+        self.positions[index] = actor.getPos()
+        self.gridCells[index] = self.spatialGrid.getCellKey(actor.getX(), actor.getY())
+        self.velocities[index] = enemy.velocity
+        self.headings[index] = actor.getH()
+        self.walking[index] = enemy.walking
+        self.health[index] = enemy.health
+        self.colliderRadii[index] = enemy.colliderRadius
+        self.maxSpeeds[index] = enemy.maxSpeed
+        self.accelerations[index] = enemy.acceleration
+        self.attackDistances[index] = enemy.attackDistance
+        self.attackDelays[index] = enemy.attackDelay
+        self.attackDelayTimers[index] = enemy.attackDelayTimer
+        self.attackWaitTimers[index] = enemy.attackWaitTimer
+
+        # The timed animations are followed by timers of our
+        # own, rather than by each enemy's animation state-machine.
+        # (Only the states that we request are passed on to those.)
+        self.spawnTimers[index] = enemy.animations.getTimeLeft("spawn")
+        self.attackAnimTimers[index] = 0
+        self.looping[index] = LOOP_NONE
+
+    def remove(self, enemy):
+        # Copy the enemy's state back out, then move
+        # the last enemy into its slot.
+        index = enemy.hordeIndex
+        if index is None:
+            return
+
+        enemy.velocity.set(*self.velocities[index])
+        enemy.walking = bool(self.walking[index])
+        enemy.attackDelayTimer = float(self.attackDelayTimers[index])
+        enemy.attackWaitTimer = float(self.attackWaitTimers[index])
+        enemy.hordeIndex = None
+
+        lastIndex = self.size - 1
+        if index != lastIndex:
+            for array in self.arrays.values():
+                array[index] = array[lastIndex]
+            lastEnemy = self.enemies[lastIndex]
+            lastEnemy.hordeIndex = index
+            self.enemies[index] = lastEnemy
+            self.xGetters[index] = self.xGetters[lastIndex]
+            self.yGetters[index] = self.yGetters[lastIndex]
+            self.transformSetters[index] = self.transformSetters[lastIndex]
+
+        self.enemies.pop()
+        self.xGetters.pop()
+        self.yGetters.pop()
+        self.transformSetters.pop()
+        self.size -= 1
+
+    def clear(self):
+        for enemy in list(self.enemies):
+            self.remove(enemy)
+
+    def setHealth(self, enemy):
+        if enemy.hordeIndex is not None:
+            self.health[enemy.hordeIndex] = enemy.health
+
+    def setAttackWaitTimer(self, enemy, waitTime):
+        if enemy.hordeIndex is not None:
+            self.attackWaitTimers[enemy.hordeIndex] = waitTime
+
+    def readPositions(self):
+        size = self.size
+        if size == 0:
+            return
+
+        positions = self.positions[:size]
+        positions[:, 0] = [getX() for getX in self.xGetters]
+        positions[:, 1] = [getY() for getY in self.yGetters]
+
+        # Re-file those that have moved into another cell
+        # of the spatial grid since the last update
+        gridCells = self.gridCells[:size]
+        newGridCells = numpy.floor(positions[:, :2]/self.spatialGrid.cellSize).astype(numpy.int64)
+        for index in numpy.flatnonzero((newGridCells != gridCells).any(axis = 1)).tolist():
+            cellX, cellY = newGridCells[index].tolist()
+            self.spatialGrid.moveToCell(self.enemies[index], (cellX, cellY))
+        gridCells[:] = newGridCells
+
+    def castRay(self, originX, originY, directionX, directionY):
+        # The nearest of our enemies that the ray hits, and how
+        # far along it, or (None, inf)
+        index, distance = Hitscan.castRayAtCircles(originX, originY, directionX, directionY,
+                                                   self.positions[:self.size, :2],
+                                                   self.colliderRadii[:self.size])
+        if index is None:
+            return None, distance
+        return self.enemies[index], distance
+
+    def update(self, player, dt):
+        size = self.size
+        if size == 0:
+            return
+
+        positions = self.positions[:size]
+        velocities = self.velocities[:size]
+        headings = self.headings[:size]
+        walking = self.walking[:size]
+        attackDelayTimers = self.attackDelayTimers[:size]
+        attackWaitTimers = self.attackWaitTimers[:size]
+        spawnTimers = self.spawnTimers[:size]
+        attackAnimTimers = self.attackAnimTimers[:size]
+
+        # The dead are left where they fell
+        alive = self.health[:size] > 0
+
+        # As "GameObject.update": clamp to maximum speed...
+        speeds = numpy.sqrt(numpy.einsum("ij,ij->i", velocities, velocities))
+        maxSpeeds = self.maxSpeeds[:size]
+        tooFast = speeds > maxSpeeds
+        velocities[tooFast] *= (maxSpeeds[tooFast]/speeds[tooFast])[:, None]
+        numpy.minimum(speeds, maxSpeeds, out = speeds)
+
+        # ... slow down those not walking, by friction...
+        frictionVal = FRICTION*dt
+        stopping = ~walking & (speeds <= frictionVal)
+        slowing = ~walking & ~stopping
+        velocities[stopping] = 0
+        velocities[slowing] *= (1.0 - frictionVal/speeds[slowing])[:, None]
+
+        # ... and move.
+        positions[alive] += velocities[alive]*dt
+
+        # As "WalkingEnemy.runLogic": those still spawning do nothing
+        numpy.maximum(spawnTimers - dt, 0, out = spawnTimers)
+        numpy.maximum(attackAnimTimers - dt, 0, out = attackAnimTimers)
+        active = alive & (spawnTimers <= 0)
+
+        # Find the vector to the player, and the heading
+        # that faces along it.
+        playerPos = player.actor.getPos()
+        vectorsToPlayer = numpy.empty((size, 2))
+        vectorsToPlayer[:, 0] = playerPos.x - positions[:, 0]
+        vectorsToPlayer[:, 1] = playerPos.y - positions[:, 1]
+        distances = numpy.hypot(vectorsToPlayer[:, 0], vectorsToPlayer[:, 1])
+        headings[active] = numpy.degrees(numpy.arctan2(-vectorsToPlayer[active, 0], vectorsToPlayer[active, 1]))
+        directions = vectorsToPlayer/numpy.maximum(distances, 1e-6)[:, None]
+
+        attackDistances = self.attackDistances[:size]
+        inRange = active & (distances <= attackDistances*0.9)
+
+        # Far from the player, move towards them
+        # (unless partway through an attack)
+        chasing = active & ~inRange & (attackAnimTimers <= 0)
+        walking[chasing] = True
+        velocities[chasing, :2] += directions[chasing]*(self.accelerations[:size][chasing]*dt)[:, None]
+        attackWaitTimers[chasing] = 0.2
+        attackDelayTimers[chasing] = 0
+
+        # Close to the player, stop, and attack
+        walking[inRange] = False
+        velocities[inRange] = 0
+
+        delaying = inRange & (attackDelayTimers > 0)
+        attackDelayTimers[delaying] -= dt
+        landing = delaying & (attackDelayTimers <= 0)
+
+        waiting = inRange & ~delaying & (attackWaitTimers > 0)
+        attackWaitTimers[waiting] -= dt
+        starting = waiting & (attackWaitTimers <= 0)
+
+        # Landed attacks are checked for hits by the
+        # game's enemy-queries, later in the step
+        enemies = self.enemies
+        for index in numpy.flatnonzero(landing).tolist():
+            base.pendingAttacks.append(enemies[index])
+
+        for index in numpy.flatnonzero(starting).tolist():
+            attackWaitTimers[index] = base.randomStreams.attacks.uniform(0.5, 0.7)
+            attackDelayTimers[index] = self.attackDelays[index]
+            attackAnimTimers[index] = enemies[index].startAttack()
+            self.looping[index] = LOOP_NONE
+
+        # As "Enemy.update": loop the walk or stand animation,
+        # when that's not already what's looping.
+        looping = self.looping[:size]
+        wantedLoops = numpy.where(walking, LOOP_WALK,
+                                  numpy.where((spawnTimers <= 0) & (attackAnimTimers <= 0), LOOP_STAND, looping))
+        for index in numpy.flatnonzero(wantedLoops != looping).tolist():
+            enemies[index].animations.request(LOOP_NAMES[int(wantedLoops[index])])
+        looping[:] = wantedLoops
+
+        # Finally, write the new transforms back, all at once
+        for setTransform, (x, y, z), heading in zip(self.transformSetters, positions.tolist(), headings.tolist()):
+            setTransform(x, y, z, heading, 0, 0)
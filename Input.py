@@ -0,0 +1,129 @@
+
+from panda3d.core import Point2, Point3
+
+# The controls that the player-character responds to
+KEY_NAMES = ("up", "down", "left", "right", "shoot")
+
+
+def emptyKeys():
+    # A key-state with nothing pressed
+    return dict.fromkeys(KEY_NAMES, False)
+
+
+class InputSource():
+    # An input-source provides, once per frame, the state of
+    # the movement- and shoot- keys, and the point on the
+    # ground-plane that the player-character is aiming at.
+    # The game doesn't care whether that comes from a person,
+    # a script, or nowhere at all.
+    #
+    # The aim-point returned is only read before the next poll,
+    # so an input-source may fill in the same point each time,
+    # rather than making a new one.
+    def __init__(self):
+        self.defaultAim = Point3()
+
+    def poll(self, player):
+        return emptyKeys(), self.defaultAimPoint(player)
+
+    def defaultAimPoint(self, player):
+        # Aim just ahead of the player, so that the
+        # firing-vector is never of zero length.
+        actor = player.actor
+        aimPoint = self.defaultAim
+        aimPoint.x = actor.getX()
+        aimPoint.y = actor.getY() + 1.0
+        aimPoint.z = actor.getZ()
+        return aimPoint
+
+
+class LiveInput(InputSource):
+    # Input from the keyboard and mouse of an actual window.
+    # (The mouse-watcher, camera and lens are the window's,
+    #  unless others are given.)
+    def __init__(self, keyMap, mouseWatcher = None, camera = None, lens = None):
+        InputSource.__init__(self)
+        self.keyMap = keyMap
+
+        self.mouseWatcher = mouseWatcher if mouseWatcher is not None else base.mouseWatcherNode
+        self.camera = camera if camera is not None else base.camera
+        self.lens = lens if lens is not None else base.camLens
+
+        # This stores the position of the mouse; it's kept
+        # as a fall-back in case we don't get a good position
+        # on a given update.
+        self.mousePos = Point2(0, 0)
+
+        # The points that the mouse-ray is worked out in, and
+        # the point on the ground that it hits--kept, and filled
+        # in afresh on each update, rather than made anew
+        self.nearPoint = Point3()
+        self.farPoint = Point3()
+        self.mousePos3D = Point3()
+
+    def poll(self, player):
+        # It's possible that we'll find that we
+        # don't have the mouse--such as if the pointer
+        # is outside of the game-window. In that case,
+        # just use the previous position.
+        mouseWatcher = self.mouseWatcher
+        mousePos = self.mousePos
+        if mouseWatcher.hasMouse():
+            mousePos.x = mouseWatcher.getMouseX()
+            mousePos.y = mouseWatcher.getMouseY()
+
+        nearPoint = self.nearPoint
+        farPoint = self.farPoint
+
+        # Get the 3D line corresponding with the
+        # 2D mouse-position.
+        # The "extrude" method will store its result in the
+        # "nearPoint" and "farPoint" objects.
+        self.lens.extrude(mousePos, nearPoint, farPoint)
+
+        # Those are relative to the camera; move them into
+        # the scene's space, in place.
+        cameraMat = self.camera.getMat(render)
+        cameraMat.xformPointInPlace(nearPoint)
+        cameraMat.xformPointInPlace(farPoint)
+
+        # Get the 3D point at which the 3D line
+        # intersects our ground-plane (that is, where
+        # z is 0). (If the line runs along the ground,
+        # we keep the last point that we found.)
+        mousePos3D = self.mousePos3D
+        rise = nearPoint.z - farPoint.z
+        if rise != 0:
+            fraction = nearPoint.z/rise
+            mousePos3D.x = nearPoint.x + (farPoint.x - nearPoint.x)*fraction
+            mousePos3D.y = nearPoint.y + (farPoint.y - nearPoint.y)*fraction
+            mousePos3D.z = 0.0
+
+        return self.keyMap, mousePos3D
+
+
+class NullInput(InputSource):
+    # No input at all: the player stands still and doesn't shoot.
+    pass
+
+
+class ScriptedInput(InputSource):
+    # Input driven by a script: a function that is given the
+    # frame-number and the player, and that returns a key-state
+    # and an aim-point. Either may be "None", in which case
+    # nothing is pressed, or the player aims straight ahead.
+    def __init__(self, script):
+        InputSource.__init__(self)
+        self.script = script
+        self.frame = 0
+
+    def poll(self, player):
+        keys, aimPoint = self.script(self.frame, player)
+        self.frame += 1
+
+        if keys is None:
+            keys = emptyKeys()
+        if aimPoint is None:
+            aimPoint = self.defaultAimPoint(player)
+
+        return keys, aimPoint
@@ -0,0 +1,444 @@
+
+# Micro-benchmarks: time individual hot methods of our game-objects,
+# in microseconds per call.
+#
+#  python MicroBenchmark.py
+#  python MicroBenchmark.py --filter runLogic --number 5000 --repeat 7
+#  python MicroBenchmark.py --json results.json
+#  python MicroBenchmark.py --allocations     (count allocations, too)
+#
+# The stand-in scene is a headless game: no window, no audio, but
+# real "base", "render" and "loader" globals, real Actors and a real
+# collision-traverser. The objects being timed are built once, and
+# put back into a known state before each batch of calls.
+#
+# With "--allocations", we also count how many blocks of memory each
+# call allocates--Panda's vectors and points, chiefly, each of which
+# is a Python-object of its own. We can't hook Python's allocator, so
+# we trace the call bytecode by bytecode, and add up each rise in the
+# number of blocks allocated ("sys.getallocatedblocks"). The garbage-
+# collector is off while we count, since a collection part-way through
+# a call frees blocks that would hide that bytecode's allocations; so
+# every call after the first few (which may fill caches) counts the same.
+# An object that's freed within the very bytecode that made it (such
+# as the intermediate result in "a + b*c") still goes unseen, so the
+# counts are a lower bound--but they're exact enough to catch a new
+# allocation in a hot path. Those cases listed in "ALLOCATION_LIMITS"
+# fail the run if they allocate more than their limit, as they do
+# "test_allocations.py".
+
+import array, gc, json, math, os, sys, time
+
+from panda3d.core import Vec3, Point3, PerspectiveLens, Camera
+
+from Input import emptyKeys, LiveInput
+from Entities import STATE_ALIVE
+import CrowdRenderer
+from AnimationLOD import AnimationLOD
+
+DEFAULT_NUMBER = 2000
+DEFAULT_REPEAT = 5
+
+FRAME_DT = 1.0/60.0
+
+# How many enemies the batched horde is timed with
+HORDE_SIZE = 100
+
+# The most allocations per call that the per-step movement-code may
+# make. (Floats and the like come from free-lists, and don't count.)
+# Firing the laser makes the iterators for the game's loops over its
+# enemies and traps, as it looks for what the beam hits. Turning the
+# mouse into an aim-point gets the camera's matrix, which is new each
+# time, and the lens may make an object of its own as it extrudes the
+# mouse-ray.
+ALLOCATION_LIMITS = {
+    "GameObject.update (coasting)" : 0,
+    "GameObject.interpolate" : 0,
+    "Player.update (idle)" : 0,
+    "Player.update (walking)" : 0,
+    "Player.update (shooting)" : 3,
+    "WalkingEnemy.runLogic (chasing)" : 0,
+    "WalkingEnemy.runLogic (in range)" : 0,
+    "Enemy.update (chasing)" : 0,
+    "TrapEnemy.update" : 0,
+    "LiveInput.poll" : 2
+}
+
+# How many times each call is traced, after as many calls that aren't
+# counted (the first few warm up caches and free-lists). The count is
+# the median, so that a one-off (a free-list running dry, say) doesn't
+# sway it; an allocation that the call really makes is seen every time.
+ALLOCATION_TRIALS = 5
+
+
+def traceAllocations(call):
+    # The number of allocations that the call makes (see above)
+    counts = array.array("q", [0, 0, 0])
+    getAllocatedBlocks = sys.getallocatedblocks
+
+    # Everything here reads and writes "counts" in place,
+    # so as not to make allocations of its own in between
+    # the readings.
+    def trace(frame, event, arg):
+        counts[1] = getAllocatedBlocks() - counts[0]
+        if event == "call":
+            # (The frame-object that tracing a call makes)
+            counts[1] -= 1
+        if counts[1] > 0:
+            counts[2] += counts[1]
+        frame.f_trace_opcodes = True
+        counts[0] = getAllocatedBlocks()
+        return trace
+
+    counts[0] = getAllocatedBlocks()
+    sys.settrace(trace)
+    try:
+        call()
+    finally:
+        sys.settrace(None)
+    return counts[2]
+
+
+def doNothing():
+    pass
+
+
+class StandInEntry():
+    # Stands in for a "CollisionEntry", so that collisions
+    # can be dispatched without a traversal.
+    def __init__(self, fromNodePath, intoNodePath):
+        self.fromNodePath = fromNodePath
+        self.intoNodePath = intoNodePath
+
+    def getFromNodePath(self):
+        return self.fromNodePath
+
+    def getIntoNodePath(self):
+        return self.intoNodePath
+
+
+class StandInMouseWatcher():
+    # Stands in for a window's "MouseWatcher", with the
+    # pointer held at one spot
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def hasMouse(self):
+        return True
+
+    def getMouseX(self):
+        return self.x
+
+    def getMouseY(self):
+        return self.y
+
+
+class MicroBenchmark():
+    def __init__(self, name, call, reset = None, quiet = False):
+        self.name = name
+        # The method-call being timed
+        self.call = call
+        # Run before each batch of calls, outside of the timing
+        self.reset = reset
+        # Whether to swallow anything that the call prints
+        self.quiet = quiet
+
+    def run(self, number, repeat):
+        # Returns the time per call, in microseconds,
+        # for each of "repeat" batches of "number" calls.
+        call = self.call
+        timings = []
+        for i in range(repeat):
+            stdout = sys.stdout
+            if self.quiet:
+                sys.stdout = open(os.devnull, "w")
+            try:
+                if self.reset is not None:
+                    self.reset()
+
+                startTime = time.perf_counter()
+                for j in range(number):
+                    call()
+                elapsed = time.perf_counter() - startTime
+            finally:
+                if self.quiet:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+
+            timings.append(elapsed*1000000.0/number)
+        return timings
+
+    def countAllocations(self):
+        # Returns the allocations per call, less those that
+        # the tracing itself makes
+        stdout = sys.stdout
+        if self.quiet:
+            sys.stdout = open(os.devnull, "w")
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            if self.reset is not None:
+                self.reset()
+            traceAllocations(doNothing)
+            overheads = sorted(traceAllocations(doNothing) for i in range(ALLOCATION_TRIALS))
+            for i in range(ALLOCATION_TRIALS):
+                traceAllocations(self.call)
+            counts = sorted(traceAllocations(self.call) for i in range(ALLOCATION_TRIALS))
+        finally:
+            if collecting:
+                gc.enable()
+            if self.quiet:
+                sys.stdout.close()
+                sys.stdout = stdout
+        return max(0, counts[len(counts)//2] - overheads[len(overheads)//2])
+
+
+def prepareEnemy(enemy, pos):
+    # Put an enemy somewhere, at rest and at full health,
+    # with its spawn-animation finished.
+    enemy.animations.stop()
+    enemy.animations.request("stand")
+    enemy.actor.setPos(pos)
+    enemy.resetSimState()
+    enemy.velocity.set(0, 0, 0)
+    enemy.health = enemy.maxHealth
+    enemy.walking = False
+    enemy.attackDelayTimer = 0
+    enemy.attackWaitTimer = 0
+
+
+def buildBenchmarks(game):
+    from GameObject import GameObject, WalkingEnemy
+
+    game.startGame()
+    player = game.player
+    player.maxHealth = 1000000000
+    player.health = player.maxHealth
+
+    farEnemy = WalkingEnemy(Vec3(6, 6, 0))
+    nearEnemy = WalkingEnemy(Vec3(0.5, 0, 0))
+    game.enemies += [farEnemy, nearEnemy]
+
+    trap = game.trapEnemies[0]
+
+    idleKeys = emptyKeys()
+    walkingKeys = emptyKeys()
+    walkingKeys["up"] = True
+    walkingKeys["right"] = True
+    shootingKeys = emptyKeys()
+    shootingKeys["shoot"] = True
+
+    aimPoint = Point3(3, 3, 0)
+    aimAtEnemy = Point3(6, 6, 0)
+
+    def resetPlayer():
+        player.actor.setPos(0, 0, 0)
+        player.resetSimState()
+        player.velocity.set(0, 0, 0)
+
+    def resetFarEnemy():
+        prepareEnemy(farEnemy, Vec3(6, 6, 0))
+        resetPlayer()
+
+    def resetNearEnemy():
+        prepareEnemy(nearEnemy, Vec3(0.5, 0, 0))
+        resetPlayer()
+        game.pendingAttacks = []
+
+    def resetCoasting():
+        resetFarEnemy()
+        farEnemy.velocity.set(3, 0, 0)
+
+    def resetTrap():
+        resetNearEnemy()
+        trap.moveDirection = 1
+        trap.ignorePlayer = False
+
+    def shoot():
+        # Aim and fire, then have the game work
+        # out what the beam hits
+        player.update(shootingKeys, aimAtEnemy, 0.0)
+        game.runPlayerQueries(0.0)
+
+    def coast():
+        velocity = farEnemy.velocity
+        velocity.x = 3.0
+        velocity.y = velocity.z = 0.0
+        GameObject.update(farEnemy, FRAME_DT)
+
+    farEnemyStart = Point3(6, 6, 0)
+
+    def chase():
+        # Put the enemy back where it started on each call, so
+        # that every call is a step of the chase--rather than
+        # the enemy reaching the player after the first hundred
+        farEnemy.actor.setPos(farEnemyStart)
+        farEnemy.update(player, FRAME_DT)
+
+    trapHitEntry = StandInEntry(trap.collider, nearEnemy.collider)
+
+    def trapHit():
+        # Bring the enemy back to life on each call, so that
+        # every call is the killing blow that a trap deals in
+        # play--rather than the first killing the enemy, and
+        # the rest hitting its corpse
+        nearEnemy.health = nearEnemy.maxHealth
+        game.entities.setState(nearEnemy, STATE_ALIVE)
+        game.trapHitsSomething(trap, nearEnemy, trapHitEntry)
+
+    def dispatchTrapHit():
+        # (As above)
+        nearEnemy.health = nearEnemy.maxHealth
+        game.entities.setState(nearEnemy, STATE_ALIVE)
+        game.collisionDispatcher.collect(trapHitEntry)
+        game.collisionDispatcher.deliver()
+
+    # The keyboard and mouse, with a stand-in for the window's
+    # mouse-watcher, and a camera placed as the game's is
+    lens = PerspectiveLens()
+    cameraNodePath = render.attachNewNode(Camera("standInCamera", lens))
+    cameraNodePath.setPos(0, 0, 32)
+    cameraNodePath.setP(-90)
+    liveInput = LiveInput(emptyKeys(), StandInMouseWatcher(0.25, -0.5), cameraNodePath, lens)
+
+    benchmarks = [
+        MicroBenchmark("GameObject.update (coasting)", coast, resetCoasting),
+        MicroBenchmark("GameObject.interpolate",
+                       lambda: farEnemy.interpolate(0.5), resetCoasting),
+        MicroBenchmark("Player.update (idle)",
+                       lambda: player.update(idleKeys, aimPoint, FRAME_DT), resetPlayer),
+        MicroBenchmark("Player.update (walking)",
+                       lambda: player.update(walkingKeys, aimPoint, FRAME_DT), resetPlayer),
+        MicroBenchmark("Player.update (shooting)",
+                       shoot, resetFarEnemy),
+        MicroBenchmark("WalkingEnemy.runLogic (chasing)",
+                       lambda: farEnemy.runLogic(player, FRAME_DT), resetFarEnemy),
+        MicroBenchmark("WalkingEnemy.runLogic (in range)",
+                       lambda: nearEnemy.runLogic(player, FRAME_DT), resetNearEnemy),
+        MicroBenchmark("Enemy.update (chasing)", chase, resetFarEnemy),
+        MicroBenchmark("TrapEnemy.update",
+                       lambda: trap.update(player, FRAME_DT), resetTrap),
+        MicroBenchmark("Game.trapHitsSomething", trapHit, resetTrap),
+        MicroBenchmark("CollisionDispatcher (trap hit)", dispatchTrapHit, resetTrap),
+        MicroBenchmark("LiveInput.poll",
+                       lambda: liveInput.poll(player), resetPlayer)
+    ]
+
+    if game.horde is not None:
+        # A ring of a hundred enemies, all closing in at once
+        hordeEnemies = []
+        for i in range(HORDE_SIZE):
+            angle = i*2.0*math.pi/HORDE_SIZE
+            hordeEnemies.append(WalkingEnemy(Vec3(math.cos(angle)*6, math.sin(angle)*6, 0)))
+
+        def resetHorde():
+            game.horde.clear()
+            for i, enemy in enumerate(hordeEnemies):
+                angle = i*2.0*math.pi/HORDE_SIZE
+                prepareEnemy(enemy, Vec3(math.cos(angle)*6, math.sin(angle)*6, 0))
+                game.horde.add(enemy)
+            resetPlayer()
+
+        benchmarks.append(MicroBenchmark("Horde.update ({0} chasing)".format(HORDE_SIZE),
+                                         lambda: game.horde.update(player, 0.0), resetHorde))
+
+        # The CPU's share of drawing the same hundred as a crowd:
+        # gathering their instance-data. (There's no window, so
+        # nothing is drawn--but nor does this need one.)
+        crowdRenderer = CrowdRenderer.CrowdRenderer(game.assets.getActorTemplate("walkingEnemy"))
+
+        def resetCrowd():
+            crowdRenderer.clear()
+            resetHorde()
+            for enemy in hordeEnemies:
+                crowdRenderer.add(enemy)
+
+        benchmarks.append(MicroBenchmark("CrowdRenderer.update ({0})".format(HORDE_SIZE),
+                                         crowdRenderer.update, resetCrowd))
+
+        # Deciding which of the hundred to pose, and posing them.
+        # (Posing doesn't need a window either.)
+        animationLod = AnimationLOD()
+
+        def resetAnimationLod():
+            animationLod.clear()
+            resetHorde()
+            for enemy in hordeEnemies:
+                animationLod.add(enemy)
+
+        benchmarks.append(MicroBenchmark("AnimationLOD.update ({0})".format(HORDE_SIZE),
+                                         lambda: animationLod.update(player), resetAnimationLod))
+
+    return benchmarks
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values)//2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle])/2.0
+
+
+def getArgument(args, name, default):
+    if name in args:
+        return args[args.index(name) + 1]
+    return default
+
+
+def main(args):
+    from Game import Game
+
+    number = int(getArgument(args, "--number", DEFAULT_NUMBER))
+    repeat = int(getArgument(args, "--repeat", DEFAULT_REPEAT))
+    nameFilter = getArgument(args, "--filter", None)
+    countingAllocations = "--allocations" in args
+
+    game = Game(headless = True)
+    benchmarks = buildBenchmarks(game)
+    if nameFilter is not None:
+        benchmarks = [benchmark for benchmark in benchmarks if nameFilter in benchmark.name]
+
+    results = {}
+    overLimit = []
+    header = "{0:<36} {1:>10} {2:>10}".format("method", "best us", "median us")
+    if countingAllocations:
+        header += " {0:>7}".format("allocs")
+    print(header)
+    for benchmark in benchmarks:
+        timings = benchmark.run(number, repeat)
+        results[benchmark.name] = {
+            "bestUs" : min(timings),
+            "medianUs" : median(timings),
+            "calls" : number*repeat
+        }
+        line = "{0:<36} {1:>10.2f} {2:>10.2f}".format(benchmark.name, min(timings), median(timings))
+
+        if countingAllocations:
+            numAllocations = benchmark.countAllocations()
+            results[benchmark.name]["allocations"] = numAllocations
+            line += " {0:>7}".format(numAllocations)
+            limit = ALLOCATION_LIMITS.get(benchmark.name)
+            if limit is not None and numAllocations > limit:
+                overLimit.append("{0} makes {1} allocations per call (the limit is {2})".format(benchmark.name, numAllocations, limit))
+                line += "  OVER LIMIT"
+        print(line)
+
+    outputPath = getArgument(args, "--json", None)
+    if outputPath is not None:
+        with open(outputPath, "w") as outputFile:
+            json.dump(results, outputFile, indent = 2, sort_keys = True)
+
+    game.cleanup()
+
+    if len(overLimit) > 0:
+        print()
+        print("\n".join(overLimit))
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
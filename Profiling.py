@@ -0,0 +1,147 @@
+
+# PStats collectors for our own work. Panda's PStats shows its own
+# categories--culling, drawing, and so on--but all of our Python
+# work arrives as the one "update" task. Here we give each stage of
+# that work a collector of its own, named beneath the task's, so that
+# PStats breaks the task down for us: the simulation-stages, the
+# player's input, movement, aim, laser and sounds, the enemy loops,
+# and the HUD. Alongside those are counters--live enemies, corpses,
+# colliders--so that the timings can be read against the horde-size.
+#
+#  pstats &
+#  python Game.py --pstats
+#
+# Nothing here costs anything until profiling is turned on: only
+# then are the methods to be timed wrapped in their collectors, much
+# as the benchmark wraps the game's stages in timers. Turning it off
+# again puts the original methods back.
+
+from panda3d.core import PStatClient, PStatCollector
+
+from GameObject import Player, WalkingEnemy
+
+# The collector that Panda gives our "update"-task
+UPDATE_COLLECTOR = "App:Show code:update"
+SIMULATE_COLLECTOR = UPDATE_COLLECTOR + ":simulate"
+
+# The game's methods that we time, beneath the
+# collector of the method that calls them
+GAME_METHODS = {
+    UPDATE_COLLECTOR : ("restoreSimState", "simulate", "interpolate", "updateAnimation"),
+    SIMULATE_COLLECTOR : ("updatePlayer", "updatePlayerQueries", "updateSpawning",
+                          "updateSpatialGrid", "updateEnemies", "updateEnemyQueries",
+                          "updateTraps", "updateCollisions", "updateDeadEnemies",
+                          "updateDifficulty"),
+    SIMULATE_COLLECTOR + ":updatePlayerQueries" : ("castLaser",),
+    SIMULATE_COLLECTOR + ":updateEnemies" : ("collectDeadEnemies",)
+}
+
+# Likewise for classes of game-object (and so for every
+# instance of them); the collector-names are shortened
+# here to the part beneath the "simulate"-collector.
+# (The health-bar is updated whenever the player is hurt--
+#  by an enemy's attack, or by a trap during the collision-
+#  passes--so it has a collector of its own, rather than
+#  one beneath either stage.)
+CLASS_METHODS = (
+    (Player, "updateMovement", "updatePlayer:Movement"),
+    (Player, "updateAim", "updatePlayer:Aim"),
+    (Player, "updateBeam", "updatePlayer:Beam"),
+    (Player, "fireLaser", "updatePlayerQueries:fireLaser"),
+    (Player, "updateLaserSound", "updatePlayerQueries:fireLaser:Audio"),
+    (Player, "updateScore", "updateEnemies:collectDeadEnemies:HUD"),
+    (Player, "updateHealthUI", "HUD"),
+    (WalkingEnemy, "update", "updateEnemies:Individual")
+)
+
+# Counters, and what they count
+COUNTERS = {
+    "Game:Enemies:Live" : lambda game: len(game.enemies),
+    "Game:Enemies:Corpses" : lambda game: len(game.deadEnemies),
+    "Game:Enemies:Pooled" : lambda game: len(game.enemyPool.available),
+    "Game:Colliders" : lambda game: game.cTrav.getNumColliders()
+}
+
+
+def wrapMethod(owner, methodName, collectorName):
+    # Replace the method with one that runs it within the
+    # collector. ("owner" may be an instance or a class.)
+    # Returns a function that puts the method back.
+    method = getattr(owner, methodName)
+    # (What the owner itself held, if anything, as
+    #  opposed to what it got from its class)
+    ownMethod = vars(owner).get(methodName)
+    collector = PStatCollector(collectorName)
+
+    def timedMethod(*args, **kwargs):
+        collector.start()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            collector.stop()
+
+    setattr(owner, methodName, timedMethod)
+
+    def unwrap():
+        if ownMethod is None:
+            delattr(owner, methodName)
+        else:
+            setattr(owner, methodName, ownMethod)
+
+    return unwrap
+
+
+class Profiler():
+    def __init__(self, game):
+        self.game = game
+        # What puts each wrapped method back
+        self.unwrappers = []
+
+        for parentName, methodNames in GAME_METHODS.items():
+            for methodName in methodNames:
+                self.wrap(game, methodName, parentName + ":" + methodName)
+
+        # (The same input-source and horde last the whole game)
+        self.wrap(game.inputSource, "poll", SIMULATE_COLLECTOR + ":updatePlayer:Input")
+        if game.horde is not None:
+            self.wrap(game.horde, "update", SIMULATE_COLLECTOR + ":updateEnemies:Horde")
+
+        for cls, methodName, collectorName in CLASS_METHODS:
+            self.wrap(cls, methodName, SIMULATE_COLLECTOR + ":" + collectorName)
+
+        self.counters = [(PStatCollector(name), count) for name, count in COUNTERS.items()]
+
+        # Counted once per frame, after the update
+        # (collisions and all)
+        game.taskMgr.add(self.updateCounters, "updatePStatCounters", sort = 40)
+
+    def wrap(self, owner, methodName, collectorName):
+        self.unwrappers.append(wrapMethod(owner, methodName, collectorName))
+
+    def updateCounters(self, task):
+        for collector, count in self.counters:
+            collector.setLevel(count(self.game))
+        return task.cont
+
+    def cleanup(self):
+        # Put every method back as it was--the class-methods
+        # especially, since those outlast the game--last-
+        # wrapped first
+        for unwrap in reversed(self.unwrappers):
+            unwrap()
+        self.unwrappers = []
+        self.game.taskMgr.remove("updatePStatCounters")
+
+
+def enable(game):
+    # Start timing, and connect to the PStats-server;
+    # returns the profiler, and whether we connected
+    profiler = Profiler(game)
+    connected = PStatClient.connect()
+    return profiler, connected
+
+
+def disable(profiler):
+    # Stop timing, and disconnect
+    profiler.cleanup()
+    PStatClient.disconnect()
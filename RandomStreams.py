@@ -0,0 +1,39 @@
+
+# The game's randomness, split into a stream per subsystem, all
+# seeded from the one number. With the same seed (and the same
+# input), a game plays out the same way every time--which is what
+# lets a recorded session be replayed (see "Replay.py").
+#
+# Each subsystem has a stream of its own, rather than sharing one,
+# so that drawing an extra number in one place (a new visual effect,
+# say) doesn't shift every number drawn after it everywhere else.
+#
+#  - "spawning": which spawn-point each enemy comes in at.
+#  - "traps": where along each wall the traps are placed.
+#  - "attacks": how long enemies wait between attacks.
+#  - "effects": the rotations of the beam-hit and damage models.
+#    (These don't affect the game, but a replay should look the
+#     same, too.)
+
+import random
+
+STREAM_NAMES = ("spawning", "traps", "attacks", "effects")
+
+
+class RandomStreams():
+    def __init__(self, seed = 0):
+        self.reseed(seed)
+
+    def reseed(self, seed):
+        # Each stream is seeded from both the seed and its own
+        # name, so that no two streams run alike
+        self.seed = seed
+        for name in STREAM_NAMES:
+            setattr(self, name, random.Random("{0}:{1}".format(seed, name)))
+
+
+def makeSeed():
+    # A new seed for a game; drawn from the global "random"-
+    # module, so that seeding that (as the benchmarks and soak-
+    # test do) still makes runs repeatable
+    return random.getrandbits(32)
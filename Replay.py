@@ -0,0 +1,207 @@
+
+# Recording a session, and playing it back exactly. A game is decided
+# by just two things: its seed (from which all of its randomness is
+# drawn--see "RandomStreams.py"), and the player's input on each
+# simulation-step. So that's all that we record: the seed, and for
+# each step the keys held and the point on the ground-plane that was
+# aimed at--nine bytes a step, compressed. Replaying feeds those same
+# steps back in, in a headless game that runs as fast as it can.
+#
+# To check that a replay really did play out the same, the recording
+# also holds the final score, and a checksum of where everything was
+# (and how healthy) when the recording ended.
+#
+#  python Game.py --record                 (saves each session into "replays/")
+#  python Replay.py replays/session-20261017-120000.replay
+#  python Benchmark.py --scenario replay:replays/session-20261017-120000.replay
+#
+# A recording only replays exactly on the same version of the game,
+# with the horde batched (or not) as it was when recorded.
+
+import os, struct, sys, time, zlib
+
+from panda3d.core import Point3
+
+from Input import InputSource, KEY_NAMES, emptyKeys
+
+MAGIC = b"RPLY"
+VERSION = 1
+
+# Magic, version, flags, seed, simulation-rate, number of steps,
+# final score, and the checksum of the final state
+HEADER = struct.Struct("<4sBBIHIiI")
+# The keys held (one bit each), and the aim-point's x and y
+STEP = struct.Struct("<Bff")
+
+FLAG_BATCHED_HORDE = 1
+
+# Each key's bit in a step's key-bits
+KEY_BITS = tuple((name, 1 << bit) for bit, name in enumerate(KEY_NAMES))
+
+OUTPUT_DIRECTORY = "replays"
+EXTENSION = ".replay"
+
+
+class Recording():
+    def __init__(self, seed, simulationRate, batchedHorde):
+        self.seed = seed
+        self.simulationRate = simulationRate
+        self.batchedHorde = batchedHorde
+
+        self.steps = bytearray()
+        self.numSteps = 0
+
+        # Filled in when the recording is finished
+        self.score = 0
+        self.checksum = 0
+
+    def addStep(self, keys, aimPoint):
+        # Called with each step's input, as it's used
+        keyBits = 0
+        for name, bit in KEY_BITS:
+            if keys[name]:
+                keyBits |= bit
+        self.steps += STEP.pack(keyBits, aimPoint.x, aimPoint.y)
+        self.numSteps += 1
+
+    def getStep(self, index):
+        # (Key-bits, aim-x, aim-y)
+        return STEP.unpack_from(self.steps, index*STEP.size)
+
+    def finish(self, game):
+        self.score = game.player.score
+        self.checksum = getStateChecksum(game)
+
+    def save(self, path):
+        flags = FLAG_BATCHED_HORDE if self.batchedHorde else 0
+        with open(path, "wb") as outputFile:
+            outputFile.write(HEADER.pack(MAGIC, VERSION, flags, self.seed, self.simulationRate,
+                                         self.numSteps, self.score, self.checksum))
+            outputFile.write(zlib.compress(bytes(self.steps)))
+
+
+def loadRecording(path):
+    with open(path, "rb") as inputFile:
+        data = inputFile.read()
+
+    if len(data) < HEADER.size:
+        raise ValueError("Not a replay (too short): " + path)
+    magic, version, flags, seed, simulationRate, numSteps, score, checksum = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a replay: " + path)
+    if version != VERSION:
+        raise ValueError("Replay-version {0} isn't supported (expected {1}): {2}".format(version, VERSION, path))
+
+    recording = Recording(seed, simulationRate, (flags & FLAG_BATCHED_HORDE) != 0)
+    recording.steps = bytearray(zlib.decompress(data[HEADER.size:]))
+    recording.numSteps = numSteps
+    recording.score = score
+    recording.checksum = checksum
+    if len(recording.steps) != numSteps*STEP.size:
+        raise ValueError("Replay is damaged (expected {0} steps): {1}".format(numSteps, path))
+    return recording
+
+
+def makeRecordingPath(outputDirectory = OUTPUT_DIRECTORY):
+    # A new file-name for a recording, by the time that it's saved
+    os.makedirs(outputDirectory, exist_ok = True)
+    name = "session-" + time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(outputDirectory, name + EXTENSION)
+    suffix = 1
+    while os.path.exists(path):
+        suffix += 1
+        path = os.path.join(outputDirectory, "{0}-{1}{2}".format(name, suffix, EXTENSION))
+    return path
+
+
+def getStateChecksum(game):
+    # A checksum of the simulation's state: the player's score,
+    # health and kills, and where each game-object is (as the
+    # simulation has it, rather than as last drawn), and its health
+    state = bytearray(struct.pack("<idiII", game.player.score, game.player.health, game.player.kills,
+                                  len(game.enemies), len(game.deadEnemies)))
+    for gameObject in game.getSimulatedObjects():
+        simPos = gameObject.simPos
+        state += struct.pack("<ffffd", simPos.x, simPos.y, simPos.z, gameObject.simH, gameObject.health)
+    return zlib.crc32(state)
+
+
+class ReplayInput(InputSource):
+    # Input from a recording, a step at a time. Once the
+    # recording runs out, nothing is pressed.
+    def __init__(self, recording):
+        InputSource.__init__(self)
+        self.recording = recording
+        self.stepIndex = 0
+
+        # Filled in afresh on each step
+        self.keys = emptyKeys()
+        self.aimPoint = Point3()
+
+    def isFinished(self):
+        return self.stepIndex >= self.recording.numSteps
+
+    def poll(self, player):
+        if self.isFinished():
+            return emptyKeys(), self.defaultAimPoint(player)
+
+        keyBits, aimX, aimY = self.recording.getStep(self.stepIndex)
+        self.stepIndex += 1
+
+        keys = self.keys
+        for name, bit in KEY_BITS:
+            keys[name] = (keyBits & bit) != 0
+        self.aimPoint.set(aimX, aimY, 0)
+
+        return keys, self.aimPoint
+
+
+def replay(recording):
+    # Play a recording back in a headless game, as fast as we can;
+    # returns the game (not yet cleaned up), and how long it took
+    from Game import Game
+    import Horde
+
+    if recording.batchedHorde and not Horde.isAvailable():
+        print("This was recorded with a batched horde, which needs NumPy; it may not replay exactly")
+
+    game = Game(headless = True, inputSource = ReplayInput(recording),
+                simulationRate = recording.simulationRate, batchedHorde = recording.batchedHorde)
+    game.startGame(seed = recording.seed)
+
+    startTime = time.perf_counter()
+    while not game.inputSource.isFinished() and game.player.health > 0:
+        game.taskMgr.step()
+    elapsed = time.perf_counter() - startTime
+
+    return game, elapsed
+
+
+def main(args):
+    if len(args) == 0:
+        print("Usage: python Replay.py RECORDING")
+        return 2
+
+    recording = loadRecording(args[0])
+    game, elapsed = replay(recording)
+
+    numSteps = game.inputSource.stepIndex
+    gameTime = numSteps/float(recording.simulationRate)
+    print("Replayed {0} steps ({1:.1f}s of play) in {2:.3f}s ({3:.0f} times real time)".format(
+        numSteps, gameTime, elapsed, gameTime/max(elapsed, 1e-9)))
+
+    score = game.player.score
+    checksum = getStateChecksum(game)
+    game.cleanup()
+
+    print("Score {0} (recorded: {1}); checksum {2:08x} (recorded: {3:08x})".format(score, recording.score,
+                                                                               checksum, recording.checksum))
+    if score != recording.score or checksum != recording.checksum:
+        print("The replay didn't play out as recorded!")
+        return 1
+    print("The replay matched the recording.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
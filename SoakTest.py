@@ -0,0 +1,242 @@
+
+# A soak-test: many headless games, played back to back by a bot, in
+# the one process--as a player restarting over and over would. Each
+# game's teardown has a number of steps to remember (the colliders'
+# "owner"-tags, the traverser and pusher, Actors, sounds, lights...),
+# and missing one doesn't show in a single game: it shows as nodes,
+# colliders or objects piling up over many.
+#
+# So after each game we clean up, and take stock of what's left:
+#  - the nodes beneath "render",
+#  - the colliders in the traverser,
+#  - the GameObjects still alive (which should be just the pool's),
+#    and those in the game's registry,
+#  - the AudioSound-handles held by Python-objects (besides the
+#    sound-manager's voices, which it adds as it needs them, up to
+#    a limit per sound--however long the game takes to need them), and
+#  - the memory allocated by Python (via "tracemalloc"), along with
+#    the lines that allocated the most of it since the last game.
+#
+# Once the first few games have warmed things up (filling the enemy-
+# pool, the sound-manager's voices, caches, and so on), none of these
+# should grow from one game to the next; if any does, the test fails.
+#
+#  python SoakTest.py
+#  python SoakTest.py --games 50 --max-frames 7200 --output soak.json
+#  python SoakTest.py --no-tracemalloc     (faster, but without memory-figures)
+
+import gc, json, math, random, sys, time, tracemalloc
+
+from panda3d.core import Vec3, AudioSound
+
+from Game import Game
+from GameObject import GameObject
+from Input import InputSource, emptyKeys
+
+DEFAULT_GAMES = 10
+DEFAULT_WARMUP_GAMES = 1
+# A game that the bot survives this long is ended anyway
+DEFAULT_MAX_FRAMES = 3600
+# Python's memory may wobble by this much from game to game
+DEFAULT_MEMORY_TOLERANCE_KB = 256
+
+# The counts that mustn't grow from game to game
+COUNTED_METRICS = ("renderNodes", "colliders", "gameObjects", "registered", "audioSounds")
+
+# How many of the biggest allocation-changes to report per game
+NUM_TOP_ALLOCATIONS = 5
+
+# The bot keeps this far from enemies, and this far inside the arena
+SAFE_DISTANCE = 2.5
+ARENA_LIMIT = 5.5
+
+
+class BotInput(InputSource):
+    # A simple player: shoot at the nearest enemy, back away from it
+    # if it's close, and otherwise circle about the arena.
+    def __init__(self, game):
+        InputSource.__init__(self)
+        self.game = game
+        self.frame = 0
+
+    def poll(self, player):
+        self.frame += 1
+        keys = emptyKeys()
+        playerPos = player.actor.getPos()
+
+        nearest = None
+        nearestDistance = 0
+        for enemy in self.game.enemies:
+            distance = (enemy.actor.getPos() - playerPos).lengthSquared()
+            if nearest is None or distance < nearestDistance:
+                nearest = enemy
+                nearestDistance = distance
+
+        if nearest is None:
+            aimPoint = self.defaultAimPoint(player)
+        else:
+            aimPoint = nearest.actor.getPos()
+            keys["shoot"] = True
+
+        # Where we'd like to go: away from the nearest enemy if
+        # it's close, around the arena otherwise, and back towards
+        # the middle if we're near the walls (and the traps)
+        if nearest is not None and nearestDistance < SAFE_DISTANCE*SAFE_DISTANCE:
+            direction = playerPos - aimPoint
+        else:
+            angle = self.frame*0.02
+            direction = Vec3(math.cos(angle), math.sin(angle), 0)
+        if abs(playerPos.x) > ARENA_LIMIT or abs(playerPos.y) > ARENA_LIMIT:
+            direction = -playerPos
+
+        keys["right"] = direction.x > 0.1
+        keys["left"] = direction.x < -0.1
+        keys["up"] = direction.y > 0.1
+        keys["down"] = direction.y < -0.1
+
+        return keys, aimPoint
+
+
+def countAudioSounds(objects):
+    # AudioSounds aren't tracked by the garbage-collector themselves,
+    # so we count those that tracked objects refer to
+    sounds = set()
+    for obj in objects:
+        for referent in gc.get_referents(obj):
+            if isinstance(referent, AudioSound):
+                sounds.add(id(referent))
+    return len(sounds)
+
+
+def takeStock(game, previousSnapshot):
+    # What's left once a game has been cleaned up.
+    # Returns the figures, and the memory-snapshot (if
+    # "tracemalloc" is running).
+    gc.collect()
+    objects = gc.get_objects()
+
+    stock = {
+        "renderNodes" : render.findAllMatches("**").getNumPaths(),
+        "colliders" : game.cTrav.getNumColliders(),
+        "gameObjects" : sum(1 for obj in objects if isinstance(obj, GameObject)),
+        "pooledEnemies" : len(game.enemyPool.available),
+        "registered" : game.entities.count(),
+        "soundVoices" : game.sounds.getStats()["voices"]
+    }
+    stock["audioSounds"] = countAudioSounds(objects) - stock["soundVoices"]
+    del objects
+
+    snapshot = None
+    if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            # (Not our own records of the games so far)
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>")
+        ))
+        stock["tracedKb"] = sum(stat.size for stat in snapshot.statistics("filename"))/1024.0
+        if previousSnapshot is not None:
+            stock["topAllocations"] = [{
+                "line" : str(stat.traceback),
+                "changeKb" : stat.size_diff/1024.0,
+                "countChange" : stat.count_diff
+            } for stat in snapshot.compare_to(previousSnapshot, "lineno")[:NUM_TOP_ALLOCATIONS]]
+
+    return stock, snapshot
+
+
+def playGame(game, maxFrames):
+    # Play until the bot dies, or we run out of frames;
+    # returns how many frames were played
+    game.startGame()
+    for frame in range(maxFrames):
+        game.taskMgr.step()
+        if game.player.health <= 0:
+            return frame + 1
+    return maxFrames
+
+
+def findGrowth(results, numWarmupGames, memoryToleranceKb):
+    # Returns a line for each figure that grew from one
+    # game to the next, after the warm-up
+    problems = []
+    for previous, current in zip(results[numWarmupGames:], results[numWarmupGames + 1:]):
+        for metric in COUNTED_METRICS:
+            if current[metric] > previous[metric]:
+                problems.append("Game {0}: {1} grew from {2} to {3}".format(current["game"], metric,
+                                                                          previous[metric], current[metric]))
+        if "tracedKb" in current:
+            growth = current["tracedKb"] - previous["tracedKb"]
+            if growth > memoryToleranceKb:
+                problems.append("Game {0}: traced memory grew by {1:.0f}KB".format(current["game"], growth))
+    return problems
+
+
+def getArgument(args, name, default):
+    if name in args:
+        return args[args.index(name) + 1]
+    return default
+
+
+def main(args):
+    numGames = int(getArgument(args, "--games", DEFAULT_GAMES))
+    numWarmupGames = int(getArgument(args, "--warmup-games", DEFAULT_WARMUP_GAMES))
+    maxFrames = int(getArgument(args, "--max-frames", DEFAULT_MAX_FRAMES))
+    memoryToleranceKb = float(getArgument(args, "--memory-tolerance-kb", DEFAULT_MEMORY_TOLERANCE_KB))
+
+    random.seed(int(getArgument(args, "--seed", 0)))
+
+    game = Game(headless = True, batchedHorde = "--unbatched" not in args)
+    game.inputSource = BotInput(game)
+
+    if "--no-tracemalloc" not in args:
+        tracemalloc.start()
+
+    results = []
+    snapshot = None
+    startTime = time.perf_counter()
+    for gameNumber in range(1, numGames + 1):
+        numFrames = playGame(game, maxFrames)
+        score = game.player.score
+        game.cleanup()
+
+        stock, snapshot = takeStock(game, snapshot)
+        stock["game"] = gameNumber
+        stock["frames"] = numFrames
+        stock["score"] = score
+        results.append(stock)
+
+        line = "Game {0:>3}: {1:>5} frames, score {2:>4} | nodes {3:>5}, colliders {4:>3}, objects {5:>4} ({6} pooled, {7} registered), sounds {8:>3} (and {9} voices)".format(
+            gameNumber, numFrames, score, stock["renderNodes"], stock["colliders"],
+            stock["gameObjects"], stock["pooledEnemies"], stock["registered"], stock["audioSounds"],
+            stock["soundVoices"])
+        if "tracedKb" in stock:
+            line += ", traced {0:.0f}KB".format(stock["tracedKb"])
+        print(line)
+        for allocation in stock.get("topAllocations", []):
+            print("    {0:>+9.1f}KB {1:>+6} blocks  {2}".format(allocation["changeKb"], allocation["countChange"],
+                                                            allocation["line"]))
+
+    elapsed = time.perf_counter() - startTime
+    tracemalloc.stop()
+
+    problems = findGrowth(results, numWarmupGames, memoryToleranceKb)
+
+    outputPath = getArgument(args, "--output", None)
+    if outputPath is not None:
+        with open(outputPath, "w") as outputFile:
+            json.dump({"games" : results, "problems" : problems}, outputFile, indent = 2)
+
+    print()
+    print("Played {0} games in {1:.1f}s".format(numGames, elapsed))
+    if len(problems) > 0:
+        print("\n".join(problems))
+        print("Something is leaking!")
+        return 1
+    print("Nothing grew after the first {0} game(s).".format(numWarmupGames))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,202 @@
+
+from panda3d.core import AudioSound
+
+# The sounds that game-objects can ask for by name: the file,
+# how many of that sound may play at once, and its priority
+# (higher is more important) when voices run short. (The game
+# may allow more of a sound than this--one per trap, say--with
+# "setMaxVoicesOfType".)
+SOUND_TYPES = {
+    "uiClick" : ("Sounds/UIClick.ogg", 1, 5),
+    "playerHurt" : ("Sounds/FemaleDmgNoise.ogg", 1, 4),
+    "laserHit" : ("Sounds/laserHit.ogg", 1, 3),
+    "laserNoHit" : ("Sounds/laserNoHit.ogg", 1, 3),
+    "enemyDie" : ("Sounds/enemyDie.ogg", 4, 2),
+    "trapHitsSomething" : ("Sounds/trapHitsSomething.ogg", 3, 2),
+    "enemySpawn" : ("Sounds/enemySpawn.ogg", 2, 1),
+    "enemyAttack" : ("Sounds/enemyAttack.ogg", 4, 1),
+    "trapStop" : ("Sounds/trapStop.ogg", 3, 1),
+    "trapSlide" : ("Sounds/trapSlide.ogg", 4, 1)
+}
+
+# The most sounds that may play at once, of all types
+MAX_VOICES = 16
+
+
+class Voice():
+    # One playable copy of a sound. A sound's voices all
+    # share its decoded data.
+    def __init__(self, name, sound, priority):
+        self.name = name
+        self.sound = sound
+        self.priority = priority
+
+        # The play that this voice is currently used for, if any
+        self.playId = None
+        self.loop = False
+        self.startTime = 0
+
+    def isBusy(self):
+        # A looping sound is busy until stopped; any other
+        # sound is busy until it finishes.
+        if self.playId is None:
+            return False
+        return self.loop or self.sound.status() == AudioSound.PLAYING
+
+
+class SoundManager():
+    # Rather than each game-object holding sounds of its own,
+    # they ask this to play sounds by name. That keeps the
+    # number of copies of each sound small, and limits how
+    # many sounds play at once--per type and overall. When
+    # there's no voice free, a new sound may "steal" one from
+    # a sound of the same or lower priority (the oldest, if
+    # there's a choice); otherwise it simply isn't played.
+    # A looping sound is never stolen from.
+    #
+    # Playing a sound returns an ID, which can be used to stop
+    # it (for looping sounds, especially) or to check on it.
+    # If its voice is later stolen, the ID is just forgotten.
+    def __init__(self, assets, maxVoices = MAX_VOICES):
+        self.assets = assets
+        self.maxVoices = maxVoices
+
+        self.voices = {}
+        self.maxVoicesOfType = {}
+        for name, (soundFile, maxVoicesOfType, priority) in SOUND_TYPES.items():
+            self.voices[name] = []
+            self.maxVoicesOfType[name] = maxVoicesOfType
+
+        self.activeVoices = {}
+        self.nextPlayId = 1
+
+        # Counts of sounds played, of voices stolen,
+        # and of sounds not played for lack of a voice
+        self.numPlayed = 0
+        self.numStolen = 0
+        self.numDropped = 0
+
+    def setMaxVoicesOfType(self, name, maxVoicesOfType):
+        self.maxVoicesOfType[name] = maxVoicesOfType
+
+    def play(self, name, loop = False):
+        soundFile, defaultMaxVoices, priority = SOUND_TYPES[name]
+        maxVoicesOfType = self.maxVoicesOfType[name]
+        voices = self.voices[name]
+
+        numBusy = self.getNumBusy()
+
+        voice = None
+        for candidate in voices:
+            if not candidate.isBusy():
+                voice = candidate
+                break
+
+        if voice is not None and numBusy >= self.maxVoices:
+            # We have a free voice of our own, but
+            # too many sounds are playing overall.
+            if not self.stealVoice(priority):
+                self.numDropped += 1
+                return None
+        elif voice is None:
+            if len(voices) < maxVoicesOfType and numBusy < self.maxVoices:
+                voice = Voice(name, self.assets.makeSound(soundFile), priority)
+                voices.append(voice)
+            elif len(voices) >= maxVoicesOfType:
+                # Too many of this sound: restart the oldest--
+                # unless they're all loops, which play until
+                # whatever started them stops them
+                oneShots = [voice for voice in voices if not voice.loop]
+                if len(oneShots) == 0:
+                    self.numDropped += 1
+                    return None
+                voice = min(oneShots, key = lambda voice: voice.startTime)
+                self.release(voice)
+                self.numStolen += 1
+            elif self.stealVoice(priority):
+                voice = Voice(name, self.assets.makeSound(soundFile), priority)
+                voices.append(voice)
+            else:
+                self.numDropped += 1
+                return None
+
+        # Forget whatever this voice last played
+        if voice.playId is not None:
+            self.activeVoices.pop(voice.playId, None)
+
+        playId = self.nextPlayId
+        self.nextPlayId += 1
+
+        voice.playId = playId
+        voice.loop = loop
+        voice.startTime = globalClock.getFrameTime()
+        voice.sound.setLoop(loop)
+        voice.sound.play()
+
+        self.activeVoices[playId] = voice
+        self.numPlayed += 1
+
+        return playId
+
+    def stealVoice(self, priority):
+        # Stop the oldest of the lowest-priority sounds playing,
+        # so long as it's no more important than "priority".
+        # Looping sounds are never stopped: whatever started one
+        # (a sliding trap, say) expects it to play until it stops
+        # it, and wouldn't know to start it again.
+        victim = None
+        for voices in self.voices.values():
+            for voice in voices:
+                if not voice.isBusy() or voice.loop or voice.priority > priority:
+                    continue
+                if victim is None or voice.priority < victim.priority or \
+                        (voice.priority == victim.priority and voice.startTime < victim.startTime):
+                    victim = voice
+
+        if victim is None:
+            return False
+
+        self.release(victim)
+        self.numStolen += 1
+        return True
+
+    def release(self, voice):
+        if voice.playId is not None:
+            self.activeVoices.pop(voice.playId, None)
+            voice.playId = None
+        voice.sound.stop()
+
+    def stop(self, playId):
+        voice = self.activeVoices.get(playId)
+        if voice is not None:
+            self.release(voice)
+
+    def isPlaying(self, playId):
+        voice = self.activeVoices.get(playId)
+        return voice is not None and voice.isBusy()
+
+    def getNumBusy(self):
+        numBusy = 0
+        for voice in self.activeVoices.values():
+            if voice.isBusy():
+                numBusy += 1
+        return numBusy
+
+    def getSharedSound(self, name):
+        # A single sound for things that insist on holding
+        # one themselves (such as DirectGui's buttons)
+        soundFile, maxVoicesOfType, priority = SOUND_TYPES[name]
+        return self.assets.loadSound(soundFile)
+
+    def getStats(self):
+        return {
+            "played" : self.numPlayed,
+            "stolen" : self.numStolen,
+            "dropped" : self.numDropped,
+            "busy" : self.getNumBusy(),
+            "voices" : sum(len(voices) for voices in self.voices.values())
+        }
+
+    def stopAll(self):
+        for voice in list(self.activeVoices.values()):
+            self.release(voice)
@@ -0,0 +1,147 @@
+
+# A uniform grid over the arena, recording which game-objects are
+# in which cell. Rather than having the collision-traverser test
+# something every frame in case it's needed, we can instead ask
+# the grid, when the moment comes, "what's near here?"--and only
+# look at the few objects in the cells nearby.
+#
+# Objects are filed under the cell that holds their centre; only
+# moving to a different cell costs anything. Queries read the
+# positions of the objects that they find straight from their
+# Actors, so those are always current.
+
+import math
+
+# The width of a cell: a little more than an enemy's reach
+CELL_SIZE = 1.0
+
+
+class SpatialGrid():
+    def __init__(self, cellSize = CELL_SIZE):
+        self.cellSize = cellSize
+
+        # Cell-key -> the objects in that cell
+        self.cells = {}
+        # Object -> its cell-key, radius, and collision-mask
+        # (as in "into"-masks: what it may be hit by)
+        self.entries = {}
+
+        # The largest radius of anything in the grid, which
+        # tells us how far beyond a query to look
+        self.maxRadius = 0
+
+        # How many objects queries have tested, in all
+        self.numTested = 0
+
+    def getCellKey(self, x, y):
+        return (math.floor(x/self.cellSize), math.floor(y/self.cellSize))
+
+    def insert(self, gameObject, x, y, radius, mask):
+        if gameObject in self.entries:
+            self.remove(gameObject)
+
+        cellKey = self.getCellKey(x, y)
+        self.entries[gameObject] = [cellKey, radius, mask]
+        self.cells.setdefault(cellKey, []).append(gameObject)
+
+        if radius > self.maxRadius:
+            self.maxRadius = radius
+
+    def remove(self, gameObject):
+        entry = self.entries.pop(gameObject, None)
+        if entry is None:
+            return
+        cell = self.cells[entry[0]]
+        cell.remove(gameObject)
+        if len(cell) == 0:
+            del self.cells[entry[0]]
+
+    def move(self, gameObject, x, y):
+        self.moveToCell(gameObject, self.getCellKey(x, y))
+
+    def moveToCell(self, gameObject, cellKey):
+        entry = self.entries.get(gameObject)
+        if entry is None or entry[0] == cellKey:
+            return
+
+        cell = self.cells[entry[0]]
+        cell.remove(gameObject)
+        if len(cell) == 0:
+            del self.cells[entry[0]]
+
+        entry[0] = cellKey
+        self.cells.setdefault(cellKey, []).append(gameObject)
+
+    def clear(self):
+        self.cells = {}
+        self.entries = {}
+        self.maxRadius = 0
+
+    def getNearby(self, minX, minY, maxX, maxY, mask):
+        # The objects that match "mask", filed under any cell
+        # that something overlapping the given box could be in
+        margin = self.maxRadius
+        minCellX, minCellY = self.getCellKey(minX - margin, minY - margin)
+        maxCellX, maxCellY = self.getCellKey(maxX + margin, maxY + margin)
+
+        nearby = []
+        for cellX in range(minCellX, maxCellX + 1):
+            for cellY in range(minCellY, maxCellY + 1):
+                cell = self.cells.get((cellX, cellY))
+                if cell is None:
+                    continue
+                for gameObject in cell:
+                    if self.entries[gameObject][2] & mask:
+                        nearby.append(gameObject)
+        return nearby
+
+    def querySegment(self, startX, startY, endX, endY, mask, ignore = None):
+        # The nearest object that matches "mask" and whose
+        # circle the segment passes through, or None.
+        # (In the ground-plane: our characters don't leave it.)
+        nearby = self.getNearby(min(startX, endX), min(startY, endY),
+                                max(startX, endX), max(startY, endY), mask)
+
+        segmentX = endX - startX
+        segmentY = endY - startY
+        segmentLengthSquared = segmentX*segmentX + segmentY*segmentY
+
+        nearest = None
+        nearestFraction = 2.0
+        for gameObject in nearby:
+            if gameObject is ignore:
+                continue
+            self.numTested += 1
+            radius = self.entries[gameObject][1]
+            pos = gameObject.actor.getPos()
+            offsetX = startX - pos.x
+            offsetY = startY - pos.y
+
+            # Solve for where along the segment we first come
+            # within "radius" of the object's centre
+            c = offsetX*offsetX + offsetY*offsetY - radius*radius
+            if c <= 0:
+                # We start inside it
+                fraction = 0.0
+            elif segmentLengthSquared == 0:
+                continue
+            else:
+                b = offsetX*segmentX + offsetY*segmentY
+                discriminant = b*b - segmentLengthSquared*c
+                if b >= 0 or discriminant < 0:
+                    continue
+                fraction = (-b - math.sqrt(discriminant))/segmentLengthSquared
+                if fraction > 1.0:
+                    continue
+
+            if fraction < nearestFraction:
+                nearest = gameObject
+                nearestFraction = fraction
+
+        return nearest
+
+    def getStats(self):
+        return {
+            "objects" : len(self.entries),
+            "cells" : len(self.cells)
+        }
@@ -0,0 +1,221 @@
+
+# A record of each session, frame by frame: how long the frame took,
+# how many enemies there were, how hard the game had become, and
+# what the player did. Records go into a ring-buffer that's allocated
+# once, up front--one fixed-size array per column--so that recording
+# a frame costs only a few stores; when it's full, the oldest frames
+# are overwritten. The buffer is written out on game over, and on
+# quitting, as CSV or JSON.
+#
+# Alongside the frames are log-channels: named, leveled streams of
+# messages for debugging. A message below its channel's level costs
+# only the level-check; the rest are kept (in a bounded buffer of
+# their own) and written out with the frames, rather than printed.
+
+import array, collections, csv, json, os, time
+
+# The values recorded each frame. Counts are as they stand at the
+# end of the frame; kills, damage and laser-time are those of the
+# frame alone.
+COLUMNS = ("frame", "dt", "enemies", "maxEnemies", "spawnInterval", "corpses",
+           "kills", "damageTaken", "laserOnTime")
+# The array-type of each; those not given hold doubles
+COLUMN_TYPES = {
+    "frame" : "q",
+    "enemies" : "l",
+    "maxEnemies" : "l",
+    "corpses" : "l",
+    "kills" : "l"
+}
+
+# Ten minutes at sixty frames per second
+DEFAULT_CAPACITY = 36000
+MAX_LOG_MESSAGES = 10000
+
+OUTPUT_DIRECTORY = "telemetry"
+FORMATS = ("csv", "json")
+
+LEVEL_DEBUG = 10
+LEVEL_INFO = 20
+LEVEL_WARNING = 30
+LEVEL_ERROR = 40
+
+LEVEL_NAMES = {
+    LEVEL_DEBUG : "debug",
+    LEVEL_INFO : "info",
+    LEVEL_WARNING : "warning",
+    LEVEL_ERROR : "error"
+}
+LEVELS = dict((name, level) for level, name in LEVEL_NAMES.items())
+
+
+class LogChannel():
+    def __init__(self, telemetry, name, level):
+        self.telemetry = telemetry
+        self.name = name
+        self.level = level
+
+    def isEnabledFor(self, level):
+        return level >= self.level
+
+    def log(self, level, message, *args):
+        # The message is only formatted (with "args") when
+        # the log is written out
+        if level >= self.level:
+            self.telemetry.addMessage(self.name, level, message, args)
+
+    def debug(self, message, *args):
+        if LEVEL_DEBUG >= self.level:
+            self.telemetry.addMessage(self.name, LEVEL_DEBUG, message, args)
+
+    def info(self, message, *args):
+        if LEVEL_INFO >= self.level:
+            self.telemetry.addMessage(self.name, LEVEL_INFO, message, args)
+
+    def warning(self, message, *args):
+        if LEVEL_WARNING >= self.level:
+            self.telemetry.addMessage(self.name, LEVEL_WARNING, message, args)
+
+    def error(self, message, *args):
+        if LEVEL_ERROR >= self.level:
+            self.telemetry.addMessage(self.name, LEVEL_ERROR, message, args)
+
+
+class Telemetry():
+    def __init__(self, outputFormat = None, capacity = DEFAULT_CAPACITY, logLevel = LEVEL_WARNING,
+                 outputDirectory = OUTPUT_DIRECTORY):
+        # The format to write sessions out in, or None
+        # to keep them in memory only
+        self.outputFormat = outputFormat
+        self.outputDirectory = outputDirectory
+
+        self.capacity = capacity
+        self.columns = {}
+        for name in COLUMNS:
+            column = array.array(COLUMN_TYPES.get(name, "d"))
+            column.frombytes(bytes(column.itemsize*capacity))
+            self.columns[name] = column
+        # The slot that the next frame goes into, and
+        # how many slots hold frames
+        self.nextIndex = 0
+        self.size = 0
+        self.numFrames = 0
+
+        self.logLevel = logLevel
+        self.channels = {}
+        # (Frame, channel-name, level, message, arguments)
+        self.messages = collections.deque(maxlen = MAX_LOG_MESSAGES)
+
+        # The player's running totals, as of the last frame
+        # recorded, so that we can record each frame's share
+        self.lastKills = 0
+        self.lastDamageTaken = 0.0
+        self.lastLaserOnTime = 0.0
+
+        # The paths of the sessions written out, in order
+        self.savedPaths = []
+
+    def getChannel(self, name):
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = LogChannel(self, name, self.logLevel)
+            self.channels[name] = channel
+        return channel
+
+    def addMessage(self, channelName, level, message, args):
+        self.messages.append((self.numFrames, channelName, level, message, args))
+
+    def record(self, game, dt):
+        # Called once per frame, while there's a player
+        player = game.player
+        index = self.nextIndex
+        columns = self.columns
+
+        columns["frame"][index] = self.numFrames
+        columns["dt"][index] = dt
+        columns["enemies"][index] = len(game.enemies)
+        columns["maxEnemies"][index] = game.maxEnemies
+        columns["spawnInterval"][index] = game.spawnInterval
+        columns["corpses"][index] = len(game.deadEnemies)
+        columns["kills"][index] = player.kills - self.lastKills
+        columns["damageTaken"][index] = player.damageTaken - self.lastDamageTaken
+        columns["laserOnTime"][index] = player.laserOnTime - self.lastLaserOnTime
+
+        self.lastKills = player.kills
+        self.lastDamageTaken = player.damageTaken
+        self.lastLaserOnTime = player.laserOnTime
+
+        self.numFrames += 1
+        self.nextIndex = (index + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def getRows(self):
+        # The frames held, oldest first
+        start = (self.nextIndex - self.size) % self.capacity
+        columns = [self.columns[name] for name in COLUMNS]
+        rows = []
+        for offset in range(self.size):
+            index = (start + offset) % self.capacity
+            rows.append([column[index] for column in columns])
+        return rows
+
+    def getMessages(self):
+        return [{
+            "frame" : frame,
+            "channel" : channelName,
+            "level" : LEVEL_NAMES.get(level, str(level)),
+            "message" : message % args if len(args) > 0 else message
+        } for frame, channelName, level, message, args in self.messages]
+
+    def clear(self):
+        # Start a new session
+        self.nextIndex = 0
+        self.size = 0
+        self.numFrames = 0
+        self.messages.clear()
+        self.lastKills = 0
+        self.lastDamageTaken = 0.0
+        self.lastLaserOnTime = 0.0
+
+    def flush(self):
+        # Write the session out (if we've a format to write it
+        # in, and anything to write), and start a new one.
+        # Returns the path written to, or None.
+        if self.outputFormat is None or (self.size == 0 and len(self.messages) == 0):
+            self.clear()
+            return None
+
+        os.makedirs(self.outputDirectory, exist_ok = True)
+        name = "session-" + time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.outputDirectory, name + "." + self.outputFormat)
+        suffix = 1
+        while os.path.exists(path):
+            suffix += 1
+            path = os.path.join(self.outputDirectory, "{0}-{1}.{2}".format(name, suffix, self.outputFormat))
+
+        rows = self.getRows()
+        if self.outputFormat == "json":
+            with open(path, "w") as outputFile:
+                json.dump({
+                    "columns" : COLUMNS,
+                    "framesRecorded" : self.numFrames,
+                    "frames" : rows,
+                    "log" : self.getMessages()
+                }, outputFile)
+        else:
+            with open(path, "w", newline = "") as outputFile:
+                writer = csv.writer(outputFile)
+                writer.writerow(COLUMNS)
+                writer.writerows(rows)
+            # The log goes beside the frames
+            if len(self.messages) > 0:
+                with open(path[:-len(".csv")] + "-log.csv", "w", newline = "") as outputFile:
+                    writer = csv.writer(outputFile)
+                    writer.writerow(("frame", "channel", "level", "message"))
+                    for message in self.getMessages():
+                        writer.writerow((message["frame"], message["channel"], message["level"], message["message"]))
+
+        self.savedPaths.append(path)
+        self.clear()
+        return path
@@ -0,0 +1,241 @@
+
+# Pre-baked textures: our PNGs, decoded ahead of time into Panda's
+# own texture-format (.txo), with their mipmaps already generated
+# and DXT-compressed, so that loading them is little more than
+# reading them from disk--and so that they take less memory.
+#
+#  python TexturePipeline.py                (process anything new or changed)
+#  python TexturePipeline.py --uncompressed (but without compressing them)
+#  python TexturePipeline.py --report       (and compare sizes and load-times)
+#  python TexturePipeline.py --clear
+#
+# Models pick up the processed textures when they're converted by
+# "BamCache.py" (so run this first); the GUI's textures are looked
+# up here by the asset-registry.
+
+import glob, hashlib, json, os, shutil, sys, time
+
+from panda3d.core import Filename, Texture, TexturePool
+
+from BamCache import ROOT_DIR, hashSource
+
+CACHE_DIR = ".texcache"
+MANIFEST_NAME = "manifest.json"
+
+SOURCE_PATTERNS = [
+    "Models/*/texture/**/*.png",
+    "Models/Misc/tex/*.png",
+    "UI/*.png"
+]
+
+# Textures that are never compressed: compression-artefacts
+# are much more obvious on the flat, crisp GUI.
+UNCOMPRESSED_PREFIXES = ("UI/",)
+
+
+def findSources():
+    sourcePaths = set()
+    for pattern in SOURCE_PATTERNS:
+        for path in glob.glob(os.path.join(ROOT_DIR, pattern), recursive = True):
+            sourcePaths.add(os.path.relpath(path, ROOT_DIR).replace(os.sep, "/"))
+    return sorted(sourcePaths)
+
+
+def getRamBytes(texture):
+    # The memory taken by a texture's image, including its mipmaps
+    total = 0
+    for level in range(max(1, texture.getNumRamMipmapImages())):
+        total += texture.getRamMipmapImageSize(level)
+    return total
+
+
+def shouldCompress(sourcePath, compress):
+    return compress and not sourcePath.startswith(UNCOMPRESSED_PREFIXES)
+
+
+def readTexture(path):
+    texture = Texture()
+    if not texture.read(Filename.fromOsSpecific(os.path.join(ROOT_DIR, path))):
+        return None
+    return texture
+
+
+class TexturePipeline():
+    def __init__(self, cacheDir = CACHE_DIR):
+        self.cacheDir = cacheDir
+        self.manifestPath = os.path.join(ROOT_DIR, cacheDir, MANIFEST_NAME)
+
+        # Source-path -> its hash, the processed file made
+        # from it, whether it was to be compressed (and whether
+        # it was), and the sizes before and after
+        self.manifest = {}
+        if os.path.exists(self.manifestPath):
+            try:
+                with open(self.manifestPath) as manifestFile:
+                    self.manifest = json.load(manifestFile)
+            except ValueError:
+                self.manifest = {}
+
+    def getKey(self):
+        # Something that changes whenever any processed texture
+        # does, so that things built from them know to rebuild.
+        if len(self.manifest) == 0:
+            return ""
+        return hashlib.sha256(json.dumps(self.manifest, sort_keys = True).encode("utf-8")).hexdigest()
+
+    def getProcessedPath(self, sourcePath, compress = None):
+        # The processed version of a texture, or None if it
+        # has none, or if what it has is out of date.
+        entry = self.manifest.get(sourcePath)
+        if entry is None:
+            return None
+        # (A texture that couldn't be compressed isn't tried again
+        #  until it changes, or the compression asked for does.
+        #  Entries from before we recorded what was asked for are
+        #  simply rebuilt.)
+        if compress is not None and entry.get("compressionRequested") != compress:
+            return None
+
+        fullSourcePath = os.path.join(ROOT_DIR, sourcePath)
+        if not os.path.exists(fullSourcePath):
+            return None
+        sourceStat = os.stat(fullSourcePath)
+        if entry["size"] != sourceStat.st_size or entry["mtime"] != sourceStat.st_mtime_ns:
+            if hashSource(sourcePath) != entry["hash"]:
+                return None
+
+        if not os.path.exists(os.path.join(ROOT_DIR, entry["txo"])):
+            return None
+
+        return entry["txo"]
+
+    def resolve(self, texturePath):
+        processedPath = self.getProcessedPath(texturePath)
+        if processedPath is None:
+            return texturePath
+        return processedPath
+
+    def applyTo(self, model):
+        # Swap any of a model's textures that we have processed
+        # versions of for those versions.
+        for texture in model.findAllTextures():
+            fullPath = texture.getFullpath().toOsSpecific()
+            if not fullPath:
+                continue
+            sourcePath = os.path.relpath(fullPath, ROOT_DIR).replace(os.sep, "/")
+            processedPath = self.getProcessedPath(sourcePath)
+            if processedPath is None:
+                continue
+            processed = TexturePool.loadTexture(Filename.fromOsSpecific(os.path.join(ROOT_DIR, processedPath)))
+            if processed is not None:
+                model.replaceTexture(texture, processed)
+
+    def build(self, sourcePaths, compress = True):
+        # Process any texture that's new or has changed, and
+        # return the source-paths that were processed.
+        processed = []
+        for sourcePath in sourcePaths:
+            compressThis = shouldCompress(sourcePath, compress)
+            if self.getProcessedPath(sourcePath, compressThis) is not None:
+                continue
+
+            texture = readTexture(sourcePath)
+            if texture is None:
+                print("Couldn't read " + sourcePath)
+                continue
+            sourceRamBytes = getRamBytes(texture)
+
+            texture.generateRamMipmapImages()
+            texture.setMinfilter(Texture.FTLinearMipmapLinear)
+            compressed = False
+            if compressThis:
+                if texture.getNumComponents() == 4:
+                    compressed = texture.compressRamImage(Texture.CMDxt5)
+                else:
+                    compressed = texture.compressRamImage(Texture.CMDxt1)
+                # (Panda may lack a compressor for this format, in
+                #  which case the image is left as it was)
+                if not compressed:
+                    print("Couldn't compress " + sourcePath + "; writing it uncompressed")
+
+            txoPath = self.cacheDir + "/" + os.path.splitext(sourcePath)[0] + ".txo"
+            fullTxoPath = os.path.join(ROOT_DIR, txoPath)
+            os.makedirs(os.path.dirname(fullTxoPath), exist_ok = True)
+            if not texture.write(Filename.fromOsSpecific(fullTxoPath)):
+                print("Couldn't write " + txoPath)
+                continue
+
+            sourceStat = os.stat(os.path.join(ROOT_DIR, sourcePath))
+            self.manifest[sourcePath] = {
+                "size" : sourceStat.st_size,
+                "mtime" : sourceStat.st_mtime_ns,
+                "hash" : hashSource(sourcePath),
+                "txo" : txoPath,
+                "compressionRequested" : compressThis,
+                "compressed" : compressed,
+                "sourceFileBytes" : sourceStat.st_size,
+                "txoFileBytes" : os.path.getsize(fullTxoPath),
+                "sourceRamBytes" : sourceRamBytes,
+                "txoRamBytes" : getRamBytes(texture)
+            }
+            processed.append(sourcePath)
+
+        os.makedirs(os.path.join(ROOT_DIR, self.cacheDir), exist_ok = True)
+        with open(self.manifestPath, "w") as manifestFile:
+            json.dump(self.manifest, manifestFile, indent = 2, sort_keys = True)
+
+        return processed
+
+    def clear(self):
+        shutil.rmtree(os.path.join(ROOT_DIR, self.cacheDir), ignore_errors = True)
+        self.manifest = {}
+
+
+def timeRead(path):
+    TexturePool.releaseAllTextures()
+    startTime = time.perf_counter()
+    readTexture(path)
+    return time.perf_counter() - startTime
+
+
+def report(pipeline, sourcePaths):
+    # File-size, texture-memory and load-time, before and after.
+    # (Memory "after" includes the mipmaps, which add a third
+    #  again unless the texture is compressed.)
+    print("{0:<48} {1:>10} {2:>10} {3:>10} {4:>10} {5:>8} {6:>8}".format(
+          "texture", "png bytes", "txo bytes", "ram before", "ram after", "png ms", "txo ms"))
+    totals = [0, 0, 0, 0, 0.0, 0.0]
+    for sourcePath in sourcePaths:
+        entry = pipeline.manifest.get(sourcePath)
+        if entry is None or pipeline.getProcessedPath(sourcePath) is None:
+            continue
+        row = [entry["sourceFileBytes"], entry["txoFileBytes"],
+               entry["sourceRamBytes"], entry["txoRamBytes"],
+               timeRead(sourcePath)*1000.0, timeRead(entry["txo"])*1000.0]
+        totals = [total + value for total, value in zip(totals, row)]
+        print("{0:<48} {1:>10} {2:>10} {3:>10} {4:>10} {5:>8.1f} {6:>8.1f}".format(sourcePath, *row))
+    print("{0:<48} {1:>10} {2:>10} {3:>10} {4:>10} {5:>8.1f} {6:>8.1f}".format("total", *totals))
+
+
+def main(args):
+    pipeline = TexturePipeline()
+
+    if "--clear" in args:
+        pipeline.clear()
+        print("Cleared " + CACHE_DIR)
+        return 0
+
+    sourcePaths = findSources()
+    processed = pipeline.build(sourcePaths, compress = "--uncompressed" not in args)
+    print("Processed {0} of {1} textures".format(len(processed), len(sourcePaths)))
+    if len(processed) > 0:
+        print("(Run BamCache.py to have the models use them.)")
+
+    if "--report" in args:
+        report(pipeline, sourcePaths)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,48 @@
+
+# The allocation-limits of "MicroBenchmark.py", as a test: the code
+# that runs for every game-object on every simulation-step shouldn't
+# make new objects as it goes (see the note at the top of
+# "GameObject.py"). Run with:
+#
+#  python -m pytest test_allocations.py
+#  python -m unittest test_allocations
+
+import os, unittest
+
+from panda3d.core import loadPrcFileData, Filename
+
+import MicroBenchmark
+
+
+class AllocationTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # (A process only gets the one game.) Panda looks for our
+        # models beside the main script--which here is the test-
+        # runner--so point it at the game's directory.
+        gameDirectory = Filename.fromOsSpecific(os.path.dirname(os.path.abspath(__file__)))
+        loadPrcFileData("test_allocations", "model-path " + gameDirectory.getFullpath())
+        from Game import Game
+        cls.game = Game(headless = True)
+        cls.benchmarks = dict((benchmark.name, benchmark)
+                              for benchmark in MicroBenchmark.buildBenchmarks(cls.game))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.game.cleanup()
+
+    def testAllocationLimits(self):
+        for name, limit in MicroBenchmark.ALLOCATION_LIMITS.items():
+            with self.subTest(name):
+                self.assertLessEqual(self.benchmarks[name].countAllocations(), limit)
+
+    def testCountsRepeat(self):
+        # Counting the same call twice gives the same count
+        for name in MicroBenchmark.ALLOCATION_LIMITS:
+            with self.subTest(name):
+                benchmark = self.benchmarks[name]
+                self.assertEqual(benchmark.countAllocations(), benchmark.countAllocations())
+
+
+if __name__ == "__main__":
+    unittest.main()
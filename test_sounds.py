@@ -0,0 +1,79 @@
+# The sound-manager's voice-limits, with stand-in sounds that
+# play until they're stopped (as real ones would, for a while),
+# rather than Panda's null audio, which finishes at once.
+#
+#  python -m pytest test_sounds.py
+#  python -m unittest test_sounds
+
+import builtins, unittest
+
+from panda3d.core import AudioSound, ClockObject
+
+from SoundManager import SoundManager, MAX_VOICES
+
+
+class StandInSound():
+    def __init__(self):
+        self.playing = False
+
+    def setLoop(self, loop):
+        pass
+
+    def play(self):
+        self.playing = True
+
+    def stop(self):
+        self.playing = False
+
+    def status(self):
+        return AudioSound.PLAYING if self.playing else AudioSound.READY
+
+
+class StandInAssets():
+    def makeSound(self, soundPath):
+        return StandInSound()
+
+
+def setUpModule():
+    # (The sound-manager reads the time from the global clock,
+    #  which ShowBase would otherwise have put in place)
+    if not hasattr(builtins, "globalClock"):
+        builtins.globalClock = ClockObject.getGlobalClock()
+
+
+class SoundManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.sounds = SoundManager(StandInAssets())
+
+    def playBurst(self):
+        # More one-shots than there are voices, of every priority,
+        # a frame apart (so that the oldest is the first played)
+        for i in range(MAX_VOICES*2):
+            for name in ("enemySpawn", "enemyAttack", "trapStop", "enemyDie", "trapHitsSomething",
+                         "laserHit", "laserNoHit", "playerHurt"):
+                globalClock.tick()
+                self.sounds.play(name)
+
+    def testLoopSurvivesBurst(self):
+        slideId = self.sounds.play("trapSlide", loop = True)
+        self.playBurst()
+        self.assertTrue(self.sounds.isPlaying(slideId))
+        self.assertLessEqual(self.sounds.getNumBusy(), MAX_VOICES)
+
+    def testLoopsOfTypeAreNotRestarted(self):
+        # With every voice of the type looping, another
+        # is dropped, rather than silencing one of them
+        self.sounds.setMaxVoicesOfType("trapSlide", 2)
+        slideIds = [self.sounds.play("trapSlide", loop = True) for i in range(2)]
+        self.assertIsNone(self.sounds.play("trapSlide", loop = True))
+        for slideId in slideIds:
+            self.assertTrue(self.sounds.isPlaying(slideId))
+
+    def testOneShotsStillSteal(self):
+        self.playBurst()
+        self.assertGreater(self.sounds.getStats()["stolen"], 0)
+        self.assertEqual(self.sounds.getNumBusy(), MAX_VOICES)
+
+
+if __name__ == "__main__":
+    unittest.main()